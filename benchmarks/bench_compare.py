@@ -0,0 +1,57 @@
+"""
+对比两次 bench_e2e.py 的结果, 有指标退化超过阈值时以非 0 状态退出
+
+python benchmarks/bench_compare.py base.json head.json [--threshold 0.1]
+"""
+import argparse
+import json
+import sys
+from typing import Dict, Iterator, Tuple
+
+# 越小越好的指标, 其余数值指标越大越好
+LOWER_IS_BETTER = ("_ms", "_seconds")
+# 只是测试参数, 不参与对比
+IGNORED = {"events", "rate", "count", "concurrency", "image_count", "image_size", "stream_file_size"}
+
+
+def flatten(data: Dict, prefix: str = "") -> Iterator[Tuple[str, float]]:
+    for key, value in data.items():
+        if isinstance(value, dict):
+            yield from flatten(value, f"{prefix}{key}.")
+        elif isinstance(value, (int, float)) and key not in IGNORED:
+            yield f"{prefix}{key}", float(value)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("base")
+    parser.add_argument("head")
+    parser.add_argument("--threshold", type=float, default=0.1, help="允许的退化比例")
+    args = parser.parse_args()
+
+    with open(args.base, encoding="utf-8") as f:
+        base = json.load(f)
+    with open(args.head, encoding="utf-8") as f:
+        head = json.load(f)
+    base_metrics = dict(flatten(base["results"]))
+    head_metrics = dict(flatten(head["results"]))
+
+    print(f"{'metric':<36} {base.get('revision', 'base'):>12} {head.get('revision', 'head'):>12} {'change':>9}")
+    regressions = []
+    for name, old in base_metrics.items():
+        if name not in head_metrics or not old:
+            continue
+        new = head_metrics[name]
+        change = (new - old) / old
+        worse = change > args.threshold if name.endswith(LOWER_IS_BETTER) else change < -args.threshold
+        mark = "  !" if worse else ""
+        print(f"{name:<36} {old:>12.2f} {new:>12.2f} {change:>+8.1%}{mark}")
+        if worse:
+            regressions.append(name)
+    if regressions:
+        print(f"\n{len(regressions)} metric(s) regressed more than {args.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+事件解码基准测试: 对比改动前的两次校验流程, 以及标准库 json 与快速 json 后端下, 从原始文本到 Event 的吞吐量
+
+python benchmarks/bench_decode.py [-n 20000] [--repeat 5]
+"""
+import argparse
+import gc
+import json
+import time
+from typing import Callable, Optional
+
+from payloads import group_message_json
+
+from nonebot.compat import type_validate_python
+from nonebot.adapters.opqbot import Adapter
+from nonebot.adapters.opqbot import utils
+from nonebot.adapters.opqbot.event import EVENT_CLASSES, Event
+from nonebot.adapters.opqbot.models import MsgBody
+
+
+def legacy_decode(raw: str) -> Optional[Event]:
+    """
+    改动前的 payload_to_event: json.loads 后直接对原始 dict 做模型校验,
+    MessageEvent 的校验器再用原始 MsgBody 校验一次, 最后才检查 MsgBody 是否为空
+    """
+    payload = json.loads(raw)
+    packet = payload.get("CurrentPacket")
+    event_model = EVENT_CLASSES.get(packet.get("EventName", None), None)
+    if event_model is None:
+        return None
+    if body := packet["EventData"].get("MsgBody"):
+        MsgBody(**body)  # 旧校验器中的 Message.build_message(MsgBody(**body))
+    event = type_validate_python(event_model, payload)
+    if event.get_type() == "message" and not event.CurrentPacket.EventData.MsgBody:
+        return None
+    return event
+
+
+def measure(decode: Callable[[str], object], frames: list) -> float:
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        for frame in frames:
+            assert decode(frame) is not None
+        return len(frames) / (time.perf_counter() - start)
+    finally:
+        gc.enable()
+        gc.collect()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=20000, help="事件数量")
+    parser.add_argument("--repeat", type=int, default=5, help="测量轮数")
+    args = parser.parse_args()
+
+    frames = [group_message_json(content=f"message {i}", seq=i) for i in range(args.n)]
+    cases = {
+        "legacy (validate twice)": legacy_decode,
+        "stdlib json + payload_to_event": lambda raw: Adapter.payload_to_event(json.loads(raw)),
+    }
+    if hasattr(Adapter, "json_to_event"):
+        cases[f"{getattr(utils, 'JSON_BACKEND', 'json')} + json_to_event"] = Adapter.json_to_event
+
+    for decode in cases.values():
+        measure(decode, frames[:1000])  # 预热
+    # 各实现轮流测量, 取最快的一轮, 减少机器负载波动的影响
+    best = dict.fromkeys(cases, 0.0)
+    for _ in range(args.repeat):
+        for name, decode in cases.items():
+            best[name] = max(best[name], measure(decode, frames))
+    for name, rate in best.items():
+        print(f"{name:<40} {rate:>10.0f} events/s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""
+端到端基准测试: 在本地模拟的 OPQ 服务上运行适配器, 测量
+
+- 事件吞吐: websocket 推送 -> 解析 -> 分发队列 -> Bot.handle_event
+- 发送延迟: send_group_msg 的 p50/p95/p99 与并发吞吐
+- 上传吞吐: upload_image_voice 与流式 upload_group_file
+
+结果以 json 输出, 可以用 bench_compare.py 对比两次提交
+
+python benchmarks/bench_e2e.py [-n 20000] [--rate 0] [--replay events.jsonl] [-o result.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import struct
+import subprocess
+import sys
+import time
+import zlib
+from typing import Any, Dict, List
+
+from fake_opq import FakeOPQServer
+from payloads import group_message_json
+
+BOT_ID = 10001
+
+
+def png_bytes(size: int, width: int = 640, height: int = 480) -> bytes:
+    """只有文件头有效的 png, 用于上传测试"""
+    ihdr = struct.pack("!IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    chunk = b"IHDR" + ihdr
+    data = b"\x89PNG\r\n\x1a\n" + struct.pack("!I", len(ihdr)) + chunk + struct.pack("!I", zlib.crc32(chunk))
+    return data + os.urandom(max(size - len(data), 0))
+
+
+def percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)]
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(__file__), text=True
+        ).strip()
+    except Exception:
+        return "unknown"
+
+
+async def bench_events(server: FakeOPQServer, frames: List[str], rate: float) -> Dict[str, Any]:
+    from nonebot.message import event_preprocessor
+
+    received = 0
+    done = asyncio.Event()
+
+    @event_preprocessor
+    async def _count() -> None:
+        nonlocal received
+        received += 1
+        if received >= len(frames):
+            done.set()
+
+    start = time.perf_counter()
+    await server.replay(frames, rate)
+    sent = time.perf_counter() - start
+    await asyncio.wait_for(done.wait(), timeout=max(60.0, len(frames) / 100))
+    elapsed = time.perf_counter() - start
+    return {
+        "events": len(frames),
+        "rate": rate,
+        "events_per_sec": len(frames) / elapsed,
+        "replay_seconds": sent,
+        "total_seconds": elapsed,
+    }
+
+
+async def bench_send(bot, count: int, concurrency: int) -> Dict[str, Any]:
+    latencies = []
+    for i in range(count):
+        start = time.perf_counter()
+        await bot.send_group_msg(20001, f"message {i}")
+        latencies.append(time.perf_counter() - start)
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send(i: int) -> None:
+        async with semaphore:
+            await bot.send_group_msg(20001 + i % 50, f"message {i}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(send(i) for i in range(count)))
+    elapsed = time.perf_counter() - start
+    return {
+        "count": count,
+        "latency_p50_ms": percentile(latencies, 0.5) * 1000,
+        "latency_p95_ms": percentile(latencies, 0.95) * 1000,
+        "latency_p99_ms": percentile(latencies, 0.99) * 1000,
+        "latency_mean_ms": statistics.mean(latencies) * 1000,
+        "concurrency": concurrency,
+        "concurrent_msgs_per_sec": count / elapsed,
+    }
+
+
+async def bench_upload(bot, count: int, size: int) -> Dict[str, Any]:
+    images = [png_bytes(size) for _ in range(count)]
+    start = time.perf_counter()
+    for image in images:
+        await bot.upload_image_voice(2, image)
+    image_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    await bot.upload_group_file(20001, "bench.bin", images[0] * 8, stream=True)
+    file_elapsed = time.perf_counter() - start
+    return {
+        "image_count": count,
+        "image_size": size,
+        "images_per_sec": count / image_elapsed,
+        "image_mb_per_sec": count * size / image_elapsed / 1024 / 1024,
+        "stream_file_size": size * 8,
+        "stream_file_mb_per_sec": size * 8 / file_elapsed / 1024 / 1024,
+    }
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    import nonebot
+
+    server = FakeOPQServer(latency=args.latency)
+    await server.start()
+    nonebot.init(
+        driver="~httpx+~websockets",
+        url=server.url,
+        bots=[BOT_ID],
+        log_level="WARNING",
+        opq_rate_limit=False,
+        opq_upload_cache="none",
+        opq_roster_persist=False,
+    )
+    from nonebot.adapters.opqbot import Adapter
+
+    driver = nonebot.get_driver()
+    driver.register_adapter(Adapter)
+    adapter: Adapter = nonebot.get_adapter(Adapter)
+    await adapter.startup()
+    try:
+        await server.wait_connected()
+        while str(BOT_ID) not in adapter.bots:
+            await asyncio.sleep(0.01)
+        bot = adapter.bots[str(BOT_ID)]
+
+        if args.replay:
+            with open(args.replay, encoding="utf-8") as f:
+                frames = [line.strip() for line in f if line.strip()]
+        else:
+            frames = [
+                group_message_json(content=f"message {i}", sender=30001 + i % 200, seq=i)
+                for i in range(args.n)
+            ]
+        results = {
+            "events": await bench_events(server, frames, args.rate),
+            "send": await bench_send(bot, args.sends, args.concurrency),
+            "upload": await bench_upload(bot, args.uploads, args.upload_size),
+        }
+    finally:
+        await adapter.shutdown()
+        await server.stop()
+    return {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "latency": args.latency,
+        "results": results,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=20000, help="推送的事件数量")
+    parser.add_argument("--rate", type=float, default=0, help="每秒推送的事件数, 0 为不限速")
+    parser.add_argument("--replay", help="按行存放事件 json 的文件, 代替合成事件")
+    parser.add_argument("--sends", type=int, default=500, help="发送消息的次数")
+    parser.add_argument("--concurrency", type=int, default=32, help="并发发送数")
+    parser.add_argument("--uploads", type=int, default=50, help="上传图片的次数")
+    parser.add_argument("--upload-size", type=int, default=512 * 1024, help="上传图片的字节数")
+    parser.add_argument("--latency", type=float, default=0.0, help="模拟 OPQ 每个 API 请求的处理时间(秒)")
+    parser.add_argument("-o", "--output", help="结果 json 的保存路径")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text, file=sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
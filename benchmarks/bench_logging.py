@@ -0,0 +1,64 @@
+"""
+日志基准测试: 对比每帧 INFO 记录原始数据与分级/采样日志下, websocket 收包路径的吞吐量
+
+python benchmarks/bench_logging.py [-n 20000]
+"""
+import argparse
+import os
+import time
+from typing import Callable
+
+from payloads import group_message_json
+
+from nonebot.log import logger, default_format
+from nonebot.utils import logger_wrapper
+from nonebot.adapters.opqbot import Adapter
+from nonebot.adapters.opqbot.log import log_sampled, redact, set_log_level
+
+old_log = logger_wrapper("OPQ")
+
+
+def measure(receive: Callable[[str], object], frames: list) -> float:
+    start = time.perf_counter()
+    for frame in frames:
+        receive(frame)
+    return len(frames) / (time.perf_counter() - start)
+
+
+def old_receive(raw: str) -> None:
+    old_log("INFO", raw)
+    Adapter.json_to_event(raw)
+
+
+def new_receive(raw: str) -> None:
+    log_sampled("DEBUG", "ws_frame", lambda: f"收到数据: {redact(raw)}")
+    Adapter.json_to_event(raw)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=20000, help="事件数量")
+    args = parser.parse_args()
+
+    # 日志写到 /dev/null, 只计算格式化与输出的开销
+    logger.remove()
+    devnull = open(os.devnull, "w")
+    logger.add(devnull, level=0, format=default_format, colorize=False)
+
+    frames = [group_message_json(content=f"message {i}", seq=i) for i in range(args.n)]
+    cases = [
+        ("no logging", "INFO", Adapter.json_to_event),
+        ("INFO raw payload per frame", "INFO", old_receive),
+        ("sampled DEBUG, level INFO", "INFO", new_receive),
+        ("sampled DEBUG, level DEBUG", "DEBUG", new_receive),
+    ]
+
+    measure(Adapter.json_to_event, frames[:1000])  # 预热
+    for name, level, receive in cases:
+        set_log_level(level)
+        print(f"{name:<40} {measure(receive, frames):>10.0f} events/s")
+    devnull.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+@ 解析基准测试: 对比逐个 str.partition 与单次线性扫描下, Message.build_message 处理大量 @ 的消息的吞吐量
+
+python benchmarks/bench_mentions.py [-n 20000] [--mentions 1 3 20]
+"""
+import argparse
+import gc
+import time
+from typing import Callable, List, Tuple
+
+from nonebot.adapters.opqbot import Message, MessageSegment
+from nonebot.adapters.opqbot.models import MsgBody
+
+
+def old_build_message(msg_body: MsgBody) -> Message:
+    """改动前的实现, 每个 @ 都对剩余文本做一次 partition"""
+    msg: List[MessageSegment] = []
+    text = msg_body.Content or ""
+    if ats := msg_body.AtUinLists:
+        for at in ats:
+            at_text = f"@{at.Nick}"
+            if at_text in text:
+                before, _, after = text.partition(at_text)
+                if before:
+                    msg.append(MessageSegment.text(before))
+                msg.append(MessageSegment(type="at", data={"uin": at}))
+                text = after
+        if text:
+            msg.append(MessageSegment.text(text))
+    elif text:
+        msg.append(MessageSegment.text(text))
+    return Message(msg)
+
+
+def make_bodies(n: int, mentions: int, reverse: bool = False) -> List[MsgBody]:
+    """
+    每条消息 @ mentions 个人, 其中第一个人在末尾再被 @ 一次
+    每条消息的昵称都不相同, 与真实的群消息一样不能依赖按昵称组合缓存的结果
+    :param reverse: 文本中 @ 的顺序与 AtUinLists 相反
+    """
+    bodies = []
+    for i in range(n):
+        ats = [{"Nick": f"user{i}_{j}", "Uin": 30000 + j, "Uid": f"u_{j}"} for j in range(mentions)]
+        order = ats[::-1] if reverse else ats
+        content = "".join(f"@{at['Nick']} 看看这个消息 {j} " for j, at in enumerate(order + ats[:1]))
+        bodies.append(MsgBody(
+            SubMsgType=0, Content=content, AtUinLists=ats, Images=None, Video=None, Voice=None, File=None, RedBag=None
+        ))
+    return bodies
+
+
+def measure(build: Callable[[MsgBody], Message], bodies: List[MsgBody], repeat: int = 3) -> Tuple[float, int]:
+    """
+    :return: (最快一轮的每秒消息数, 解析出的 at 段数)
+    """
+    best = float("inf")
+    found = 0
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            messages = [build(body) for body in bodies]
+            best = min(best, time.perf_counter() - start)
+            found = sum(segment.type == "at" for message in messages for segment in message)
+            del messages
+            gc.collect()
+    finally:
+        gc.enable()
+    return len(bodies) / best, found
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=20000, help="消息数量")
+    parser.add_argument("--mentions", type=int, nargs="+", default=[1, 3, 20], help="每条消息中 @ 的人数")
+    args = parser.parse_args()
+
+    cases = {
+        "str.partition": old_build_message,
+        "single-pass scan": Message.build_message,
+    }
+    for mentions in args.mentions:
+        expected = args.n * (mentions + 1)
+        for reverse in (False, True):
+            bodies = make_bodies(args.n, mentions, reverse)
+            print(f"{mentions} mentions, {'reversed order' if reverse else 'in order'}:")
+            for build in cases.values():
+                measure(build, bodies[:1000], repeat=1)  # 预热
+            for name, build in cases.items():
+                rate, found = measure(build, bodies)
+                print(f"  {name:<22} {rate:>10.0f} msgs/s {found / expected:>8.1%} mentions kept")
+
+if __name__ == "__main__":
+    main()
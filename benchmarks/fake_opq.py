@@ -0,0 +1,244 @@
+"""
+本地模拟的 OPQ 服务, 只依赖标准库
+
+提供 /ws (推送事件), /v1/LuaApiCaller 与 /v1/upload, 接口返回固定的成功数据,
+用于离线压测适配器。也可以单独运行:
+
+python benchmarks/fake_opq.py --port 8086
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import struct
+import time
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from urllib.parse import urlsplit
+
+_WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+def _ws_frame(data: bytes, opcode: int = 0x1) -> bytes:
+    """服务端发出的帧不需要掩码"""
+    length = len(data)
+    if length < 126:
+        header = struct.pack("!BB", 0x80 | opcode, length)
+    elif length < 1 << 16:
+        header = struct.pack("!BBH", 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack("!BBQ", 0x80 | opcode, 127, length)
+    return header + data
+
+
+async def _read_ws_frame(reader: asyncio.StreamReader) -> Tuple[int, bytes]:
+    first, second = await reader.readexactly(2)
+    length = second & 0x7F
+    if length == 126:
+        (length,) = struct.unpack("!H", await reader.readexactly(2))
+    elif length == 127:
+        (length,) = struct.unpack("!Q", await reader.readexactly(8))
+    mask = await reader.readexactly(4) if second & 0x80 else b""
+    data = await reader.readexactly(length)
+    if mask:
+        data = bytes(b ^ mask[i % 4] for i, b in enumerate(data))
+    return first & 0x0F, data
+
+
+class FakeOPQServer:
+    """
+    :param host: 监听地址
+    :param port: 监听端口, 0 为随机端口
+    :param latency: 每个 API 请求额外等待的秒数, 模拟 OPQ 的处理时间
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.requests: Dict[str, int] = {}  # CgiCmd -> 请求数
+        self.upload_bytes = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._clients: List[asyncio.StreamWriter] = []  # websocket 连接
+        self._connections: Set[asyncio.StreamWriter] = set()  # 所有连接
+        self._handlers: Set[asyncio.Task] = set()  # 处理连接的任务
+        self._connected = asyncio.Event()
+        self._seq = 0
+
+    @property
+    def url(self) -> str:
+        """适配器配置中的 url (IP:PORT)"""
+        return f"{self.host}:{self.port}"
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        for writer in self._connections:
+            writer.close()
+        # 等处理连接的任务读到 EOF 后自行结束, 否则它们会在事件循环退出时被取消并打印 CancelledError
+        handlers, self._handlers = self._handlers, set()
+        if handlers:
+            _, pending = await asyncio.wait(handlers, timeout=5)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def wait_connected(self, timeout: float = 10) -> None:
+        await asyncio.wait_for(self._connected.wait(), timeout)
+
+    async def drop_clients(self) -> None:
+        """断开所有 websocket 连接, 模拟 OPQ 重启"""
+        clients, self._clients = self._clients, []
+        self._connected.clear()
+        for writer in clients:
+            writer.close()
+
+    async def replay(self, frames: Iterable[str], rate: float = 0) -> int:
+        """
+        向所有 websocket 连接推送事件
+        :param frames: 事件的 json 文本
+        :param rate: 每秒推送的事件数, 0 为不限速
+        :return: 推送的事件数
+        """
+        count = 0
+        start = time.perf_counter()
+        for frame in frames:
+            data = _ws_frame(frame.encode())
+            for writer in self._clients:
+                writer.write(data)
+            count += 1
+            if rate:
+                if (delay := start + count / rate - time.perf_counter()) > 0:
+                    await asyncio.sleep(delay)
+            if count % 100 == 0 or rate:
+                for writer in self._clients:
+                    await writer.drain()
+        for writer in self._clients:
+            await writer.drain()
+        return count
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._connections.add(writer)
+        task = asyncio.current_task()
+        self._handlers.add(task)
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    return
+                request_line, *header_lines = head.decode("latin-1").split("\r\n")
+                method, target, _ = request_line.split(" ", 2)
+                headers = {}
+                for line in header_lines:
+                    if ":" in line:
+                        key, value = line.split(":", 1)
+                        headers[key.strip().lower()] = value.strip()
+                path = urlsplit(target).path
+                if headers.get("upgrade", "").lower() == "websocket":
+                    await self._handle_websocket(reader, writer, headers)
+                    return
+                body = await self._read_body(reader, headers)
+                status, data = await self._handle_http(method, path, body)
+                content = json.dumps(data).encode()
+                writer.write(
+                    f"HTTP/1.1 {status} OK\r\nContent-Type: application/json\r\n"
+                    f"Content-Length: {len(content)}\r\nConnection: keep-alive\r\n\r\n".encode()
+                    + content
+                )
+                await writer.drain()
+        finally:
+            self._connections.discard(writer)
+            self._handlers.discard(task)
+            writer.close()
+
+    @staticmethod
+    async def _read_body(reader: asyncio.StreamReader, headers: Dict[str, str]) -> bytes:
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+                if size == 0:
+                    await reader.readuntil(b"\r\n")
+                    return b"".join(chunks)
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+        return await reader.readexactly(int(headers.get("content-length", 0)))
+
+    async def _handle_http(self, method: str, path: str, body: bytes) -> Tuple[int, Dict[str, Any]]:
+        try:
+            payload = json.loads(body) if body else {}
+        except ValueError:
+            return 400, {"CgiBaseResponse": {"Ret": -1, "ErrMsg": "invalid json"}, "ResponseData": None}
+        cmd = payload.get("CgiCmd", path)
+        self.requests[cmd] = self.requests.get(cmd, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if path == "/v1/upload":
+            self.upload_bytes += len(body)
+            data = {
+                "FileMd5": base64.b64encode(hashlib.md5(body).digest()).decode(),
+                "FileSize": len(body),
+                "FileId": self.requests[cmd],
+                "FileToken": "fake",
+            }
+        elif path == "/v1/LuaApiCaller":
+            if cmd == "MessageSvc.PbSendMsg":
+                self._seq += 1
+                data = {"MsgTime": int(time.time()), "MsgSeq": self._seq}
+            elif cmd == "SsoUploadMultiMsg":
+                data = {"ResId": base64.b64encode(hashlib.sha256(body).digest()).decode()}
+            else:
+                data = {}
+        else:
+            return 404, {"CgiBaseResponse": {"Ret": -1, "ErrMsg": "not found"}, "ResponseData": None}
+        return 200, {"CgiBaseResponse": {"Ret": 0, "ErrMsg": ""}, "ResponseData": data}
+
+    async def _handle_websocket(
+            self,
+            reader: asyncio.StreamReader,
+            writer: asyncio.StreamWriter,
+            headers: Dict[str, str],
+    ) -> None:
+        accept = base64.b64encode(hashlib.sha1((headers["sec-websocket-key"] + _WS_GUID).encode()).digest())
+        writer.write(
+            b"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+            b"Sec-WebSocket-Accept: " + accept + b"\r\n\r\n"
+        )
+        await writer.drain()
+        self._clients.append(writer)
+        self._connected.set()
+        try:
+            while True:
+                opcode, data = await _read_ws_frame(reader)
+                if opcode == 0x8:  # close
+                    writer.write(_ws_frame(data[:2], 0x8))
+                    return
+                if opcode == 0x9:  # ping
+                    writer.write(_ws_frame(data, 0xA))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            if writer in self._clients:
+                self._clients.remove(writer)
+
+
+async def _serve(host: str, port: int, latency: float) -> None:
+    server = FakeOPQServer(host, port, latency)
+    await server.start()
+    print(f"Fake OPQ listening on {server.url}")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8086)
+    parser.add_argument("--latency", type=float, default=0.0, help="每个 API 请求额外等待的秒数")
+    args = parser.parse_args()
+    asyncio.run(_serve(args.host, args.port, args.latency))
@@ -0,0 +1,60 @@
+"""基准测试使用的合成 OPQ 事件数据"""
+import json
+from typing import Any, Dict, List, Optional
+
+
+def group_message(
+        content: str = "hello",
+        current_qq: int = 10001,
+        group_id: int = 20001,
+        sender: int = 30001,
+        seq: int = 1,
+        at_users: Optional[List[Dict[str, Any]]] = None,
+) -> Dict[str, Any]:
+    """生成一条 ON_EVENT_GROUP_NEW_MSG 事件"""
+    return {
+        "CurrentPacket": {
+            "EventData": {
+                "MsgHead": {
+                    "FromUin": group_id,
+                    "ToUin": current_qq,
+                    "FromType": 2,
+                    "SenderUin": sender,
+                    "SenderNick": f"user{sender}",
+                    "SenderUid": f"u_{sender}",
+                    "MsgType": 82,
+                    "C2cCmd": 0,
+                    "MsgSeq": seq,
+                    "MsgTime": 1700000000 + seq,
+                    "MsgRandom": seq,
+                    "MsgUid": 7200000000000000000 + seq,
+                    "GroupInfo": {
+                        "GroupCard": "",
+                        "GroupCode": group_id,
+                        "GroupInfoSeq": 1,
+                        "GroupLevel": 1,
+                        "GroupRank": 0,
+                        "GroupType": 0,
+                        "GroupName": f"group{group_id}",
+                    },
+                    "C2CTempMessageHead": None,
+                },
+                "MsgBody": {
+                    "SubMsgType": 0,
+                    "Content": content,
+                    "AtUinLists": at_users,
+                    "Images": None,
+                    "Video": None,
+                    "Voice": None,
+                    "File": None,
+                    "RedBag": None,
+                },
+            },
+            "EventName": "ON_EVENT_GROUP_NEW_MSG",
+        },
+        "CurrentQQ": current_qq,
+    }
+
+
+def group_message_json(**kwargs: Any) -> str:
+    return json.dumps(group_message(**kwargs), ensure_ascii=False)
@@ -1,7 +1,8 @@
 import asyncio
-from typing import Any, Optional, Dict, List, Callable
+import time
+from typing import Any, Optional, Dict, List, Callable, Union, Collection, Mapping
 from typing_extensions import override
-from .log import log
+from .log import log, configure_log, redact
 from nonebot import get_plugin_config
 from nonebot.exception import WebSocketClosed
 from nonebot.utils import DataclassEncoder, escape_tag
@@ -23,10 +24,22 @@ from nonebot.drivers import (
 from nonebot.adapters import Adapter as BaseAdapter
 import json
 from .bot import Bot
-from .event import Event, EVENT_CLASSES, EventType
-from .config import Config
+from .event import Event, EVENT_CLASSES, EventType, MessageEvent
+from .utils import json_loads
+from .config import Config, ServerConfig
+from .cache import UploadCache, DownloadCache, TTLCache, create_upload_cache
+from .session import SessionPool
+from .media import MediaStore
+from .directory import UidIndex
+from .connection import ServerConnection
+from . import metrics
 from .message import Message, MessageSegment
 
+DOWNLOAD_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
+                  "Chrome/127.0.0.0 Safari/537.36 Edg/127.0.0.0"
+}
+
 
 class Adapter(BaseAdapter):
 
@@ -34,10 +47,38 @@ class Adapter(BaseAdapter):
     def __init__(self, driver: Driver, **kwargs: Any):
         super().__init__(driver, **kwargs)
         self.adapter_config = get_plugin_config(Config)
-        self.task: Optional[asyncio.Task] = None  # 存储 ws 任务
-        self.ws_url = f"ws://{self.adapter_config.url}/ws"
-        self.http_url: str = f"http://{self.adapter_config.url}"
-        self.bot_ids: list[int] = self.adapter_config.bots
+        configure_log(self.adapter_config.opq_log_max_length, self.adapter_config.opq_log_sample)
+        self.servers: List[ServerConfig] = self.adapter_config.get_servers()
+        self.connections = [ServerConnection(self, server) for server in self.servers]  # 每个 OPQ 服务一个
+        self.ws_url = self.servers[0].ws_url
+        self.http_url: str = self.servers[0].http_url
+        self.bot_ids: list[int] = [bot_id for server in self.servers for bot_id in server.bots]
+        self.upload_cache: Optional[UploadCache] = create_upload_cache(
+            self.adapter_config.opq_upload_cache,
+            ttl=self.adapter_config.opq_upload_cache_ttl,
+            maxsize=self.adapter_config.opq_upload_cache_size,
+            cache_dir=self.adapter_config.opq_cache_dir,
+        )
+        self.download_cache: Optional[DownloadCache] = None
+        if (config := self.adapter_config).opq_download_cache:
+            self.download_cache = DownloadCache(
+                self.download,
+                cache_dir=config.opq_cache_dir / "downloads" if config.opq_download_cache_disk else None,
+                memory_size=config.opq_download_cache_memory,
+                disk_size=config.opq_download_cache_disk,
+                max_object_size=config.opq_download_max_size,
+                ttl=config.opq_download_cache_ttl,
+            )
+        self.forward_cache: Optional[TTLCache[str]] = None  # 合并转发内容 -> ResId
+        if config.opq_forward_cache_size > 0:
+            self.forward_cache = TTLCache(config.opq_forward_cache_ttl, config.opq_forward_cache_size)
+        self.payload_cache: Optional[TTLCache[Mapping[str, Any]]] = None  # 消息内容 -> 编译好的协议数据
+        if config.opq_payload_cache_size > 0:
+            # 编译结果中含有上传结果, 有效期与上传缓存相同
+            self.payload_cache = TTLCache(config.opq_upload_cache_ttl, config.opq_payload_cache_size)
+        self.media_store: Optional[MediaStore] = None  # 在 setup 中创建, 所有 Bot 共用
+        self.http_sessions: Optional[SessionPool] = None  # 在 setup 中创建, 所有 Bot 共用
+        self.uid_index = UidIndex(self.adapter_config.opq_uid_index_size)  # 所有 Bot 共用
 
         self.setup()
 
@@ -67,9 +108,74 @@ class Adapter(BaseAdapter):
                 "websocket client! "
                 "OPQBot Adapter need a WebSocketClient Driver to work."
             )
+        self.http_sessions = SessionPool(
+            self.driver,
+            pool_size=self.adapter_config.opq_http_pool_size,
+            max_connections_per_host=self.adapter_config.opq_http_max_connections_per_host,
+            keepalive=self.adapter_config.opq_http_keepalive,
+            circuit_failures=self.adapter_config.opq_circuit_failures,
+            circuit_reset=self.adapter_config.opq_circuit_reset,
+        )
+        self.media_store = MediaStore(
+            self.driver,
+            self.adapter_config.opq_cache_dir / "media",
+            quota=self.adapter_config.opq_media_quota,
+            prefetch_concurrency=self.adapter_config.opq_media_prefetch_concurrency,
+        )
         # 在 NoneBot 启动和关闭时进行相关操作
         self.driver.on_startup(self.startup)
         self.driver.on_shutdown(self.shutdown)
+        metrics.REGISTRY.add_collector(self._collect_metrics)
+        if path := self.adapter_config.opq_metrics_path:
+            if isinstance(self.driver, ReverseDriver):
+                self.setup_http_server(
+                    HTTPServerSetup(URL(path), "GET", f"{self.get_name()} Metrics", self._handle_metrics)
+                )
+            else:
+                log(
+                    "WARNING",
+                    f"Current driver {self.config.driver} does not support http server, "
+                    "metrics endpoint is disabled. Use metrics.REGISTRY.render() to export metrics.",
+                )
+
+    async def _handle_metrics(self, request: Request) -> Response:
+        return Response(
+            200,
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+            content=metrics.REGISTRY.render(),
+        )
+
+    def _collect_metrics(self) -> None:
+        """导出前更新连接状态与各个 Bot 的队列长度"""
+        for connection in self.connections:
+            metrics.ws_connected.set(int(connection.connected), server=connection.server.url)
+        for gauge in (metrics.dispatch_queue_depth, metrics.dispatch_in_flight, metrics.send_pending):
+            gauge.clear()
+        for self_id, bot in self.bots.items():
+            stats = bot.dispatcher.stats()
+            metrics.dispatch_queue_depth.set(stats["queue_depth"], bot=self_id)
+            metrics.dispatch_in_flight.set(stats["in_flight"], bot=self_id)
+            if bot.scheduler is not None:
+                metrics.send_pending.set(bot.scheduler.pending, bot=self_id)
+
+    @classmethod
+    def json_to_event(
+            cls,
+            raw: Union[str, bytes],
+            self_ids: Optional[Collection[int]] = None,
+    ) -> Optional[Event]:
+        """解析 websocket 收到的原始数据并转换为 Event
+
+        :param self_ids: 只解析这些 Bot 的事件, 其余直接丢弃
+        """
+        try:
+            payload = json_loads(raw)
+        except Exception as e:
+            log("WARNING", f"Invalid payload: {redact(raw)}", e)
+            return
+        if self_ids is not None and payload.get("CurrentQQ") not in self_ids:
+            return
+        return cls.payload_to_event(payload)
 
     @classmethod
     def payload_to_event(cls, payload: Dict[str, Any]) -> Optional[Event]:
@@ -78,91 +184,73 @@ class Adapter(BaseAdapter):
         Event 模型继承自 pydantic.BaseModel，具体请参考 pydantic 文档
         """
 
+        packet = payload.get('CurrentPacket') or {}
+        event_name = packet.get('EventName', None)
+        received, parsed = metrics.event_counters(event_name)
+        received.value += 1
+        sampled = not received.value % metrics.PARSE_SAMPLE_EVERY
+        start = time.perf_counter() if sampled else 0.0
         # 做一层异常处理，以应对平台事件数据的变更
         try:
-            event_name = payload.get('CurrentPacket').get('EventName', None)
+            # 先根据 EventName 分发, 不需要的事件不做任何模型校验
             event_model = EVENT_CLASSES.get(event_name, None)
             if event_model is None:
+                metrics.events_dropped.inc(event_name=event_name, reason="unsupported")
                 return
-            event = type_validate_python(event_model, payload)
-            if event.get_type() == "message":  # message消息无MsgBody就跳过
-                if not event.CurrentPacket.EventData.MsgBody:
+            if issubclass(event_model, MessageEvent):  # message消息无MsgBody就跳过
+                if not (packet.get('EventData') or {}).get('MsgBody'):
+                    metrics.events_dropped.inc(event_name=event_name, reason="empty")
                     return
+            event = type_validate_python(event_model, payload)
+            parsed.value += 1
+            if sampled:
+                metrics.event_parse_seconds.observe(time.perf_counter() - start, event_name=event_name)
             return event
         except Exception as e:
+            metrics.events_dropped.inc(event_name=event_name, reason="error")
             # 无法正常解析为具体 Event 时，给出日志提示
             log(
                 "WARNING",
-                f"Parse event error: {str(payload)}",
+                f"Parse event error: {redact(payload)}",
+                e,
             )
-            print(e)
             # 也可以尝试转为基础 Event 进行处理
             return
             # return type_validate_python(Event, payload)
 
-    async def _forward_ws(self):
-        request = Request(
+    async def download(self, url: str, headers: Optional[Dict[str, str]] = None) -> Response:
+        """不经过缓存直接下载 url"""
+        return await self.request(Request(
             method="GET",
-            url=self.ws_url,
-        )
-        for bot_id in self.bot_ids:
-            bot = Bot(self, self_id=str(bot_id))
-            self.bot_connect(bot)
-        while True:
-            try:
-                log("INFO", f"Attempting to connect to server at {self.ws_url}")
-                async with self.websocket(request) as ws:
-                    log("SUCCESS", f"Successfully connected to server at {self.ws_url}")
-                    try:
-                        while True:
-                            payload: str = await ws.receive()
-                            log("INFO", payload)
-                            if not payload:
-                                continue
-                            if event := self.payload_to_event(json.loads(payload)):
-                                if event.CurrentQQ not in self.bot_ids:
-                                    return
-
-                                    # bots[event.CurrentQQ] = bot  # 保存所有bot对象
-                                # bot
-                                task = self.bots[str(event.CurrentQQ)].handle_event(event)
-                                asyncio.create_task(task)
-                    except WebSocketClosed as e:
-                        log(
-                            "ERROR",
-                            "<r><bg #f8bbd0>WebSocket Closed</bg #f8bbd0></r>",
-                            e,
-                        )
-                    except Exception as e:
-                        log(
-                            "ERROR",
-                            "<r><bg #f8bbd0>Error while process data from "
-                            "websocket platform_websocket_url. "
-                            "Trying to reconnect...</bg #f8bbd0></r>",
-                            e,
-                        )
-                    finally:
-                        # 这里要断开 Bot 连接
-                        bots = self.bots.copy()
-                        for bot in bots.values():
-                            self.bot_disconnect(bot)
-            except Exception as e:
-                # 尝试重连
-                log(
-                    "ERROR",
-                    "<r><bg #f8bbd0>Error while setup websocket to "
-                    "platform_websocket_url. Trying to reconnect...</bg #f8bbd0></r>",
-                    e,
-                )
-                await asyncio.sleep(3)  # 重连间隔
+            url=url,
+            headers=DOWNLOAD_HEADERS | (headers or {}),
+            timeout=self.adapter_config.opq_download_timeout,
+        ))
+
+    def connection_stats(self) -> List[Dict[str, Any]]:
+        """各个 OPQ 服务的连接状态、重连次数与累计断线时间"""
+        return [connection.stats() for connection in self.connections]
 
     async def startup(self) -> None:
         """定义启动时的操作，例如和平台建立连接"""
-        self.task = asyncio.create_task(self._forward_ws())  # 建立 ws 连接
+        # 每个 OPQ 服务建立一个 ws 连接
+        for connection in self.connections:
+            connection.start()
 
     async def shutdown(self) -> None:
         """定义关闭时的操作，例如停止任务、断开连接"""
 
         # 断开 ws 连接
-        if self.task is not None and not self.task.done():
-            self.task.cancel()
+        for connection in self.connections:
+            bots = connection.bots
+            await connection.stop()
+            for bot in bots:
+                if bot.scheduler is not None:
+                    await bot.scheduler.stop()
+        if self.http_sessions is not None:
+            await self.http_sessions.close()
+        if self.upload_cache is not None:
+            self.upload_cache.close()
+        if self.media_store is not None:
+            await self.media_store.close()
+        metrics.REGISTRY.remove_collector(self._collect_metrics)
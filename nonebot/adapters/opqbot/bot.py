@@ -1,5 +1,9 @@
+import asyncio
+import time
+from functools import partial
 from io import BytesIO
-from typing import Union, Any, TYPE_CHECKING, Optional, List, Annotated
+from types import MappingProxyType
+from typing import Union, Any, TYPE_CHECKING, Optional, List, Annotated, Dict, Tuple, Awaitable, AsyncIterable, Iterable, Mapping
 
 # import bot
 from typing_extensions import override
@@ -18,22 +22,72 @@ from pathlib import Path
 
 if TYPE_CHECKING:
     from .adapter import Adapter
-from .utils import FileType, _resolve_data_type, get_image_size
+from .utils import (
+    FileType, _resolve_data_type, get_image_size, iter_json_with_base64, _T_Stream, _T_Progress, Backoff
+)
+from .cache import make_upload_key, make_forward_key, make_message_key
+from .exception import UploadFailed, NetworkError, ApiTimeout, CircuitOpen, ActionFailed, RateLimited
+from .dispatch import EventDispatcher
+from .ratelimit import OutboundScheduler, Priority, Target, TokenBucket
+from .directory import MemberDirectory, Roster
+from .media import MEDIA_TYPES
 from .models import (
     BaseResponse,
     Response,
     UploadImageVoiceResponse,
     SendMsgResponse,
     UploadForwardMsgResponse,
+    BroadcastResult,
     GetGroupListResponse,
     GetGroupMemberListResponse,
-    MemberLists
+    GetFriendListResponse,
+    MemberInfo,
+    FriendInfo,
 )
-from nonebot.utils import logger_wrapper
+from .models.response import GroupData
+from nonebot.utils import logger_wrapper, escape_tag
 
-from .log import log
+from .log import log, redact
+from . import metrics
 from nonebot.log import logger
 
+# 只读的查询请求, 失败时自动重试
+# SsoGroup.Op / SsoGroup.File 等按 OpCode 区分操作的命令包含写操作, 不在此列,
+# 其中的只读操作需要在调用 post 时传 retry=True
+IDEMPOTENT_CMDS = {
+    "ClusterInfo",
+    "GetGroupLists",
+    "GetFriendLists",
+    "GetGroupMemberLists",
+}
+# ErrMsg 中出现这些文字时视为被限流
+_RATE_LIMIT_HINTS = ("频繁", "频率", "too frequent")
+
+
+def _forward_card(res_id: str, news: List[str], count: int) -> str:
+    """
+    合并转发的 json 卡片
+    :param res_id: SsoUploadMultiMsg 返回的 ResId
+    :param news: 每条消息的概要文本, 卡片上只显示前4条
+    :param count: 消息数
+    """
+    json_template = {"app": "com.tencent.multimsg",
+                     "config": {"autosize": 1, "forward": 1, "round": 1, "type": "normal", "width": 300},
+                     "desc": "[聊天记录]",
+                     "meta": {
+                         "detail":
+                             {
+                                 "news": [{"text": text} for text in news[:4]],
+                                 "resid": res_id,
+                                 "source": "QQ用户的聊天记录",
+                                 "summary": f"查看{count}条转发消息",
+                                 "uniseq": "dcdd7729-7482-4e1a-acd8-1777a314af0f"
+                             }
+                     },
+                     "prompt": "[聊天记录]", "ver": "0.0.0.5",
+                     "view": "contact"}
+    return json.dumps(json_template)
+
 
 
 class Bot(BaseBot):
@@ -44,22 +98,57 @@ class Bot(BaseBot):
 
     @override
     # def __init__(self, adapter: Adapter, self_id: str, **kwargs: Any):
-    def __init__(self, adapter: "Adapter", self_id: str, **kwargs: Any):
+    def __init__(self, adapter: "Adapter", self_id: str, http_url: Optional[str] = None, **kwargs: Any):
         super().__init__(adapter, self_id)
         self.adapter = adapter
-        self.http_url: str = self.adapter.http_url
+        # 所在 OPQ 服务的地址, 未指定时使用第一个服务
+        self.http_url: str = http_url or self.adapter.http_url
         # 一些有关 Bot 的信息也可以在此定义和存储
+        config = self.adapter.adapter_config
+        self._upload_semaphore = asyncio.Semaphore(config.opq_upload_concurrency)
+        self._prefetch_groups = set(config.opq_media_prefetch_groups)
+        self.dispatcher = EventDispatcher(
+            self.handle_event,
+            maxsize=config.opq_dispatch_queue_size,
+            workers=config.opq_dispatch_workers,
+            policy=config.opq_dispatch_overflow,
+            lane_key=config.opq_dispatch_lane,
+            on_drop=lambda _: metrics.dispatch_dropped.inc(bot=self.self_id),
+        )
+        self.members = MemberDirectory(self, ttl=config.opq_member_cache_ttl, uid_index=self.adapter.uid_index)
+        self.roster = Roster(
+            self,
+            ttl=config.opq_roster_ttl,
+            persist_path=config.opq_cache_dir / f"roster_{self_id}.json" if config.opq_roster_persist else None,
+            uid_index=self.adapter.uid_index,
+        )
+        self.scheduler: Optional[OutboundScheduler] = None
+        if config.opq_rate_limit:
+            self.scheduler = OutboundScheduler(
+                bot_rate=config.opq_rate_bot,
+                bot_burst=config.opq_rate_bot_burst,
+                group_rate=config.opq_rate_group,
+                group_burst=config.opq_rate_group_burst,
+                user_rate=config.opq_rate_user,
+                user_burst=config.opq_rate_user_burst,
+            )
 
     async def handle_event(self, event: Union[Event, MessageEvent]) -> None:
         """处理收到的事件。"""
+        self.members.observe(event)
+        self.adapter.uid_index.observe(event)
         if isinstance(event, MessageEvent):
             sender_id = str(event.user_id)
             self_id = str(self.self_id)
 
             if sender_id == self_id:
                 # 🐾 是 Bot 自己发的消息，直接忽略~
-                logger.info(f"忽略了自己发的消息")
+                log("DEBUG", "忽略了自己发的消息")
                 return
+            if event.group_id in self._prefetch_groups:
+                for segment in event.message:
+                    if segment.type in MEDIA_TYPES:
+                        self.adapter.media_store.prefetch(segment.data["Url"], segment.data["FileMd5"])
         await handle_event(self, event)
 
     async def baseRequest(
@@ -70,31 +159,90 @@ class Bot(BaseBot):
             payload: Optional[dict] = None,
             params: Optional[dict] = None,
             timeout: Optional[int] = None,
-    ) -> Optional["Response.ResponseData"]:
-        params = params or {}
-        params["funcname"] = funcname
-        params["qq"] = self.self_id
+            content: Any = None,
+            headers: Optional[dict] = None,
+            retry: Optional[bool] = None,
+    ) -> Any:
+        """
+        发送 API 请求
+        :param retry: 网络错误、超时或被限流时是否重试, 默认只重试 IDEMPOTENT_CMDS 中的只读请求, 写操作需要显式传 True
+        :return: 返回数据中的 ResponseData
+        :raises NetworkError: 无法连接 OPQ 或返回的数据无法解析
+        :raises ApiTimeout: 请求超时
+        :raises RateLimited: 请求过于频繁
+        :raises ActionFailed: 返回的 Ret 不为 0
+        """
+        params = (params or {}) | {"funcname": funcname, "qq": self.self_id}
+        cmd = payload.get("CgiCmd", funcname) if payload else funcname
+        if retry is None:
+            retry = (method == "GET" or cmd in IDEMPOTENT_CMDS) and isinstance(content, (bytes, str, type(None)))
+        config = self.adapter.adapter_config
+        attempts = config.opq_api_retries + 1 if retry else 1
+        backoff = Backoff(config.opq_api_retry_backoff, maximum=5.0)
+        for attempt in range(1, attempts + 1):
+            try:
+                return await self._request(method, cmd, path, payload, params, timeout, content, headers)
+            except (NetworkError, RateLimited) as e:
+                if attempt == attempts or isinstance(e, CircuitOpen):
+                    raise
+                delay = backoff.next_delay()
+                log("WARNING", f"{escape_tag(repr(e))}, retrying in {delay:.2f}s ({attempt}/{attempts - 1})")
+                metrics.api_retries.inc(cmd=cmd)
+                await asyncio.sleep(delay)
 
-        ret = None
-        log("INFO", f"API请求数据: payload:[{payload}]")
+    async def _request(
+            self,
+            method: str,
+            cmd: str,
+            path: str,
+            payload: Optional[dict],
+            params: dict,
+            timeout: Optional[int],
+            content: Any,
+            headers: Optional[dict],
+    ) -> Any:
+        """发送一次请求, 把各种失败转换为对应的异常"""
+        log("DEBUG", lambda: f"API请求 {cmd}: {redact(payload)}")
+        start = time.perf_counter()
         try:
-            resp = await self.adapter.request(Request(
+            resp = await self.adapter.http_sessions.request(self.http_url, Request(
                 method,
                 url=self.http_url + path,
                 params=params,
+                headers=headers,
                 json=payload,
+                content=content,
                 timeout=timeout,
             ))
+        except NetworkError:
+            metrics.api_failures.inc(cmd=cmd)
+            raise
+        except Exception as e:
+            metrics.api_failures.inc(cmd=cmd)
+            # 各个驱动器的超时异常不同, 按名字判断
+            if isinstance(e, asyncio.TimeoutError) or "Timeout" in type(e).__name__:
+                raise ApiTimeout(f"{cmd} timed out after {time.perf_counter() - start:.1f}s") from e
+            raise NetworkError(f"{cmd} failed: {e!r}") from e
+        metrics.api_request_seconds.observe(time.perf_counter() - start, cmd=cmd)
+        if resp.status_code == 429:
+            metrics.api_errors.inc(cmd=cmd, ret=429)
+            raise RateLimited(cmd, 429, "HTTP 429")
+        try:
             ret = json.loads(resp.content)
             resp_model = Response(**ret)
-            if resp_model.CgiBaseResponse.Ret == 0:
-                log("SUCCESS", f"API返回: {ret}")
-            else:
-                log("ERROR", f"API返回: {ret}")
-            return resp_model.ResponseData
         except Exception as e:
-            log("ERROR", f"{e} \r\n API返回：{ret}")
-            return None
+            metrics.api_failures.inc(cmd=cmd)
+            raise NetworkError(
+                f"{cmd} returned HTTP {resp.status_code} with invalid data: {redact(resp.content)}"
+            ) from e
+        base = resp_model.CgiBaseResponse
+        if base.Ret != 0:
+            metrics.api_errors.inc(cmd=cmd, ret=base.Ret)
+            log("ERROR", f"API返回: {redact(ret)}")
+            is_rate_limited = any(hint in str(base.ErrMsg) for hint in _RATE_LIMIT_HINTS)
+            raise (RateLimited if is_rate_limited else ActionFailed)(cmd, base.Ret, str(base.ErrMsg or ""), ret)
+        log("DEBUG", lambda: f"API返回: {redact(ret)}")
+        return resp_model.ResponseData
 
     def build_request(self, request, cmd="MessageSvc.PbSendMsg") -> dict:
         return {"CgiCmd": cmd, "CgiRequest": request}
@@ -106,15 +254,31 @@ class Bot(BaseBot):
             params: Optional[dict] = None,
             path: str = "/v1/LuaApiCaller",
             timeout: Optional[int] = None,
+            priority: Priority = Priority.NORMAL,
+            retry: Optional[bool] = None,
     ):
-        return await self.baseRequest(
+        request = partial(
+            self.baseRequest,
             method="POST",
             funcname=funcname,
             path=path,
             payload=payload,
             params=params,
             timeout=timeout,
+            retry=retry,
         )
+        if self.scheduler is not None and (target := self._send_target(payload)):
+            # 发消息要经过限速调度
+            return await self.scheduler.submit(target, request, priority)
+        return await request()
+
+    @staticmethod
+    def _send_target(payload: dict) -> Optional[Target]:
+        """发送消息请求的目标, 其他请求返回 None"""
+        if payload.get("CgiCmd") != "MessageSvc.PbSendMsg":
+            return None
+        request = payload.get("CgiRequest") or {}
+        return ("group" if request.get("ToType") == 2 else "user", request.get("ToUin"))
 
     async def get(
             self,
@@ -138,16 +302,41 @@ class Bot(BaseBot):
         res = await self.post(request)
         return res
 
-    async def send_like(self, user_uid: str):
+    async def send_like(self, user_uid: Union[str, int]):
         """
         好友点赞
-        :param user_uid: uid(event.Sender.user_uid)
+        :param user_uid: uid(event.Sender.user_uid), 也可以直接传qq号(int 或 event.get_user_id() 返回的数字字符串)
         :return:
         """
+        user_uid = await self.resolve_uid(user_uid)
         request = self.build_request({"Uid": user_uid}, cmd="SsoFriend.Op.Zan")
         res = await self.post(request)
         return res
 
+    async def resolve_uid(self, user_id: Union[str, int], group_id: Optional[int] = None) -> str:
+        """
+        qq号转换为uid
+        优先查询索引, 未命中时才查询该群的成员列表(传了群号时)或好友列表
+        :param user_id: qq号, 纯数字的字符串也视为qq号; 其它字符串视为已经是 uid, 原样返回
+        :param group_id: 所在群号
+        :return: uid
+        """
+        if isinstance(user_id, str):
+            if not user_id.isdigit():
+                return user_id
+            user_id = int(user_id)
+        if uid := self.adapter.uid_index.get_uid(user_id):
+            return uid
+        if group_id:
+            member = await self.members.get_member(group_id, user_id)
+            uid = member.Uid if member else None
+        else:
+            friend = await self.roster.find_friend(user_id)
+            uid = friend.Uid if friend else None
+        if not uid:
+            raise ValueError(f"无法获取 {user_id} 的 uid")
+        return uid
+
     async def get_status(self) -> dict:
         """
         获取OPQ框架信息 (机器人在线列表等等)
@@ -157,11 +346,29 @@ class Bot(BaseBot):
         res = await self.post(request)
         return res
 
-    async def get_group_member_list(self, group_id: int) -> List[MemberLists]:
+    async def get_group_member_list(self, group_id: int, refresh: bool = False) -> List[MemberInfo]:
+        """
+        获取群成员信息, 优先使用缓存
+        :param group_id: 群号(event.group_id)
+        :param refresh: 忽略缓存重新拉取
+        :return: List[MemberInfo]
+        """
+        return await self.members.get_members(group_id, refresh)
+
+    async def get_group_member(self, group_id: int, user_id: int) -> Optional[MemberInfo]:
+        """
+        获取单个群成员信息, 优先使用缓存
+        :param group_id: 群号(event.group_id)
+        :param user_id: qq号(event.user_id)
+        :return: MemberInfo, 不在群内时返回 None
+        """
+        return await self.members.get_member(group_id, user_id)
+
+    async def fetch_group_member_list(self, group_id: int) -> List[MemberInfo]:
         """
-        获取群成员信息
+        不经过缓存, 直接分页拉取群成员信息
         :param group_id: 群号(event.group_id)
-        :return: List[MemberLists]
+        :return: List[MemberInfo]
         """
         lastbuffer = "null"
         memberlist = []
@@ -178,28 +385,62 @@ class Bot(BaseBot):
 
         return memberlist
 
-    async def get_group_list(self) -> GetGroupListResponse:
+    async def get_group_list(self, refresh: bool = False) -> GetGroupListResponse:
         """
-        获取群列表
+        获取群列表, 优先使用缓存
+        :param refresh: 忽略缓存重新拉取
         :return: GetGroupListResponse
         """
+        return GetGroupListResponse.model_construct(GroupLists=await self.roster.get_groups(refresh))
+
+    async def fetch_group_list(self) -> List[GroupData]:
+        """
+        不经过缓存, 直接拉取群列表
+        :return: List[GroupData]
+        """
         request = self.build_request({}, cmd="GetGroupLists")
         res = await self.post(request)
-        return GetGroupListResponse(**res)
+        return GetGroupListResponse(**res).GroupLists
+
+    async def get_friend_list(self, refresh: bool = False) -> List[FriendInfo]:
+        """
+        获取好友列表, 优先使用缓存
+        :param refresh: 忽略缓存重新拉取
+        :return: List[FriendInfo]
+        """
+        return await self.roster.get_friends(refresh)
+
+    async def fetch_friend_list(self) -> List[FriendInfo]:
+        """
+        不经过缓存, 直接分页拉取好友列表
+        :return: List[FriendInfo]
+        """
+        last_uin = 0
+        friends = []
+        while True:
+            request = self.build_request({"LastUin": last_uin}, cmd="GetFriendLists")
+            res = await self.post(request)
+            data = GetFriendListResponse(**res)
+            friends += data.FriendLists
+            if not data.LastUin or not data.FriendLists or data.LastUin == last_uin:
+                break
+            last_uin = data.LastUin
+        return friends
 
     async def set_group_ban(
             self,
             group_id: int,
-            user_uid: str,
+            user_uid: Union[str, int],
             duration: int
     ):
         """
         禁言群组成员
         :param group_id: 群号 (event.group_id)
-        :param user_uid: 成员uid(event.Sender.user_uid)
+        :param user_uid: 成员uid(event.Sender.user_uid), 也可以直接传qq号(int 或 event.get_user_id() 返回的数字字符串)
         :param duration: 禁言秒数 至少60秒 至多30天 禁言一天为24*3600=86400 参数为0解除禁言
         :return:
         """
+        user_uid = await self.resolve_uid(user_uid, group_id)
         payload = {
             "OpCode": 4691,
             "GroupCode": group_id,
@@ -218,7 +459,7 @@ class Bot(BaseBot):
         """
         发送合并转发消息,每条消息只支持一张图,多的图会自动拆分
         :param event: event对象
-        :param messages: 需要组合的message(只支持text和image)
+        :param messages: 需要组合的message(支持text、image、voice、file和嵌套的forward)
         :return: api返回的数据
         """
         if event.__type__ == EventType.GROUP_NEW_MSG:  # 群聊
@@ -240,7 +481,7 @@ class Bot(BaseBot):
     ) -> SendMsgResponse:
         """
         发送群组的合并转发消息,每条消息只支持一张图,多的图会自动拆分
-        :param messages: 需要组合的message(只支持text和image)
+        :param messages: 需要组合的message(支持text、image、voice、file和嵌套的forward)
         :param group_id: 群号(event.group_id)
         :return: api返回的数据
         """
@@ -256,7 +497,7 @@ class Bot(BaseBot):
         """
         发送好友或临时会话的合并转发消息,每条消息只支持一张图,多的图会自动拆分
         :param user_id: qq号(event.user_id)
-        :param messages: 需要组合的message(只支持text和image)
+        :param messages: 需要组合的message(支持text、image、voice、file和嵌套的forward)
         :param group_id: 群号(event.group_id)
         :return: api返回的数据
         """
@@ -266,12 +507,14 @@ class Bot(BaseBot):
     async def send_group_json_msg(
             self,
             group_id: int,
-            json_content: str
+            json_content: str,
+            priority: Priority = Priority.NORMAL,
     ) -> SendMsgResponse:
         """
         发送群组的json消息
         :param group_id: 群号
         :param json_content: json文本(json.dumps({"data":"test"}))
+        :param priority: 发送优先级
         :return: api返回的数据
         """
         payload = {
@@ -282,19 +525,21 @@ class Bot(BaseBot):
         }
 
         request = self.build_request(payload)
-        return await self.post(request)
+        return await self.post(request, priority=priority)
 
     async def send_private_json_msg(
             self,
             user_id: int,
             json_content: str,
-            group_id: Optional[int] = None
+            group_id: Optional[int] = None,
+            priority: Priority = Priority.NORMAL,
     ) -> SendMsgResponse:
         """
         发送好友或临时会话的json消息
         :param user_id: qq号(event.user_id)
         :param json_content: json文本(json.dumps({"data":"test"}))
         :param group_id: 群号
+        :param priority: 发送优先级
         :return: api返回的数据
         """
         payload = {
@@ -306,7 +551,7 @@ class Bot(BaseBot):
         if group_id:
             payload["GroupCode"] = group_id
         request = self.build_request(payload)
-        return await self.post(request)
+        return await self.post(request, priority=priority)
 
     async def build_forward_msg(
             self,
@@ -314,81 +559,97 @@ class Bot(BaseBot):
     ) -> str:
         """
         生成合并转发消息
-        :param messages: message对象(只支持text和image)
+        相同内容的合并转发复用缓存的 ResId; 消息数超过 opq_forward_chunk_size 时拆分并发上传, 再嵌套成多层聊天记录
+        :param messages: message对象(支持text、image、voice、file和嵌套的forward)
         :return: 生成好的json模板
         """
-        json_template = {"app": "com.tencent.multimsg",
-                         "config": {"autosize": 1, "forward": 1, "round": 1, "type": "normal", "width": 300},
-                         "desc": "[聊天记录]",
-                         "meta": {
-                             "detail":
-                                 {
-                                     "news": [
-                                         {"text": "概要1"}, {"text": "概要2"}
-                                     ],
-                                     "resid": "7G6x5GJk07ze2AAjirAywSEYLRqVRj1sU0Pxv9mfmhe/YYqFV2kreIxtoqH+flEV",
-                                     "source": "QQ用户的聊天记录",
-                                     "summary": "查看4条转发消息",
-                                     "uniseq": "dcdd7729-7482-4e1a-acd8-1777a314af0f"
-                                 }
-                         },
-                         "prompt": "[聊天记录]", "ver": "0.0.0.5",
-                         "view": "contact"}
-        msg_bodys = []
-        news = []
-        for message in messages:
-            data = await self._message_to_protocol_data(EventType.GROUP_NEW_MSG, message)
-            if images := data.get("Images"):
-                msg_bodys.append(
-                    {
-                        "Content": data.get("Content"),
-                        "Image": data.get("Images")[0]
-                    },
+        # 并发转换, gather 会保持原有顺序
+        nodes = [
+            node
+            for message_nodes in await asyncio.gather(*(self._forward_nodes(message) for message in messages))
+            for node in message_nodes
+        ]
+        res_id = await self._upload_forward_nodes(nodes)
+        return _forward_card(res_id, [text for _, text in nodes], len(nodes))
+
+    async def _forward_nodes(self, message: Union[Message, MessageSegment, str]) -> List[Tuple[Dict[str, Any], str]]:
+        """
+        把一条 message 转换成合并转发中的若干条消息
+        :return: [(MsgBody, 概要文本)]
+        """
+        message = Message(message)
+        # 嵌套的合并转发、文件、语音各自单独成为一条消息, 排在文字和图片之后
+        content = Message(segment for segment in message if segment.type not in ("forward", "file"))
+        data = await self.compile_message(content)
+        nodes = []
+        text = data.get("Content")
+        if images := data.get("Images"):
+            nodes.append(({"Content": text, "Image": images[0]}, f"QQ用户: {text}[图片]" if text else "QQ用户: [图片]"))
+            nodes.extend(({"Image": image}, "QQ用户: [图片]") for image in images[1:])
+        elif text:
+            nodes.append(({"Content": text}, f"QQ用户: {text}"))
+        if voice := data.get("Voice"):
+            nodes.append(({"Voice": voice}, "QQ用户: [语音]"))
+
+        forwards = []
+        for segment in message:
+            if segment.type == "file":
+                # 合并转发中无法携带文件本身, 以文件名代替
+                name = segment.data.get("filename") or segment.data.get("FileName") or ""
+                nodes.append(({"Content": f"[文件] {name}"}, f"QQ用户: [文件] {name}"))
+            elif segment.type == "forward":
+                forwards.append(self.build_forward_msg(segment.data["messages"]))
+        for card in await asyncio.gather(*forwards):
+            nodes.append(({"SubMsgType": 51, "Content": card}, "QQ用户: [聊天记录]"))
+        return nodes
+
+    async def _upload_forward_nodes(self, nodes: List[Tuple[Dict[str, Any], str]]) -> str:
+        """上传合并转发并返回 ResId, 超过 opq_forward_chunk_size 时先并发上传各分块"""
+        chunk_size = max(self.adapter.adapter_config.opq_forward_chunk_size, 2)
+        while len(nodes) > chunk_size:
+            chunks = [nodes[i:i + chunk_size] for i in range(0, len(nodes), chunk_size)]
+            res_ids = await asyncio.gather(*(self._upload_forward_nodes(chunk) for chunk in chunks))
+            nodes = [
+                (
+                    {"SubMsgType": 51, "Content": _forward_card(res_id, [text for _, text in chunk], len(chunk))},
+                    "QQ用户: [聊天记录]",
                 )
-                if text := data.get("Content"):
-                    news.append({"text": f"QQ用户: {text}[图片]"})
-                else:
-                    news.append({"text": "QQ用户: [图片]"})
-                for image in images[1:]:
-                    msg_bodys.append(
-                        {
-                            "Image": image
-                        },
-                    )
-                    news.append({"text": "QQ用户: [图片]"})
-            else:
-                if text := data.get("Content"):
-                    msg_bodys.append(
-                        {
-                            "Content": text
-                        }
-                    )
-                    news.append({"text": f"QQ用户: {text}"})
-        json_template["meta"]["detail"]["news"] = news[:4]
-        json_template["meta"]["detail"]["summary"] = f"查看{len(msg_bodys)}条转发消息"
+                for res_id, chunk in zip(res_ids, chunks)
+            ]
+        msg_bodys = [body for body, _ in nodes]
+        if (cache := self.adapter.forward_cache) is None:
+            return await self._upload_multi_msg(msg_bodys)
+        return await cache.get_or_create(
+            make_forward_key(self.self_id, msg_bodys), partial(self._upload_multi_msg, msg_bodys)
+        )
 
+    async def _upload_multi_msg(self, msg_bodys: List[Dict[str, Any]]) -> str:
         payload = {
-                      "ToUin": self.self_id,
-                      "ToType": 1,
-                  } | {"MsgBodys": msg_bodys}
-
+            "ToUin": self.self_id,
+            "ToType": 1,
+            "MsgBodys": msg_bodys,
+        }
         request = self.build_request(payload, cmd="SsoUploadMultiMsg")
         res = UploadForwardMsgResponse(**await self.post(request))
-        json_template["meta"]["detail"]["resid"] = res.ResId
-        return json.dumps(json_template)
+        return res.ResId
 
     async def download_to_bytes(self, url: str) -> bytes:
-        """下载文件返回bytes"""
-        req = Request(
-            method="GET",
-            url=url,
-            headers={
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/127.0.0.0 Safari/537.36 Edg/127.0.0.0"},
-            timeout=15
-        )
-        res = await self.adapter.request(req)
+        """下载文件返回bytes, 开启下载缓存时优先使用缓存"""
+        if (cache := self.adapter.download_cache) is not None:
+            return await cache.get(url)
+        res = await self.adapter.download(url)
         return res.content
 
+    async def fetch_media(self, segment: MessageSegment) -> Path:
+        """
+        下载收到的图片、语音或视频, 按 FileMd5 保存在本地, 已下载过时直接返回
+        :param segment: image/voice/video 类型的消息段
+        :return: 本地文件路径
+        """
+        if segment.type not in MEDIA_TYPES:
+            raise ValueError(f"{segment.type} 类型的消息段无法下载")
+        return await self.adapter.media_store.fetch(segment.data["Url"], segment.data["FileMd5"])
+
     async def get_group_file_url(
             self,
             group_id: int,
@@ -408,15 +669,18 @@ class Bot(BaseBot):
             },
             cmd="SsoGroup.File"
         )
-        res = await self.post(request)
+        res = await self.post(request, retry=True)  # 只是查询下载链接, 可以重试
         return res
 
     async def upload_group_file(
             self,
             group_id: int,
             filename: str,
-            file: Union[str, Path, BytesIO, bytes],
+            file: Union[str, Path, BytesIO, bytes, AsyncIterable[bytes]],
             notify: bool = True,
+            stream: bool = False,
+            chunk_size: int = 768 * 1024,
+            progress: Optional[_T_Progress] = None,
     ):
         """
         上传群文件
@@ -424,15 +688,20 @@ class Bot(BaseBot):
         :param filename: 文件名
         :param file: 文件
         :param notify: 推送通知
+        :param stream: 分块读取并流式上传, 内存占用只与 chunk_size 有关, 适合大文件
+        :param chunk_size: 流式上传时每次读取的字节数
+        :param progress: 流式上传的进度回调 progress(已读取字节数, 总字节数或 None)
         :return:
         """
-        data_type, data = _resolve_data_type(file)
         req = {
             "CommandId": 71,
             "FileName": filename,
             "Notify": notify,
             "ToUin": group_id
         }
+        if stream or not isinstance(file, (str, Path, BytesIO, bytes)):
+            return await self._upload_group_file_stream(req, file, chunk_size, progress)
+        data_type, data = _resolve_data_type(file)
         if data_type == FileType.TYPE_URL:
             req["FileUrl"] = data
         elif data_type == FileType.TYPE_BASE64:
@@ -442,7 +711,49 @@ class Bot(BaseBot):
         else:
             raise ValueError("无法识别文件类型")
         request = self.build_request(req, cmd="PicUp.DataUp")
-        res = await self.post(request, path="/v1/upload", funcname="", timeout=120)
+        with metrics.upload_seconds.time(kind="group_file"):
+            res = await self.post(request, path="/v1/upload", funcname="", timeout=120)
+        if "Base64Buf" in req:
+            metrics.upload_bytes.inc(len(req["Base64Buf"]) * 3 // 4, kind="group_file")
+        return res
+
+    async def _upload_group_file_stream(
+            self,
+            req: dict,
+            file: _T_Stream,
+            chunk_size: int,
+            progress: Optional[_T_Progress],
+    ):
+        """边读边编码上传, 不在内存中保留完整的 base64"""
+        if isinstance(file, str) and (file.startswith("http://") or file.startswith("https://")):
+            req["FileUrl"] = file  # url 由 OPQ 自己下载, 无需流式上传
+            request = self.build_request(req, cmd="PicUp.DataUp")
+            return await self.post(request, path="/v1/upload", funcname="", timeout=120)
+        sent = 0
+
+        def on_progress(done: int, total: Optional[int]) -> None:
+            nonlocal sent
+            sent = done
+            if progress is not None:
+                progress(done, total)
+
+        body = iter_json_with_base64(
+            self.build_request(req | {"Base64Buf": None}, cmd="PicUp.DataUp"),
+            "Base64Buf",
+            file,
+            chunk_size=chunk_size,
+            progress=on_progress,
+        )
+        with metrics.upload_seconds.time(kind="group_file"):
+            res = await self.baseRequest(
+                "POST",
+                funcname="",
+                path="/v1/upload",
+                content=body,
+                headers={"Content-Type": "application/json"},
+                timeout=120,
+            )
+        metrics.upload_bytes.inc(sent, kind="group_file")
         return res
 
     async def upload_image_voice(
@@ -456,58 +767,75 @@ class Bot(BaseBot):
         :param file: 资源文件
         :return: api返回的数据
         """
+        cache = self.adapter.upload_cache
+        if isinstance(file, str) and (file.startswith("http://") or file.startswith("https://")):
+            # url 的内容可能变化, 先下载(经过下载缓存的重新验证)再按内容查找上传缓存
+            file = await self.download_to_bytes(file)
+        cache_key = await make_upload_key(command_id, file) if cache is not None else None
+        if cache_key is not None:
+            if cached := await cache.get(cache_key):  # 相同内容已经上传过, 直接复用
+                return cached
         data_type, data = _resolve_data_type(file)
+        # 编码前的原始数据, 用来读取图片尺寸, 避免再解码一次 base64
+        raw = data if isinstance(file, str) else file
         req = {"CommandId": command_id}
-        if data_type == FileType.TYPE_URL:
-            data = await self.download_to_bytes(data)
-            req["Base64Buf"] = base64.b64encode(data).decode()
-        elif data_type == FileType.TYPE_BASE64:
+        if data_type == FileType.TYPE_BASE64:
             req["Base64Buf"] = data
         elif data_type == FileType.TYPE_PATH:
             req["FilePath"] = data
         else:
             raise ValueError("无法识别文件类型")
         request = self.build_request(req, cmd="PicUp.DataUp")
-        res = await self.post(request, path="/v1/upload", funcname="", timeout=60)
+        kind = "image" if command_id in [1, 2] else "voice"
+        with metrics.upload_seconds.time(kind=kind):
+            res = await self.post(request, path="/v1/upload", funcname="", timeout=60)
+        if "Base64Buf" in req:
+            metrics.upload_bytes.inc(len(req["Base64Buf"]) * 3 // 4, kind=kind)
         uploadresponse = UploadImageVoiceResponse(**res)
         if command_id in [1, 2]:  # 上传图片的时候
-            height, width = get_image_size(data)
+            height, width = get_image_size(raw)
             uploadresponse.Height, uploadresponse.Width = height, width
+        if cache_key is not None:
+            await cache.set(cache_key, uploadresponse)
         return uploadresponse
 
     async def send_group_msg(
             self,
             group_id: int,
             message: Union[str, Message, MessageSegment],
+            priority: Priority = Priority.NORMAL,
     ) -> Optional[SendMsgResponse]:
         """
         发送群组消息
         :param message: message对象
         :param group_id: 群号(event.group_id)
+        :param priority: 发送优先级
         :return: api返回的数据
         """
-        data = await self._message_to_protocol_data(EventType.GROUP_NEW_MSG, message)
+        data = await self.compile_message(message)
         payload = {
                       "ToUin": group_id,
                       "ToType": 2,
                   } | data
         request = self.build_request(payload)
-        return await self.post(request)
+        return await self.post(request, priority=priority)
 
     async def send_private_msg(
             self,
             user_id: int,
             message: Union[str, Message, MessageSegment],
-            group_id: Optional[int] = None
+            group_id: Optional[int] = None,
+            priority: Priority = Priority.NORMAL,
     ) -> Optional[SendMsgResponse]:
         """
         发送好友消息与临时会话消息
         :param user_id: qq号(event.user_id)
         :param message: message对象
         :param group_id: 群号(event.group_id)
+        :param priority: 发送优先级
         :return: api返回的数据
         """
-        data = await self._message_to_protocol_data(EventType.GROUP_NEW_MSG, message)
+        data = await self.compile_message(message)
         payload = {
                       "ToUin": user_id,
                       "ToType": 3 if group_id else 1
@@ -515,7 +843,53 @@ class Bot(BaseBot):
         if group_id:
             payload["GroupCode"] = group_id
         request = self.build_request(payload)
-        return await self.post(request)
+        return await self.post(request, priority=priority)
+
+    async def broadcast(
+            self,
+            message: Union[str, Message, MessageSegment],
+            group_ids: Iterable[int] = (),
+            user_ids: Iterable[int] = (),
+            concurrency: int = 16,
+            priority: Priority = Priority.LOW,
+    ) -> List[BroadcastResult]:
+        """
+        向多个群和好友发送同一条消息, 消息只转换和上传一次
+        :param message: message对象
+        :param group_ids: 群号列表
+        :param user_ids: 好友qq号列表
+        :param concurrency: 同时发送的最大数量
+        :param priority: 发送优先级, 默认低于普通消息
+        :return: 每个目标的发送结果, 顺序为先群后好友
+
+        开启 opq_rate_limit 时与其它发送一起排队限速; 未开启时广播自己按
+        opq_rate_bot / opq_rate_bot_burst 限速, 避免一次广播把消息全部瞬间发出
+        """
+        data = await self.compile_message(message)
+        semaphore = asyncio.Semaphore(concurrency)
+        config = self.adapter.adapter_config
+        bucket = TokenBucket(config.opq_rate_bot, config.opq_rate_bot_burst) if self.scheduler is None else None
+
+        async def send_to(target_type: str, target_id: int) -> BroadcastResult:
+            payload = {
+                          "ToUin": target_id,
+                          "ToType": 2 if target_type == "group" else 1,
+                      } | data
+            async with semaphore:
+                if bucket is not None:
+                    await bucket.acquire()
+                try:
+                    res = await self.post(self.build_request(payload), priority=priority)
+                except Exception as e:
+                    return BroadcastResult(
+                        target_type=target_type, target_id=target_id, success=False, error=repr(e)
+                    )
+            return BroadcastResult(target_type=target_type, target_id=target_id, success=True, response=res)
+
+        return await asyncio.gather(
+            *(send_to("group", group_id) for group_id in group_ids),
+            *(send_to("user", user_id) for user_id in user_ids),
+        )
 
     async def revoke_group_msg(
             self,
@@ -538,6 +912,42 @@ class Bot(BaseBot):
         request = self.build_request(payload, cmd="GroupRevokeMsg")
         return await self.post(request)
 
+    async def _upload_limited(
+            self,
+            command_id: int,
+            file: Union[str, Path, BytesIO, bytes],
+    ) -> UploadImageVoiceResponse:
+        """受 opq_upload_concurrency 限制的 upload_image_voice"""
+        async with self._upload_semaphore:
+            return await self.upload_image_voice(command_id, file)
+
+    async def compile_message(
+            self,
+            message: Union[str, Message, MessageSegment],
+            event_type: EventType = EventType.GROUP_NEW_MSG,
+    ) -> Mapping[str, Any]:
+        """
+        把 message 编译成协议数据, 发送时与 ToUin/ToType 合并
+        含图片或语音的消息按内容指纹缓存, 重复发送同一条消息时不再转换和查找上传结果
+        :param message: message对象
+        :param event_type: 决定图片和语音按群组还是好友上传
+        :return: 只读的协议数据, 不要修改其中的内容
+        """
+        message = Message(message)  # 确保是 Message 对象
+
+        async def compile_() -> Mapping[str, Any]:
+            return MappingProxyType(await self._message_to_protocol_data(event_type, message))
+
+        cache = self.adapter.payload_cache
+        if (
+                cache is None
+                # 纯文本消息转换很快, 不缓存以免挤掉真正需要缓存的消息
+                or not any(segment.type in ("image", "voice") for segment in message)
+                or (key := await make_message_key(message)) is None
+        ):
+            return await compile_()
+        return await cache.get_or_create(f"{self.self_id}:{event_type.value}:{key}", compile_)
+
     async def _message_to_protocol_data(
         self,
         event_type: EventType,
@@ -550,8 +960,12 @@ class Bot(BaseBot):
         Content = ""
         images = []
         at_uin_lists = []
+        # images 下标 -> (消息段下标, 上传任务), 上传完成后按下标回填以保持顺序
+        uploads: Dict[int, Tuple[int, Awaitable[UploadImageVoiceResponse]]] = {}
+        voice = None
+        voice_upload: Optional[Tuple[int, Awaitable[UploadImageVoiceResponse]]] = None  # 一条消息只能有一段语音
 
-        for segment in message:
+        for index, segment in enumerate(message):
             if segment.type == "text":
                 Content += segment.data.get("text", "")
             elif segment.type == "image":
@@ -564,17 +978,16 @@ class Bot(BaseBot):
                         "Width": segment.data.get("Width")
                     })
                 else:
-                    img = await self.upload_image_voice(
+                    uploads[len(images)] = (index, self._upload_limited(
                         2 if event_type == EventType.GROUP_NEW_MSG else 1,
                         file=segment.data.get("file")
-                    )
-                    images.append({
-                        "FileId": img.FileId,
-                        "FileMd5": img.FileMd5,
-                        "FileSize": img.FileSize,
-                        "Height": img.Height,
-                        "Width": img.Width,
-                    })
+                    ))
+                    images.append(None)
+            elif segment.type == "voice" and voice_upload is None:
+                voice_upload = (index, self._upload_limited(
+                    29 if event_type == EventType.GROUP_NEW_MSG else 26,
+                    file=segment.data.get("file") or segment.data.get("Url")
+                ))
             elif segment.type == "at":
                 uin = segment.data.get("uin")
                 if uin:
@@ -584,11 +997,38 @@ class Bot(BaseBot):
                 at_uin_lists.append({"Uin": 0})
                 Content += "@全体成员 "
 
+        tasks = [task for _, task in uploads.values()]
+        if voice_upload is not None:
+            tasks.append(voice_upload[1])
+        if tasks:
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+            errors = {}
+            for (image_index, (segment_index, _)), img in zip(uploads.items(), results):
+                if isinstance(img, BaseException):
+                    errors[segment_index] = img
+                    continue
+                images[image_index] = {
+                    "FileId": img.FileId,
+                    "FileMd5": img.FileMd5,
+                    "FileSize": img.FileSize,
+                    "Height": img.Height,
+                    "Width": img.Width,
+                }
+            if voice_upload is not None:
+                if isinstance(res := results[-1], BaseException):
+                    errors[voice_upload[0]] = res
+                else:
+                    voice = {"FileMd5": res.FileMd5, "FileSize": res.FileSize, "FileToken": res.FileToken}
+            if errors:
+                raise UploadFailed(errors)
+
         payload = {
             "Content": Content or None,
             "AtUinLists": at_uin_lists or None,
             "Images": images or None,
         }
+        if voice:
+            payload["Voice"] = voice
         return payload
 
 
@@ -609,13 +1049,15 @@ class Bot(BaseBot):
         if event.__type__ == EventType.GROUP_NEW_MSG:  # 群聊
             return await self.send_group_msg(
                 group_id=event.group_id,
-                message=message
+                message=message,
+                priority=Priority.HIGH,
             )
         elif event.__type__ == EventType.FRIEND_NEW_MSG:  # 好友和私聊
             return await self.send_private_msg(
                 user_id=event.user_id,
                 group_id=event.group_id,
-                message=message
+                message=message,
+                priority=Priority.HIGH,
             )
         else:
             raise ValueError(f"Unknown supped event: {event.__type__}")
@@ -634,7 +1076,7 @@ class Bot(BaseBot):
         if event.message_type == "private":
             raise ValueError(f"unsupported message_type: private")
         else:
-            data = await self._message_to_protocol_data(event.__type__, message)
+            data = await self.compile_message(message, event.__type__)
             payload = {
                           "ToUin": event.group_id if event.message_type == "group" else event.user_id,
                           "ToType": 2 if event.message_type == "group" else 1,
@@ -645,4 +1087,4 @@ class Bot(BaseBot):
                           },
                       } | data
             request = self.build_request(payload)
-            return await self.post(request)
+            return await self.post(request, priority=Priority.HIGH)
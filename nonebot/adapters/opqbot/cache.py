@@ -0,0 +1,618 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from io import BytesIO
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Generic, Iterable, List, Optional, Tuple, TypeVar, Union
+
+from nonebot.drivers import Response
+
+from .exception import NetworkError
+from .log import log
+from .models import UploadImageVoiceResponse
+from .utils import SingleFlight
+
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+V = TypeVar("V")
+
+
+def _hash_file(path: Union[str, Path]) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(_HASH_CHUNK_SIZE):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _hash_bytes(data: Union[bytes, bytearray, memoryview]) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+# (绝对路径, 大小, 修改时间) -> 文件内容的哈希
+_file_digests: "OrderedDict[Tuple[str, int, int], str]" = OrderedDict()
+_FILE_DIGESTS_SIZE = 1024
+_file_flight: "SingleFlight[Tuple[str, int, int], str]" = SingleFlight()
+
+
+async def _digest_file(path: Union[str, Path]) -> str:
+    """
+    文件内容的哈希, 按 (绝对路径, 大小, 修改时间) 记住结果
+    同一个文件在编译消息和上传时只读取一次, 文件被修改后重新计算
+    """
+    stat = os.stat(path)
+    fingerprint = (os.path.realpath(path), stat.st_size, stat.st_mtime_ns)
+    if (digest := _file_digests.get(fingerprint)) is not None:
+        _file_digests.move_to_end(fingerprint)
+        return digest
+    digest = await _file_flight.do(fingerprint, lambda: asyncio.to_thread(_hash_file, path))
+    _file_digests[fingerprint] = digest
+    while len(_file_digests) > _FILE_DIGESTS_SIZE:
+        _file_digests.popitem(last=False)
+    return digest
+
+
+async def _digest_bytes(data: Union[bytes, bytearray, memoryview]) -> str:
+    """较大的数据在线程中计算哈希, 避免阻塞事件循环"""
+    if len(data) < _HASH_CHUNK_SIZE:
+        return _hash_bytes(data)
+    return await asyncio.to_thread(_hash_bytes, data)
+
+
+async def make_upload_key(command_id: int, file: Any) -> Optional[str]:
+    """
+    根据资源内容计算上传缓存的 key, 读取文件和较大数据的哈希计算在线程中进行
+    :param command_id: 上传的 CommandId
+    :param file: upload_image_voice 接收的资源文件
+    :return: key, 无法识别或是 url 时返回 None (url 的内容可能变化, 需要下载后按内容计算)
+    """
+    if isinstance(file, (bytes, bytearray, memoryview)):
+        digest = await _digest_bytes(file)
+    elif isinstance(file, BytesIO):
+        digest = await _digest_bytes(file.getvalue())
+    elif isinstance(file, Path):
+        digest = await _digest_file(file)
+    elif isinstance(file, str):
+        if file.startswith("http://") or file.startswith("https://"):
+            return None
+        elif len(file) < 1000 and not file.startswith("base64://") and Path(file).is_file():
+            digest = await _digest_file(file)
+        else:
+            digest = "b64:" + await _digest_bytes(file.removeprefix("base64://").encode())
+    else:
+        return None
+    return f"{command_id}:{digest}"
+
+
+class UploadCache(ABC):
+    """
+    上传结果缓存, 以 (CommandId, 内容哈希) 为 key 保存 UploadImageVoiceResponse
+    """
+
+    def __init__(self, ttl: float, maxsize: int):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key: str) -> Optional[UploadImageVoiceResponse]:
+        data = await self._get(key)
+        if data is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return UploadImageVoiceResponse(**data)
+
+    async def set(self, key: str, value: UploadImageVoiceResponse) -> None:
+        await self._set(key, value.model_dump())
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self)}
+
+    @abstractmethod
+    async def _get(self, key: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def _set(self, key: str, value: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def clear(self) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class MemoryUploadCache(UploadCache):
+    """内存后端, 进程重启后失效"""
+
+    def __init__(self, ttl: float, maxsize: int):
+        super().__init__(ttl, maxsize)
+        self._data: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+
+    async def _get(self, key: str) -> Optional[Dict[str, Any]]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expire_at, value = item
+        if expire_at < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    async def _set(self, key: str, value: Dict[str, Any]) -> None:
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SqliteUploadCache(UploadCache):
+    """
+    SQLite 磁盘后端, 重启后仍然有效
+    查询和写入都在线程中进行; 命中时的最近使用时间先记在内存中, 攒够一批或下次写入时再写回
+    """
+
+    # 攒够这么多条最近使用时间再写回数据库
+    TOUCH_BATCH = 64
+
+    def __init__(self, path: Union[str, Path], ttl: float, maxsize: int):
+        super().__init__(ttl, maxsize)
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS upload_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "expire_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS upload_cache_accessed ON upload_cache (accessed_at)"
+        )
+        self._conn.commit()
+        # 连接会在不同的线程中使用, 同一时间只允许一个线程访问
+        self._lock = threading.Lock()
+        self._touched: Dict[str, float] = {}  # key -> 还没写回的最近使用时间
+
+    async def _get(self, key: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self._select, key)
+
+    async def _set(self, key: str, value: Dict[str, Any]) -> None:
+        await asyncio.to_thread(self._insert, key, value)
+
+    def _select(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expire_at FROM upload_cache WHERE key = ?", (key,)
+            ).fetchone()
+            now = time.time()
+            if row is None or row[1] < now:
+                return None  # 过期的记录在下次写入时清理
+            self._touched[key] = now
+            if len(self._touched) >= self.TOUCH_BATCH:
+                self._flush_touched()
+                self._conn.commit()
+        return json.loads(row[0])
+
+    def _insert(self, key: str, value: Dict[str, Any]) -> None:
+        now = time.time()
+        with self._lock:
+            self._flush_touched()  # 先写回最近使用时间, 按它淘汰的时候才准确
+            self._conn.execute(
+                "INSERT OR REPLACE INTO upload_cache VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now + self.ttl, now),
+            )
+            self._conn.execute("DELETE FROM upload_cache WHERE expire_at < ?", (now,))
+            overflow = self._count() - self.maxsize
+            if overflow > 0:
+                self._conn.execute(
+                    "DELETE FROM upload_cache WHERE key IN "
+                    "(SELECT key FROM upload_cache ORDER BY accessed_at LIMIT ?)",
+                    (overflow,),
+                )
+            self._conn.commit()
+
+    def _flush_touched(self) -> None:
+        """调用方需要持有 _lock 并负责 commit"""
+        if self._touched:
+            touched, self._touched = self._touched, {}
+            self._conn.executemany(
+                "UPDATE upload_cache SET accessed_at = ? WHERE key = ?",
+                [(accessed_at, key) for key, accessed_at in touched.items()],
+            )
+
+    def _count(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM upload_cache").fetchone()[0]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._touched.clear()
+            self._conn.execute("DELETE FROM upload_cache")
+            self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._count()
+
+    def close(self) -> None:
+        with self._lock:
+            self._flush_touched()
+            self._conn.commit()
+            self._conn.close()
+
+
+def create_upload_cache(
+        backend: str,
+        ttl: float,
+        maxsize: int,
+        cache_dir: Path,
+) -> Optional[UploadCache]:
+    """
+    根据配置创建上传缓存
+    :param backend: memory / sqlite / none
+    """
+    if backend == "memory":
+        return MemoryUploadCache(ttl, maxsize)
+    elif backend == "sqlite":
+        return SqliteUploadCache(cache_dir / "upload_cache.sqlite3", ttl, maxsize)
+    elif backend == "none":
+        return None
+    raise ValueError(f"未知的上传缓存后端: {backend}")
+
+
+def make_forward_key(self_id: str, msg_bodys: List[Dict[str, Any]]) -> str:
+    """根据合并转发的 MsgBodys 计算缓存 key, ResId 只对上传它的账号有效"""
+    content = json.dumps(msg_bodys, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return f"{self_id}:{hashlib.sha256(content.encode()).hexdigest()}"
+
+
+async def make_message_key(message: Iterable[Any]) -> Optional[str]:
+    """
+    根据 Message 的内容计算指纹, 媒体按内容而不是对象计算
+    本地文件的哈希会被记住, 之后上传时计算上传缓存的 key 不再重复读取
+    媒体是 url 时同样返回 None: url 的内容可能变化, 编译结果不能按 url 缓存
+    :return: 指纹, 含有无法识别的数据或 url 媒体时返回 None
+    """
+    sha = hashlib.sha256()
+    for segment in message:
+        sha.update(segment.type.encode())
+        for key, value in sorted(segment.data.items()):
+            if key != "file" and isinstance(value, (str, int, float, bool, type(None))):
+                part = repr(value)
+            elif (part := await make_upload_key(0, value)) is None:
+                return None
+            sha.update(f"\0{key}={part}".encode())
+        sha.update(b"\1")
+    return sha.hexdigest()
+
+
+class TTLCache(Generic[V]):
+    """
+    带有效期的内存 LRU 缓存, 用于合并转发 ResId 与编译好的消息
+    :param ttl: 有效期(秒)
+    :param maxsize: 最大条目数
+    """
+
+    def __init__(self, ttl: float, maxsize: int):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[str, Tuple[float, V]]" = OrderedDict()
+        self._flight: SingleFlight[str, V] = SingleFlight()
+
+    def get(self, key: str) -> Optional[V]:
+        item = self._data.get(key)
+        if item is None or item[0] < time.monotonic():
+            self._data.pop(key, None)
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def set(self, key: str, value: V) -> None:
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    async def get_or_create(self, key: str, create: Callable[[], Awaitable[V]]) -> V:
+        """命中时直接返回, 否则调用 create 并缓存结果; 相同 key 的并发请求只调用一次"""
+        if (value := self.get(key)) is not None:
+            return value
+
+        async def run() -> V:
+            value = await create()
+            self.set(key, value)
+            return value
+
+        return await self._flight.do(key, run)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self)}
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+_MAX_AGE = re.compile(r"max-age=(\d+)")
+
+
+class _DownloadEntry:
+    __slots__ = ("size", "etag", "last_modified", "expire_at")
+
+    def __init__(self, size: int, etag: Optional[str], last_modified: Optional[str], expire_at: float):
+        self.size = size
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expire_at = expire_at  # 时间戳, 之后需要重新验证
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+
+class DownloadCache:
+    """
+    url 下载缓存, 内存与磁盘两级, 按最近使用淘汰
+
+    过期后带 If-None-Match / If-Modified-Since 重新验证, 服务器返回 304 时继续使用缓存;
+    同一个 url 的并发下载只会请求一次。
+    :param fetch: 实际发送请求的函数 fetch(url, headers)
+    :param cache_dir: 磁盘缓存目录, None 时只使用内存
+    :param memory_size: 内存缓存的总字节数上限
+    :param disk_size: 磁盘缓存的总字节数上限
+    :param max_object_size: 超过这个大小的文件不缓存
+    :param ttl: 服务器没有给出 max-age 时, 缓存视为新鲜的秒数
+    """
+
+    def __init__(
+            self,
+            fetch: Callable[[str, Dict[str, str]], Awaitable[Response]],
+            cache_dir: Optional[Path],
+            memory_size: int = 64 * 1024 * 1024,
+            disk_size: int = 512 * 1024 * 1024,
+            max_object_size: int = 20 * 1024 * 1024,
+            ttl: float = 600,
+    ):
+        self.fetch = fetch
+        self.cache_dir = cache_dir
+        self.memory_size = memory_size
+        self.disk_size = disk_size
+        self.max_object_size = max_object_size
+        self.ttl = ttl
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self._entries: Dict[str, _DownloadEntry] = {}
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_used = 0
+        self._disk_used: Optional[int] = None  # 第一次写入磁盘时统计
+        self._evicting = False
+        self._flight: SingleFlight[str, bytes] = SingleFlight()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "revalidated": self.revalidated,
+            "misses": self.misses,
+            "memory_used": self._memory_used,
+            "disk_used": self._disk_used or 0,
+        }
+
+    async def get(self, url: str) -> bytes:
+        """下载 url, 优先使用缓存"""
+        return await self._flight.do(url, lambda: self._get(url))
+
+    async def _get(self, url: str) -> bytes:
+        key = hashlib.sha256(url.encode()).hexdigest()
+        entry = self._entries.get(key)
+        if entry is None and (entry := await asyncio.to_thread(self._load_meta, key)) is not None:
+            self._entries[key] = entry
+        data = None
+        headers = {}
+        if entry is not None:
+            data = await self._read(key)
+            if data is not None and entry.expire_at > time.time():
+                self.hits += 1
+                return data
+            if data is not None:
+                if entry.etag:
+                    headers["If-None-Match"] = entry.etag
+                if entry.last_modified:
+                    headers["If-Modified-Since"] = entry.last_modified
+        try:
+            resp = await self.fetch(url, headers)
+        except Exception as e:
+            raise NetworkError(f"Download {url} failed: {e!r}") from e
+        if resp.status_code == 304 and data is not None:
+            self.revalidated += 1
+            entry.expire_at = self._expire_at(resp)
+            await asyncio.to_thread(self._save_meta, key, entry)
+            return data
+        if not 200 <= resp.status_code < 300:
+            raise NetworkError(f"Download {url} failed: HTTP {resp.status_code}")
+        self.misses += 1
+        content = resp.content or b""
+        if isinstance(content, str):
+            content = content.encode()
+        if len(content) <= self.max_object_size and "no-store" not in resp.headers.get("Cache-Control", ""):
+            entry = _DownloadEntry(
+                len(content), resp.headers.get("ETag"), resp.headers.get("Last-Modified"), self._expire_at(resp)
+            )
+            self._entries[key] = entry
+            self._remember(key, content)
+            if self.cache_dir is not None:
+                await self._write(key, entry, content)
+        return content
+
+    def _expire_at(self, resp: Response) -> float:
+        cache_control = resp.headers.get("Cache-Control", "")
+        if "no-cache" in cache_control:
+            return 0
+        if match := _MAX_AGE.search(cache_control):
+            return time.time() + int(match.group(1))
+        return time.time() + self.ttl
+
+    def _remember(self, key: str, content: bytes) -> None:
+        """放入内存缓存"""
+        if len(content) > self.memory_size:
+            return
+        if (old := self._memory.pop(key, None)) is not None:
+            self._memory_used -= len(old)
+        self._memory[key] = content
+        self._memory_used += len(content)
+        while self._memory_used > self.memory_size:
+            evicted_key, evicted = self._memory.popitem(last=False)
+            self._memory_used -= len(evicted)
+            if self.cache_dir is None:
+                self._entries.pop(evicted_key, None)
+
+    async def _read(self, key: str) -> Optional[bytes]:
+        if (data := self._memory.get(key)) is not None:
+            self._memory.move_to_end(key)
+            return data
+        if self.cache_dir is None:
+            return None
+        data = await asyncio.to_thread(self._read_file, key)
+        if data is not None:
+            self._remember(key, data)
+        return data
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / key
+
+    def _read_file(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+            os.utime(path)  # 以修改时间作为最近使用时间
+            return data
+        except OSError:
+            return None
+
+    def _load_meta(self, key: str) -> Optional[_DownloadEntry]:
+        if self.cache_dir is None:
+            return None
+        try:
+            meta = json.loads(self._path(key).with_suffix(".json").read_text())
+            return _DownloadEntry(**meta)
+        except (OSError, ValueError, TypeError):
+            return None
+
+    def _save_meta(self, key: str, entry: _DownloadEntry) -> None:
+        if self.cache_dir is not None:
+            try:
+                self._path(key).with_suffix(".json").write_text(json.dumps(entry.to_dict()))
+            except OSError as e:
+                log("WARNING", f"Failed to save download cache meta {key}", e)
+
+    # 以下 _write 与 _evict_disk 的统计和淘汰选择都在事件循环中进行,
+    # 线程中只做文件读写, 不访问 _memory / _entries 等共享状态
+
+    async def _write(self, key: str, entry: _DownloadEntry, content: bytes) -> None:
+        if self._disk_used is None:
+            used = await asyncio.to_thread(self._scan_disk)
+            if self._disk_used is None:  # 等待期间可能已经被别的写入统计过
+                self._disk_used = used
+        old_size = await asyncio.to_thread(self._write_file, key, entry, content)
+        if old_size is None:
+            return
+        self._disk_used += len(content) - old_size
+        if self._disk_used > self.disk_size:
+            await self._evict_disk()
+
+    def _scan_disk(self) -> int:
+        """统计磁盘缓存占用的字节数"""
+        return sum(size for _, size, _ in self._list_files())
+
+    def _write_file(self, key: str, entry: _DownloadEntry, content: bytes) -> Optional[int]:
+        """
+        写入文件与元数据
+        :return: 被覆盖的旧文件大小, 写入失败时返回 None
+        """
+        path = self._path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            old_size = path.stat().st_size if path.exists() else 0
+            tmp = path.with_suffix(".tmp")
+            tmp.write_bytes(content)
+            tmp.replace(path)
+        except OSError as e:
+            log("WARNING", f"Failed to write download cache {path}", e)
+            return None
+        self._save_meta(key, entry)
+        return old_size
+
+    def _list_files(self) -> List[Tuple[float, int, Path]]:
+        """列出磁盘缓存文件 (修改时间, 大小, 路径)"""
+        files = []
+        for file in self.cache_dir.glob("*/*"):
+            if file.suffix in (".json", ".tmp"):
+                continue
+            try:
+                stat = file.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, file))
+        return files
+
+    @staticmethod
+    def _remove_files(files: List[Path]) -> List[Path]:
+        """删除文件与元数据, 返回成功删除的文件"""
+        removed = []
+        for file in files:
+            try:
+                file.unlink()
+                file.with_suffix(".json").unlink(missing_ok=True)
+            except OSError:
+                continue
+            removed.append(file)
+        return removed
+
+    async def _evict_disk(self) -> None:
+        """按最近使用时间删除磁盘缓存, 直到占用降到上限的 90%"""
+        if self._evicting:
+            return
+        self._evicting = True
+        try:
+            files = sorted(await asyncio.to_thread(self._list_files))
+            sizes = {}
+            target = self.disk_size * 0.9
+            expected = self._disk_used
+            for _, size, file in files:
+                if expected <= target:
+                    break
+                sizes[file] = size
+                expected -= size
+            for file in await asyncio.to_thread(self._remove_files, list(sizes)):
+                self._disk_used -= sizes[file]
+                self._entries.pop(file.name, None)
+                if (data := self._memory.pop(file.name, None)) is not None:
+                    self._memory_used -= len(data)
+        finally:
+            self._evicting = False
@@ -1,6 +1,139 @@
-from pydantic import Field, BaseModel
+from pathlib import Path
+from typing import List, Literal, Optional
 
+from pydantic import Field, BaseModel, model_validator
 
-class Config(BaseModel):
+
+class ServerConfig(BaseModel):
+    """单个 OPQ 服务"""
+
+    # OPQ 的 IP:PORT
     url: str
-    bots: list[int]
+    # 该服务上登录的 QQ 号
+    bots: List[int]
+
+    @property
+    def ws_url(self) -> str:
+        return f"ws://{self.url}/ws"
+
+    @property
+    def http_url(self) -> str:
+        return f"http://{self.url}"
+
+
+class Config(BaseModel):
+    url: Optional[str] = None
+    bots: List[int] = Field(default_factory=list)
+    # 多个 OPQ 服务, 与 url/bots 可以同时使用
+    opq_servers: List[ServerConfig] = Field(default_factory=list)
+
+    # 缓存文件存放目录
+    opq_cache_dir: Path = Path("cache/opq")
+    # 上传缓存后端 memory/sqlite/none
+    opq_upload_cache: Literal["memory", "sqlite", "none"] = "memory"
+    # 上传缓存有效期(秒)
+    opq_upload_cache_ttl: int = 12 * 3600
+    # 上传缓存最大条目数
+    opq_upload_cache_size: int = 1024
+    # 单个 Bot 同时上传媒体的最大数量
+    opq_upload_concurrency: int = 4
+    # 所有 OPQ 服务合计的最大 HTTP 并发连接数
+    opq_http_pool_size: int = 100
+    # 单个 OPQ 服务的最大 HTTP 并发连接数
+    opq_http_max_connections_per_host: int = 20
+    # 复用 HTTP 长连接
+    opq_http_keepalive: bool = True
+    # 每个 Bot 事件队列的长度
+    opq_dispatch_queue_size: int = 1000
+    # 每个 Bot 处理事件的 worker 数量
+    opq_dispatch_workers: int = 16
+    # 事件队列满时的处理方式 block/drop_oldest/drop_newest
+    opq_dispatch_overflow: Literal["block", "drop_oldest", "drop_newest"] = "block"
+    # 消息事件的顺序通道划分方式 session/group/none
+    opq_dispatch_lane: Literal["session", "group", "none"] = "session"
+    # 发送消息限速
+    opq_rate_limit: bool = False
+    # 每个 Bot 每秒最多发送的消息数与允许的突发数量, 未开启限速时 broadcast 也按这个速率发送
+    opq_rate_bot: float = 3.0
+    opq_rate_bot_burst: int = 10
+    # 每个群每秒最多发送的消息数与允许的突发数量
+    opq_rate_group: float = 1.0
+    opq_rate_group_burst: int = 5
+    # 每个用户每秒最多发送的消息数与允许的突发数量
+    opq_rate_user: float = 1.0
+    opq_rate_user_burst: int = 5
+    # 群成员缓存有效期(秒)
+    opq_member_cache_ttl: int = 600
+    # 群列表与好友列表缓存有效期(秒)
+    opq_roster_ttl: int = 3600
+    # 将群列表与好友列表缓存写入 opq_cache_dir, 重启后继续使用
+    opq_roster_persist: bool = False
+    # qq号与 uid 索引的最大记录数
+    opq_uid_index_size: int = 100000
+    # 断线后第一次重连前的等待秒数, 之后按指数增加
+    opq_reconnect_initial: float = 0.2
+    # 重连间隔上限(秒)
+    opq_reconnect_max: float = 30.0
+    # 超过这么多秒收不到数据时探测服务是否存活, 0 为不探测
+    opq_stall_timeout: float = 60.0
+    # 断线超过这么多秒仍未重连成功才断开 Bot
+    opq_disconnect_grace: float = 30.0
+    # 请求/响应等数据在日志中的最大长度, Base64Buf 只记录长度
+    opq_log_max_length: int = 512
+    # 收到的原始数据等高频 DEBUG 日志每多少条记录一条
+    opq_log_sample: int = 100
+    # 以 Prometheus 文本格式导出指标的路径, 如 /opq/metrics, 需要支持 HTTP 服务端的驱动器
+    opq_metrics_path: Optional[str] = None
+    # 查询等可以重复执行的 API 请求失败后的最大重试次数
+    opq_api_retries: int = 2
+    # 第一次重试前的等待秒数, 之后按指数增加
+    opq_api_retry_backoff: float = 0.2
+    # 单个 OPQ 服务连续失败多少次后熔断, 0 为不熔断
+    opq_circuit_failures: int = 5
+    # 熔断持续的秒数, 之后放行一个请求试探服务是否恢复
+    opq_circuit_reset: float = 30.0
+    # 缓存通过 url 下载的图片等文件
+    opq_download_cache: bool = True
+    # 下载缓存占用的内存上限(字节)
+    opq_download_cache_memory: int = 64 * 1024 * 1024
+    # 下载缓存占用的磁盘上限(字节), 0 为不写入磁盘
+    opq_download_cache_disk: int = 512 * 1024 * 1024
+    # 超过这个大小(字节)的文件不缓存
+    opq_download_max_size: int = 20 * 1024 * 1024
+    # 服务器没有给出 max-age 时缓存视为新鲜的秒数, 之后向服务器重新验证
+    opq_download_cache_ttl: int = 600
+    # 下载超时(秒)
+    opq_download_timeout: float = 15.0
+    # 收到的图片/语音/视频在 opq_cache_dir/media 中的磁盘占用上限(字节)
+    opq_media_quota: int = 1024 * 1024 * 1024
+    # 在后台预先下载这些群收到的图片/语音/视频
+    opq_media_prefetch_groups: List[int] = Field(default_factory=list)
+    # 后台预下载的并发数
+    opq_media_prefetch_concurrency: int = 4
+    # 合并转发 ResId 的缓存条目数, 0 为不缓存
+    opq_forward_cache_size: int = 256
+    # 合并转发 ResId 的缓存有效期(秒)
+    opq_forward_cache_ttl: int = 3600
+    # 合并转发单次上传的最多消息数, 超过时拆分上传后嵌套成多层聊天记录
+    opq_forward_chunk_size: int = 100
+    # 编译好的含图片/语音消息的缓存条目数, 重复发送相同消息时不再重新转换, 0 为不缓存
+    opq_payload_cache_size: int = 256
+
+    @model_validator(mode="after")
+    def check_servers(self) -> "Config":
+        servers = self.get_servers()
+        if not servers:
+            raise ValueError("至少需要配置 url 或 opq_servers")
+        seen = set()
+        for server in servers:
+            if duplicated := seen.intersection(server.bots):
+                raise ValueError(f"QQ {sorted(duplicated)} 配置在了多个 OPQ 服务上")
+            seen.update(server.bots)
+        return self
+
+    def get_servers(self) -> List[ServerConfig]:
+        """所有 OPQ 服务, url/bots 排在最前"""
+        servers = list(self.opq_servers)
+        if self.url is not None:
+            servers.insert(0, ServerConfig(url=self.url, bots=self.bots))
+        return servers
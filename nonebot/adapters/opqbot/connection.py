@@ -0,0 +1,182 @@
+import asyncio
+import time
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+from nonebot.drivers import Request
+from nonebot.exception import WebSocketClosed
+
+from .bot import Bot
+from .config import ServerConfig
+from .log import log, log_sampled, redact
+from .utils import Backoff
+from . import metrics
+
+if TYPE_CHECKING:
+    from .adapter import Adapter
+
+
+class ServerConnection:
+    """
+    单个 OPQ 服务的 websocket 连接, 断开后自动重连
+
+    Bot 对象只创建一次, 断线期间保留; 在 grace 秒内重连成功时 Bot 不会断开,
+    事件队列中尚未处理的事件也会继续处理。长时间收不到数据时通过 HTTP
+    探测服务是否存活, 探测失败则主动断开重连。
+    :param adapter: 所属适配器
+    :param server: OPQ 服务配置
+    """
+
+    def __init__(self, adapter: "Adapter", server: ServerConfig):
+        self.adapter = adapter
+        self.server = server
+        config = adapter.adapter_config
+        self.backoff = Backoff(config.opq_reconnect_initial, config.opq_reconnect_max)
+        self.stall_timeout = config.opq_stall_timeout
+        self.grace = config.opq_disconnect_grace
+        self.bots: List[Bot] = []
+        self.connected = False
+        self.reconnects = 0  # 重连成功的次数
+        self.downtime_total = 0.0  # 累计断线秒数
+        self.last_error: Optional[str] = None
+        self._down_since: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+        self._grace_task: Optional[asyncio.Task] = None
+
+    def stats(self) -> Dict[str, Any]:
+        downtime = self.downtime_total
+        if self._down_since is not None:
+            downtime += time.monotonic() - self._down_since
+        return {
+            "url": self.server.url,
+            "connected": self.connected,
+            "reconnects": self.reconnects,
+            "downtime": downtime,
+            "last_error": self.last_error,
+        }
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """停止重连并断开该服务上的所有 Bot"""
+        for task in (self._task, self._grace_task):
+            if task is not None and not task.done():
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        self._task = self._grace_task = None
+        self.connected = False
+        await self._disconnect_bots()
+
+    def _connect_bots(self) -> None:
+        if self._grace_task is not None:
+            self._grace_task.cancel()
+            self._grace_task = None
+        if not self.bots:
+            self.bots = [
+                Bot(self.adapter, self_id=str(bot_id), http_url=self.server.http_url)
+                for bot_id in self.server.bots
+            ]
+        for bot in self.bots:
+            bot.dispatcher.start()
+            if bot.self_id not in self.adapter.bots:
+                self.adapter.bot_connect(bot)
+
+    async def _disconnect_bots(self) -> None:
+        for bot in self.bots:
+            await bot.dispatcher.stop()
+            if bot.self_id in self.adapter.bots:
+                self.adapter.bot_disconnect(bot)
+
+    async def _disconnect_after_grace(self) -> None:
+        await asyncio.sleep(max(self.grace, 0))
+        log("WARNING", f"{self.server.ws_url} still unreachable after {self.grace}s, disconnecting bots")
+        self._grace_task = None
+        await self._disconnect_bots()
+
+    def _on_connected(self) -> None:
+        self.connected = True
+        if self._down_since is not None:
+            self.downtime_total += time.monotonic() - self._down_since
+            self.reconnects += 1
+            metrics.ws_reconnects.inc(server=self.server.url)
+            self._down_since = None
+        self._connect_bots()
+
+    def _on_disconnected(self, error: Optional[BaseException]) -> None:
+        self.connected = False
+        self.last_error = repr(error) if error is not None else None
+        if self._down_since is None:
+            self._down_since = time.monotonic()
+        if self._grace_task is None and any(bot.self_id in self.adapter.bots for bot in self.bots):
+            self._grace_task = asyncio.create_task(self._disconnect_after_grace())
+
+    async def probe(self) -> bool:
+        """通过 HTTP 接口探测 OPQ 服务是否存活"""
+        params = {"funcname": "MagicCgiCmd"}
+        if self.server.bots:
+            params["qq"] = str(self.server.bots[0])
+        try:
+            resp = await self.adapter.http_sessions.request(self.server.http_url, Request(
+                "POST",
+                url=self.server.http_url + "/v1/LuaApiCaller",
+                params=params,
+                json={"CgiCmd": "ClusterInfo", "CgiRequest": {}},
+                timeout=5,
+            ))
+        except Exception as e:
+            log("WARNING", f"Liveness probe to {self.server.http_url} failed", e)
+            return False
+        return resp.status_code == 200
+
+    async def _receive(self, ws) -> Any:
+        """接收一帧数据, 超过 stall_timeout 没有数据且探测失败时抛出 TimeoutError"""
+        while True:
+            try:
+                return await asyncio.wait_for(ws.receive(), self.stall_timeout or None)
+            except asyncio.TimeoutError:
+                if not await self.probe():
+                    raise
+                log("DEBUG", f"No data from {self.server.ws_url} in {self.stall_timeout}s but server is alive")
+
+    async def _run(self) -> None:
+        request = Request(method="GET", url=self.server.ws_url)
+        while True:
+            error: Optional[BaseException] = None
+            connected_at = None
+            try:
+                log("INFO", f"Attempting to connect to server at {self.server.ws_url}")
+                async with self.adapter.websocket(request) as ws:
+                    log("SUCCESS", f"Successfully connected to server at {self.server.ws_url}")
+                    connected_at = time.monotonic()
+                    self._on_connected()
+                    while True:
+                        payload = await self._receive(ws)
+                        log_sampled("DEBUG", "ws_frame", lambda: f"收到数据: {redact(payload)}")
+                        if not payload:
+                            continue
+                        if event := self.adapter.json_to_event(payload, self.server.bots):
+                            # 放入 Bot 的分发队列, 队列满时按配置阻塞或丢弃
+                            await self.adapter.bots[str(event.CurrentQQ)].dispatcher.put(event)
+            except asyncio.CancelledError:
+                raise
+            except WebSocketClosed as e:
+                error = e
+                log("ERROR", "<r><bg #f8bbd0>WebSocket Closed</bg #f8bbd0></r>", e)
+            except asyncio.TimeoutError as e:
+                error = e
+                log("ERROR", f"<r><bg #f8bbd0>{self.server.ws_url} stalled for {self.stall_timeout}s, "
+                             "reconnecting...</bg #f8bbd0></r>")
+            except Exception as e:
+                error = e
+                log(
+                    "ERROR",
+                    "<r><bg #f8bbd0>Error while connecting or processing data from "
+                    f"{self.server.ws_url}. Trying to reconnect...</bg #f8bbd0></r>",
+                    e,
+                )
+            self._on_disconnected(error)
+            # 稳定连接过一段时间后重新从最短间隔开始退避
+            if connected_at is not None and time.monotonic() - connected_at > self.backoff.maximum:
+                self.backoff.reset()
+            await asyncio.sleep(self.backoff.next_delay())
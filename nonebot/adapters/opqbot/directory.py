@@ -0,0 +1,309 @@
+import asyncio
+import json
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, Generic, Iterable, List, Optional, Tuple, TypeVar
+
+from .event import Event, MessageEvent, GroupMemberExitEvent, GroupMemberJoinEvent
+from .log import log
+from .models import MemberInfo, FriendInfo
+from .models.response import GroupData
+from .utils import SingleFlight
+
+if TYPE_CHECKING:
+    from .bot import Bot
+
+T = TypeVar("T")
+
+
+class UidIndex:
+    """
+    qq号(Uin) 与 Uid 的双向索引, 从收到的事件和成员列表中被动收集
+    超出容量时淘汰最久未使用的记录
+    :param maxsize: 最大记录数
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._uid_by_uin: "OrderedDict[int, str]" = OrderedDict()
+        self._uin_by_uid: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._uid_by_uin)
+
+    def add(self, uin: Optional[int], uid: Optional[str]) -> None:
+        if not uin or not uid:
+            return
+        if (old_uid := self._uid_by_uin.get(uin)) is not None:
+            self._uid_by_uin.move_to_end(uin)
+            if old_uid == uid:
+                return
+            self._uin_by_uid.pop(old_uid, None)
+        self._uid_by_uin[uin] = uid
+        self._uin_by_uid[uid] = uin
+        while len(self._uid_by_uin) > self.maxsize:
+            _, evicted = self._uid_by_uin.popitem(last=False)
+            self._uin_by_uid.pop(evicted, None)
+
+    def get_uid(self, uin: int) -> Optional[str]:
+        if (uid := self._uid_by_uin.get(uin)) is not None:
+            self._uid_by_uin.move_to_end(uin)
+        return uid
+
+    def get_uin(self, uid: str) -> Optional[int]:
+        if (uin := self._uin_by_uid.get(uid)) is not None:
+            self._uid_by_uin.move_to_end(uin)
+        return uin
+
+    def observe(self, event: Event) -> None:
+        """从消息事件的发送者和 @ 列表中收集"""
+        if not isinstance(event, MessageEvent):
+            return
+        event_data = event.CurrentPacket.EventData
+        self.add(event_data.MsgHead.SenderUin, event_data.MsgHead.SenderUid)
+        if event_data.MsgBody and event_data.MsgBody.AtUinLists:
+            for at_user in event_data.MsgBody.AtUinLists:
+                self.add(at_user.Uin, at_user.Uid)
+
+
+class _GroupMembers:
+    __slots__ = ("by_uin", "expire_at")
+
+    def __init__(self, members: List[MemberInfo], ttl: float):
+        self.by_uin: Dict[int, MemberInfo] = {member.Uin: member for member in members}
+        self.expire_at = time.monotonic() + ttl
+
+
+class MemberDirectory:
+    """
+    群成员缓存, 每个 Bot 一个
+    按 (群号, qq号) 和 Uid 索引, 过期后在下次访问时重新拉取,
+    同一个群的并发拉取只会请求一次
+    :param bot: 所属 Bot
+    :param ttl: 缓存有效期(秒)
+    """
+
+    def __init__(self, bot: "Bot", ttl: float, uid_index: Optional[UidIndex] = None):
+        self.bot = bot
+        self.ttl = ttl
+        self.uid_index = uid_index
+        self._groups: Dict[int, _GroupMembers] = {}
+        self._by_uid: Dict[str, Tuple[int, MemberInfo]] = {}  # Uid -> (来自哪个群, 成员信息)
+        self._refreshing: SingleFlight[int, _GroupMembers] = SingleFlight()
+
+    def get(self, group_id: int, uin: int) -> Optional[MemberInfo]:
+        """只查缓存, 不发请求"""
+        if group := self._groups.get(group_id):
+            return group.by_uin.get(uin)
+        return None
+
+    def get_by_uid(self, uid: str) -> Optional[MemberInfo]:
+        """只查缓存, 不发请求"""
+        entry = self._by_uid.get(uid)
+        return entry[1] if entry else None
+
+    async def get_member(self, group_id: int, uin: int) -> Optional[MemberInfo]:
+        """获取群成员, 缓存不存在或过期时先拉取整个群"""
+        group = await self._ensure(group_id)
+        return group.by_uin.get(uin)
+
+    async def get_members(self, group_id: int, refresh: bool = False) -> List[MemberInfo]:
+        """获取整个群的成员列表"""
+        group = await self._ensure(group_id, refresh)
+        return list(group.by_uin.values())
+
+    def invalidate(self, group_id: Optional[int] = None) -> None:
+        """使缓存失效, 不传群号时清空所有群"""
+        if group_id is None:
+            self._groups.clear()
+            self._by_uid.clear()
+        elif group := self._groups.pop(group_id, None):
+            self._unindex(group_id, group.by_uin.values())
+
+    def observe(self, event: Event) -> None:
+        """根据进群/退群事件增量更新缓存"""
+        if isinstance(event, GroupMemberJoinEvent):
+            # 事件里只有 Uid, 拿不到完整的成员信息, 让这个群下次访问时重新拉取
+            if group := self._groups.get(event.group_id):
+                group.expire_at = 0
+        elif isinstance(event, GroupMemberExitEvent):
+            if (group := self._groups.get(event.group_id)) and event.user_uid:
+                for uin, member in list(group.by_uin.items()):
+                    if member.Uid == event.user_uid:
+                        del group.by_uin[uin]
+                        self._unindex(event.group_id, [member])
+
+    def _unindex(self, group_id: int, members: Iterable[MemberInfo]) -> None:
+        """从 Uid 索引中移除来自这个群的成员, 仍在其它已缓存的群中时改为指向那个群"""
+        for member in members:
+            entry = self._by_uid.get(member.Uid)
+            if entry is None or entry[0] != group_id:
+                continue
+            del self._by_uid[member.Uid]
+            for other_id, other in self._groups.items():
+                if other_id != group_id and (other_member := other.by_uin.get(member.Uin)):
+                    self._by_uid[member.Uid] = (other_id, other_member)
+                    break
+
+    async def _ensure(self, group_id: int, refresh: bool = False) -> _GroupMembers:
+        group = self._groups.get(group_id)
+        if refresh or group is None or group.expire_at < time.monotonic():
+            group = await self._refreshing.do(group_id, lambda: self._refresh(group_id))
+        return group
+
+    async def _refresh(self, group_id: int) -> _GroupMembers:
+        members = await self.bot.fetch_group_member_list(group_id)
+        if old := self._groups.get(group_id):
+            self._unindex(group_id, old.by_uin.values())  # 已经退群的成员不再留在索引中
+        group = self._groups[group_id] = _GroupMembers(members, self.ttl)
+        for member in members:
+            self._by_uid[member.Uid] = (group_id, member)
+            if self.uid_index is not None:
+                self.uid_index.add(member.Uin, member.Uid)
+        return group
+
+
+class _RosterEntry(Generic[T]):
+    __slots__ = ("items", "fetched_at")
+
+    def __init__(self, items: List[T], fetched_at: float):
+        self.items = items
+        self.fetched_at = fetched_at  # 使用墙上时间, 持久化后重启仍然可用
+
+
+class Roster:
+    """
+    群列表与好友列表缓存, 每个 Bot 一个
+    超过 ttl 后在下次访问时重新拉取, 并发拉取只请求一次;
+    配置了 persist_path 时会把结果写入磁盘, 重启后在有效期内直接使用
+    :param bot: 所属 Bot
+    :param ttl: 缓存有效期(秒)
+    :param persist_path: 持久化文件路径
+    """
+
+    def __init__(
+            self,
+            bot: "Bot",
+            ttl: float,
+            persist_path: Optional[Path] = None,
+            uid_index: Optional[UidIndex] = None,
+    ):
+        self.bot = bot
+        self.ttl = ttl
+        self.persist_path = persist_path
+        self.uid_index = uid_index
+        self._groups: Optional[_RosterEntry[GroupData]] = None
+        self._friends: Optional[_RosterEntry[FriendInfo]] = None
+        self._loaded = False
+        self._refreshing: SingleFlight[str, Any] = SingleFlight()
+        self._write_lock = threading.Lock()
+
+    async def get_groups(self, refresh: bool = False) -> List[GroupData]:
+        """群列表, 返回的是副本, 调用方修改列表不会影响缓存"""
+        return list((await self._group_entry(refresh)).items)
+
+    async def get_friends(self, refresh: bool = False) -> List[FriendInfo]:
+        """好友列表, 返回的是副本, 调用方修改列表不会影响缓存"""
+        return list((await self._friend_entry(refresh)).items)
+
+    async def find_friend(self, uin: int) -> Optional[FriendInfo]:
+        for friend in (await self._friend_entry()).items:
+            if friend.Uin == uin:
+                return friend
+        return None
+
+    def invalidate(self) -> None:
+        self._groups = self._friends = None
+
+    def _fresh(self, entry: Optional[_RosterEntry]) -> bool:
+        return entry is not None and time.time() - entry.fetched_at < self.ttl
+
+    async def _group_entry(self, refresh: bool = False) -> _RosterEntry[GroupData]:
+        await self._load()
+        if refresh or not self._fresh(self._groups):
+            self._groups = await self._refreshing.do("groups", self._refresh_groups)
+        return self._groups
+
+    async def _friend_entry(self, refresh: bool = False) -> _RosterEntry[FriendInfo]:
+        await self._load()
+        if refresh or not self._fresh(self._friends):
+            self._friends = await self._refreshing.do("friends", self._refresh_friends)
+        return self._friends
+
+    async def _refresh_groups(self) -> _RosterEntry[GroupData]:
+        entry = _RosterEntry(await self.bot.fetch_group_list(), time.time())
+        self._groups = entry
+        await self._save()
+        return entry
+
+    async def _refresh_friends(self) -> _RosterEntry[FriendInfo]:
+        entry = _RosterEntry(await self.bot.fetch_friend_list(), time.time())
+        self._index_friends(entry.items)
+        self._friends = entry
+        await self._save()
+        return entry
+
+    def _index_friends(self, friends: List[FriendInfo]) -> None:
+        if self.uid_index is not None:
+            for friend in friends:
+                self.uid_index.add(friend.Uin, friend.Uid)
+
+    async def _load(self) -> None:
+        """第一次访问时读取持久化文件, 并发的访问共用同一次读取"""
+        if not self._loaded:
+            await self._refreshing.do("load", self._load_persisted)
+
+    async def _load_persisted(self) -> None:
+        try:
+            if self.persist_path is not None:
+                groups, friends = await asyncio.to_thread(self._read)
+                if groups is not None:
+                    self._groups = groups
+                if friends is not None:
+                    self._index_friends(friends.items)
+                    self._friends = friends
+        except Exception as e:
+            log("WARNING", f"Failed to load roster cache {self.persist_path}", e)
+        finally:
+            self._loaded = True
+
+    def _read(self) -> Tuple[Optional[_RosterEntry[GroupData]], Optional[_RosterEntry[FriendInfo]]]:
+        """在线程中读取并解析持久化文件"""
+        if not self.persist_path.exists():
+            return None, None
+        data = json.loads(self.persist_path.read_text(encoding="utf-8"))
+        groups = friends = None
+        if items := data.get("groups"):
+            groups = _RosterEntry([GroupData.model_validate(item) for item in items["items"]], items["fetched_at"])
+        if items := data.get("friends"):
+            friends = _RosterEntry([FriendInfo.model_validate(item) for item in items["items"]], items["fetched_at"])
+        return groups, friends
+
+    async def _save(self) -> None:
+        if self.persist_path is None:
+            return
+        try:
+            await asyncio.to_thread(self._write)
+        except OSError as e:
+            log("WARNING", f"Failed to save roster cache {self.persist_path}", e)
+
+    def _write(self) -> None:
+        """
+        在线程中写入持久化文件
+        群列表与好友列表可能同时刷新, 加锁依次写入, 每次写入的都是当时最新的两份列表
+        """
+        with self._write_lock:
+            data = {
+                name: {
+                    "fetched_at": entry.fetched_at,
+                    "items": [item.model_dump(mode="json") for item in entry.items],
+                }
+                for name, entry in (("groups", self._groups), ("friends", self._friends))
+                if entry is not None
+            }
+            self.persist_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.persist_path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+            tmp.replace(self.persist_path)
@@ -0,0 +1,174 @@
+import asyncio
+from collections import deque
+from enum import Enum
+from typing import Awaitable, Callable, Deque, Dict, List, Optional
+
+from .event import Event, MessageEvent
+from .log import log
+
+
+class OverflowPolicy(str, Enum):
+    """队列满时的处理方式"""
+
+    BLOCK = "block"  # 阻塞 websocket 读取, 直到队列有空位
+    DROP_OLDEST = "drop_oldest"  # 丢弃队列中最早的事件
+    DROP_NEWEST = "drop_newest"  # 丢弃新收到的事件
+
+
+class LaneKey(str, Enum):
+    """消息事件按什么划分顺序通道"""
+
+    SESSION = "session"  # 同一群内的同一用户 (get_session_id)
+    GROUP = "group"  # 同一个群, 私聊仍按会话划分
+    NONE = "none"  # 不保证顺序
+
+
+class EventDispatcher:
+    """
+    有界的事件分发队列, 由固定数量的 worker 处理事件
+
+    消息事件按会话划分通道: 同一通道内的事件按收到的顺序依次处理,
+    不同通道之间并行处理。某个通道正在处理时, 后续属于它的事件由
+    正在处理它的 worker 接着处理, 其它 worker 继续处理别的通道。
+    :param handler: 事件处理函数
+    :param maxsize: 队列长度, 同时也是通道内等待事件数的上限
+    :param workers: worker 数量
+    :param policy: 队列满时的处理方式
+    :param lane_key: 划分通道的方式
+    :param on_drop: 事件因队列满被丢弃时调用
+    """
+
+    def __init__(
+            self,
+            handler: Callable[[Event], Awaitable[None]],
+            maxsize: int = 1000,
+            workers: int = 16,
+            policy: OverflowPolicy = OverflowPolicy.BLOCK,
+            lane_key: LaneKey = LaneKey.SESSION,
+            on_drop: Optional[Callable[[Event], None]] = None,
+    ):
+        self.handler = handler
+        self.maxsize = maxsize
+        self.workers = workers
+        self.policy = OverflowPolicy(policy)
+        self.lane_key = LaneKey(lane_key)
+        self.on_drop = on_drop
+        self.in_flight = 0  # 正在处理的事件数
+        self.dropped = 0  # 因队列满被丢弃的事件数
+        self._queue: "asyncio.Queue[Event]" = asyncio.Queue(maxsize)
+        self._tasks: List[asyncio.Task] = []
+        self._lanes: Dict[str, Deque[Event]] = {}  # 正在处理的通道 -> 排在后面的事件
+        self._backlog = 0  # 在通道里等待的事件数
+        self._backlog_free = asyncio.Event()
+
+    @property
+    def queue_depth(self) -> int:
+        """排队中的事件数(包括在通道里等待的)"""
+        return self._queue.qsize() + self._backlog
+
+    @property
+    def active_lanes(self) -> int:
+        """正在处理的通道数"""
+        return len(self._lanes)
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "queue_depth": self.queue_depth,
+            "in_flight": self.in_flight,
+            "active_lanes": self.active_lanes,
+            "dropped": self.dropped,
+        }
+
+    def start(self) -> None:
+        """启动 worker, 重复调用不会重复启动"""
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        """停止所有 worker, 未处理的事件会被丢弃"""
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # 丢弃还在队列中的事件, 否则它们会在下次 start 时(可能是很久以后重连时)才被处理
+        discarded = self._backlog
+        while not self._queue.empty():
+            self._queue.get_nowait()
+            discarded += 1
+        for _ in range(discarded):
+            self._queue.task_done()
+        self._lanes.clear()
+        self._backlog = 0
+        self._backlog_free.set()
+        if discarded:
+            log("WARNING", f"Dispatcher stopped, {discarded} unprocessed events discarded")
+
+    async def put(self, event: Event) -> None:
+        """将事件放入队列, 队列满时按 policy 处理"""
+        if self.policy == OverflowPolicy.BLOCK:
+            await self._queue.put(event)
+            return
+        if self._queue.full():
+            self.dropped += 1
+            if self.policy == OverflowPolicy.DROP_NEWEST:
+                dropped = event
+            else:
+                dropped = self._queue.get_nowait()
+                self._queue.task_done()
+            if self.on_drop is not None:
+                self.on_drop(dropped)
+            if dropped is event:
+                return
+        self._queue.put_nowait(event)
+
+    async def join(self) -> None:
+        """等待队列中的事件全部处理完成"""
+        await self._queue.join()
+
+    def _get_lane(self, event: Event) -> Optional[str]:
+        if self.lane_key == LaneKey.NONE or not isinstance(event, MessageEvent):
+            return None
+        if self.lane_key == LaneKey.GROUP and event.group_id:
+            return f"group_{event.group_id}"
+        return event.get_session_id()
+
+    async def _worker(self) -> None:
+        while True:
+            # 通道里积压太多时先不取新事件, 让队列满起来触发 policy
+            while self._backlog >= self.maxsize:
+                self._backlog_free.clear()
+                await self._backlog_free.wait()
+            event = await self._queue.get()
+            key = self._get_lane(event)
+            if key is None:
+                await self._handle(event)
+                continue
+            if (lane := self._lanes.get(key)) is not None:
+                # 该通道正在被其它 worker 处理, 排到它后面
+                lane.append(event)
+                self._backlog += 1
+                continue
+            lane = self._lanes[key] = deque()
+            try:
+                await self._handle(event)
+                while lane:
+                    event = lane.popleft()
+                    self._backlog -= 1
+                    self._backlog_free.set()
+                    await self._handle(event)
+            finally:
+                self._lanes.pop(key, None)
+
+    async def _handle(self, event: Event) -> None:
+        self.in_flight += 1
+        try:
+            await self.handler(event)
+        except Exception as e:
+            log("ERROR", f"Error while handling event {event.get_event_name()}", e)
+        finally:
+            self.in_flight -= 1
+            self._queue.task_done()
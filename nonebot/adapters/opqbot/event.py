@@ -1,8 +1,9 @@
 from datetime import datetime
+from functools import cached_property
 
 from typing_extensions import override
 from typing import Optional, List, Union, TypeVar, Type, Dict, Any
-from pydantic import BaseModel, Field, model_validator, field_validator
+from pydantic import BaseModel, Field, PrivateAttr, model_validator, field_validator
 from enum import Enum
 from nonebot.utils import escape_tag
 
@@ -28,7 +29,7 @@ class EventType(str, Enum):
 class Sender(BaseModel):
     user_id: int
     nickname: str
-    user_uid: str
+    user_uid: Optional[str] = None
 
 
 class MessageId(BaseModel):
@@ -80,11 +81,35 @@ class MessageEvent(Event):
     group_id: Optional[int]
     user_id: int
     group_name: Optional[str]
-    message: Message = Message()
-    message_id: MessageId
     message_random: int
-    raw_message: dict
-    sender: Sender
+
+    # message, message_id, sender, raw_message 在第一次访问时才生成
+    _raw: Dict[str, Any] = PrivateAttr(default_factory=dict)
+
+    @cached_property
+    def message(self) -> Message:
+        if body := self.CurrentPacket.EventData.MsgBody:
+            return Message.build_message(body)
+        return Message()
+
+    @cached_property
+    def message_id(self) -> MessageId:
+        msg_head = self.CurrentPacket.EventData.MsgHead
+        return MessageId(seq=msg_head.MsgSeq, time=msg_head.MsgTime, uid=msg_head.MsgUid)
+
+    @cached_property
+    def sender(self) -> Sender:
+        """发送消息的人"""
+        msg_head = self.CurrentPacket.EventData.MsgHead
+        return Sender(
+            user_id=msg_head.SenderUin,
+            nickname=msg_head.SenderNick,
+            user_uid=msg_head.SenderUid,
+        )
+
+    @cached_property
+    def raw_message(self) -> dict:
+        return self._raw.copy()
 
     @override
     def get_event_name(self) -> str:
@@ -96,7 +121,8 @@ class MessageEvent(Event):
 
     @override
     def get_event_description(self) -> str:
-        return escape_tag(str(model_dump(self)))
+        source = f"{self.user_id}@[群:{self.group_id}]" if self.group_id else str(self.user_id)
+        return escape_tag(f"Message {self.message_id.seq} from {source} {self.get_message()}")
 
     @override
     def get_message(self) -> Message:
@@ -143,10 +169,9 @@ class MessageEvent(Event):
                     nested = nested.get(key, {})
             target[new_key] = nested
 
-        values["raw_message"] = values.copy()
+        values = values.copy()  # 不修改原始数据, 原始数据会作为 raw_message 保留
         event_data = values.get("CurrentPacket", {}).get("EventData", {})
         msg_head = event_data.get("MsgHead", {})
-        msg_body = event_data.get("MsgBody", {}) or {}  # 防止MsgBody:null
         transform_dict = {
                              "time": ["MsgTime"],
                              "user_id": ["SenderUin"],
@@ -163,22 +188,22 @@ class MessageEvent(Event):
         values["message_type"] = {1: "friend", 2: "group", 3: "private"}.get(
             msg_head.get("FromType"), "unknown"
         )
-        values["message_id"] = MessageId(
-            seq=msg_head.get("MsgSeq"),
-            time=msg_head.get("MsgTime"),
-            uid=msg_head.get("MsgUid"),
-        )
-        values["sender"] = Sender(
-            user_id=msg_head.get("SenderUin"),
-            nickname=msg_head.get("SenderNick"),
-            user_uid=msg_head.get("SenderUid"),
-        )  # 发送消息的人
-        if body := msg_body:
-            values["message"] = Message.build_message(MsgBody(**body))
-        else:
-            values["message"] = Message()
+        # CurrentPacket 只校验这一次, 之后 pydantic 会直接复用这个实例
+        packet = values.get("CurrentPacket")
+        if not isinstance(packet, CurrentPacket):
+            packet = CurrentPacket.model_validate(packet)
+        values["CurrentPacket"] = packet
         return values
 
+    @model_validator(mode="wrap")
+    @classmethod
+    def keep_raw_payload(cls, values: Any, handler):
+        # 保留原始数据的引用, 用到 raw_message 时才复制
+        event = handler(values)
+        if isinstance(values, dict):
+            event._raw = values
+        return event
+
     # @field_validator('time', mode='before')
     # def validate_time(cls, v):
     #     return datetime.fromtimestamp(v)
@@ -205,7 +230,15 @@ class GroupMessageEvent(MessageEvent):
     """群消息事件"""
 
     __type__ = EventType.GROUP_NEW_MSG
-    at_users: Optional[List[Sender]]
+
+    @cached_property
+    def at_users(self) -> List[Sender]:
+        msg_body = self.CurrentPacket.EventData.MsgBody
+        at_uin_lists = (msg_body.AtUinLists if msg_body else None) or []
+        return [
+            Sender(user_id=at_user.Uin, nickname=at_user.Nick, user_uid=at_user.Uid)
+            for at_user in at_uin_lists
+        ]
 
     @override
     def get_type(self) -> str:
@@ -223,25 +256,6 @@ class GroupMessageEvent(MessageEvent):
             return True
         return False
 
-    @model_validator(mode="before")
-    def transform_group_data(cls, values: dict):
-        # 展平嵌套数据
-        event_data = values.get("CurrentPacket", {}).get("EventData", {})
-        msg_body = event_data.get("MsgBody", {}) or {}  # 防止MsgBody:null
-        at_uin_lists = msg_body.get("AtUinLists") or []
-        at_users = []
-        for at_user in at_uin_lists:
-            at_users.append(
-                Sender(
-                    user_id=at_user.get("Uin"),
-                    nickname=at_user.get("Nick"),
-                    user_uid=at_user.get("Uid"),
-                )
-            )
-
-        values["at_users"] = at_users
-        return values
-
 
 @register_event_class
 class FriendMessageEvent(MessageEvent):
@@ -300,6 +314,36 @@ class GroupMessageRevokeEvent(NoticeEvent):
         return "notice"
 
 
+class GroupMemberChangeEvent(NoticeEvent):
+    """群成员变动事件"""
+
+    group_id: int
+    user_uid: Optional[str] = None
+
+    @model_validator(mode="before")
+    def transform_member_data(cls, values: dict):
+        event_data = values.get("CurrentPacket", {}).get("EventData", {})
+        values = values.copy()
+        values["group_id"] = (event_data.get("MsgHead") or {}).get("FromUin")
+        event = event_data.get("Event") or {}
+        values["user_uid"] = event.get("Invitee") or event.get("Uid")
+        return values
+
+
+@register_event_class
+class GroupMemberJoinEvent(GroupMemberChangeEvent):
+    """群成员加入事件"""
+
+    __type__ = EventType.GROUP_JOIN
+
+
+@register_event_class
+class GroupMemberExitEvent(GroupMemberChangeEvent):
+    """群成员退出事件"""
+
+    __type__ = EventType.GROUP_EXIT
+
+
 @register_event_class
 class BotLogin(NoticeEvent):
     """Bot登录事件"""
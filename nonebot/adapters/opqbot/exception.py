@@ -0,0 +1,76 @@
+from typing import Any, Dict, Optional
+
+from nonebot.exception import AdapterException
+from nonebot.exception import ActionFailed as BaseActionFailed
+from nonebot.exception import NetworkError as BaseNetworkError
+
+
+class OPQAdapterException(AdapterException):
+    """OPQ 适配器异常基类"""
+
+    def __init__(self, *args: object) -> None:
+        super().__init__("OPQ", *args)
+
+
+class UploadFailed(OPQAdapterException):
+    """
+    消息中的媒体段上传失败
+    :param errors: 消息段下标 -> 对应的异常
+    """
+
+    def __init__(self, errors: Dict[int, BaseException]):
+        self.errors = errors
+        detail = ", ".join(f"#{index}: {error!r}" for index, error in errors.items())
+        super().__init__(f"{len(errors)} 个消息段上传失败 ({detail})")
+
+
+class NetworkError(BaseNetworkError, OPQAdapterException):
+    """
+    无法连接 OPQ 或 OPQ 返回了无法解析的数据
+    :param msg: 错误信息
+    """
+
+    def __init__(self, msg: Optional[str] = None):
+        super().__init__(msg)
+        self.msg = msg
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(msg={self.msg!r})"
+
+    def __str__(self) -> str:
+        return self.__repr__()
+
+
+class ApiTimeout(NetworkError):
+    """API 请求超时"""
+
+
+class CircuitOpen(NetworkError):
+    """该 OPQ 服务连续失败, 熔断期间不再发送请求"""
+
+
+class ActionFailed(BaseActionFailed, OPQAdapterException):
+    """
+    OPQ 返回的 Ret 不为 0
+    :param cmd: 请求的 CgiCmd
+    :param ret: 返回的 Ret
+    :param errmsg: 返回的 ErrMsg
+    :param response: 完整的返回数据
+    """
+
+    def __init__(self, cmd: str, ret: int, errmsg: str = "", response: Any = None):
+        super().__init__(cmd, ret, errmsg)
+        self.cmd = cmd
+        self.ret = ret
+        self.errmsg = errmsg
+        self.response = response
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(cmd={self.cmd!r}, ret={self.ret}, errmsg={self.errmsg!r})"
+
+    def __str__(self) -> str:
+        return self.__repr__()
+
+
+class RateLimited(ActionFailed):
+    """请求过于频繁, 被 OPQ 或 QQ 限制"""
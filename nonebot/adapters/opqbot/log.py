@@ -1,3 +1,107 @@
-from nonebot.utils import logger_wrapper
+from typing import Any, Callable, Dict, Optional, Union
 
-log = logger_wrapper("OPQ")
+from nonebot import get_driver
+from nonebot.log import logger
+from nonebot.utils import escape_tag
+
+_T_Message = Union[str, Callable[[], str]]
+
+# 这些字段只记录长度
+REDACT_KEYS = {"Base64Buf"}
+
+_settings: Dict[str, Any] = {
+    "max_length": 512,  # 单个字段/数据在日志中的最大长度
+    "sample_every": 100,  # 采样日志每多少条记录一条
+}
+_threshold: Optional[int] = None
+_sample_counters: Dict[str, int] = {}
+
+
+def configure_log(max_length: Optional[int] = None, sample_every: Optional[int] = None) -> None:
+    """
+    修改日志设置
+    :param max_length: 单个字段/数据在日志中的最大长度
+    :param sample_every: 采样日志每多少条记录一条
+    """
+    if max_length is not None:
+        _settings["max_length"] = max_length
+    if sample_every is not None:
+        _settings["sample_every"] = max(sample_every, 1)
+
+
+def set_log_level(level: Union[str, int, None]) -> None:
+    """修改适配器的日志等级, None 时重新读取 NoneBot 的 log_level"""
+    global _threshold
+    _threshold = logger.level(level).no if isinstance(level, str) else level
+
+
+def is_enabled(level: str) -> bool:
+    """该等级的日志是否会被输出"""
+    global _threshold
+    if _threshold is None:
+        try:
+            set_log_level(get_driver().config.log_level)
+        except ValueError:  # NoneBot 尚未初始化
+            return True
+    return logger.level(level).no >= _threshold
+
+
+def truncate(text: Any, limit: Optional[int] = None) -> str:
+    """截断过长的文本"""
+    text = str(text)
+    limit = limit or _settings["max_length"]
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}...({len(text)} chars)"
+
+
+def _redact(data: Any, limit: int) -> Any:
+    if isinstance(data, dict):
+        return {
+            key: f"<{len(value)} chars>" if key in REDACT_KEYS and isinstance(value, str) else _redact(value, limit)
+            for key, value in data.items()
+        }
+    if isinstance(data, (list, tuple)):
+        return [_redact(item, limit) for item in data]
+    if isinstance(data, (str, bytes)) and len(data) > limit:
+        return f"{data[:limit]}...({len(data)} chars)"
+    return data
+
+
+def redact(data: Any, limit: Optional[int] = None) -> str:
+    """
+    将请求/响应数据转为适合写入日志的文本
+    Base64Buf 等字段只保留长度, 过长的字符串和整体结果会被截断
+    """
+    limit = limit or _settings["max_length"]
+    return escape_tag(truncate(_redact(data, limit), limit * 4))
+
+
+def log(level: str, message: _T_Message, exception: Optional[BaseException] = None) -> None:
+    """
+    记录适配器日志
+    :param level: 日志等级
+    :param message: 日志内容, 传入函数时只在该等级会被输出时才调用它生成内容
+    :param exception: 异常信息
+    """
+    if not is_enabled(level):
+        return
+    if callable(message):
+        message = message()
+    logger.opt(colors=True, exception=exception).log(level, f"<m>OPQ</m> | {message}")
+
+
+def log_sampled(level: str, key: str, message: _T_Message) -> None:
+    """
+    高频日志按 key 采样, 每 sample_every 条只记录一条
+    :param key: 采样计数的分组
+    """
+    if not is_enabled(level):
+        return
+    count = _sample_counters.get(key, 0)
+    _sample_counters[key] = count + 1
+    if count % _settings["sample_every"]:
+        return
+    if callable(message):
+        message = message()
+    log(level, f"{message} (每 {_settings['sample_every']} 条记录一条)")
@@ -0,0 +1,243 @@
+import asyncio
+import base64
+import binascii
+import hashlib
+import os
+from pathlib import Path
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple
+
+from nonebot.drivers import HTTPClientMixin, Request
+
+from .exception import NetworkError
+from .log import log
+from .utils import SingleFlight
+
+# 可以下载的消息段类型
+MEDIA_TYPES = ("image", "voice", "video")
+
+
+def _md5_hex(file_md5: str) -> Optional[str]:
+    """FileMd5 是十六进制或 base64 的 md5 时返回十六进制, 否则返回 None"""
+    if len(file_md5) == 32:
+        try:
+            bytes.fromhex(file_md5)
+            return file_md5.lower()
+        except ValueError:
+            pass
+    try:
+        digest = base64.b64decode(file_md5, validate=True)
+        if len(digest) == 16:
+            return digest.hex()
+    except (binascii.Error, ValueError):
+        pass
+    return None
+
+
+def media_key(file_md5: str) -> str:
+    """把 FileMd5 (十六进制或 base64) 统一转成十六进制, 用作文件名"""
+    return _md5_hex(file_md5) or hashlib.sha256(file_md5.encode()).hexdigest()
+
+
+class MediaStore:
+    """
+    按 FileMd5 存放收到的图片、语音和视频
+
+    下载时边收边写入磁盘并校验 md5, 同一个文件的并发请求只下载一次;
+    总大小超过 quota 时按最近使用时间删除旧文件。
+    后台预下载由 prefetch_concurrency 个 worker 从有界队列中取出执行, 队列满时直接跳过。
+    :param driver: 支持 HTTP 客户端的驱动器
+    :param root: 存放目录
+    :param quota: 磁盘占用上限(字节)
+    :param prefetch_concurrency: 后台预下载的并发数
+    :param prefetch_queue_size: 等待预下载的文件数上限
+    :param timeout: 下载超时(秒)
+    """
+
+    def __init__(
+            self,
+            driver: HTTPClientMixin,
+            root: Path,
+            quota: int = 1024 * 1024 * 1024,
+            prefetch_concurrency: int = 4,
+            prefetch_queue_size: int = 256,
+            timeout: float = 60.0,
+    ):
+        self.driver = driver
+        self.root = root
+        self.quota = quota
+        self.prefetch_concurrency = prefetch_concurrency
+        self.prefetch_queue_size = prefetch_queue_size
+        self.timeout = timeout
+        self._used: Optional[int] = None  # 第一次写入时统计
+        self._evicting = False
+        self._flight: SingleFlight[str, Path] = SingleFlight()
+        # 队列和 worker 在第一次预下载时创建, 保证绑定到正在运行的事件循环
+        self._prefetch_queue: "Optional[asyncio.Queue[Tuple[str, str]]]" = None
+        self._prefetch_workers: List[asyncio.Task] = []
+        self._prefetch_pending: Set[str] = set()  # 排队中和正在预下载的 media_key
+
+    def path(self, file_md5: str) -> Path:
+        key = media_key(file_md5)
+        return self.root / key[:2] / key
+
+    def get(self, file_md5: str) -> Optional[Path]:
+        """已经下载过时返回文件路径"""
+        path = self.path(file_md5)
+        try:
+            os.utime(path)  # 以修改时间作为最近使用时间
+        except OSError:
+            return None
+        return path
+
+    async def fetch(self, url: str, file_md5: str) -> Path:
+        """
+        下载文件并返回本地路径, 已下载过时直接返回
+        :param url: 消息段中的 Url
+        :param file_md5: 消息段中的 FileMd5
+        :raises NetworkError: 下载失败或内容与 FileMd5 不符
+        """
+        if (path := self.get(file_md5)) is not None:
+            return path
+        return await self._flight.do(media_key(file_md5), lambda: self._download(url, file_md5))
+
+    def prefetch(self, url: str, file_md5: str) -> None:
+        """在后台下载, 失败时只记录日志"""
+        key = media_key(file_md5)
+        if key in self._prefetch_pending or key in self._flight or self.get(file_md5) is not None:
+            return
+        if self._prefetch_queue is None:
+            self._prefetch_queue = asyncio.Queue(self.prefetch_queue_size)
+            self._prefetch_workers = [
+                asyncio.create_task(self._prefetch_worker()) for _ in range(self.prefetch_concurrency)
+            ]
+        try:
+            self._prefetch_queue.put_nowait((url, file_md5))
+        except asyncio.QueueFull:
+            log("DEBUG", f"Prefetch queue is full, skipped media {file_md5}")
+            return
+        self._prefetch_pending.add(key)
+
+    async def _prefetch_worker(self) -> None:
+        while True:
+            url, file_md5 = await self._prefetch_queue.get()
+            try:
+                await self.fetch(url, file_md5)
+            except Exception as e:
+                log("WARNING", f"Failed to prefetch media {file_md5}", e)
+            finally:
+                self._prefetch_pending.discard(media_key(file_md5))
+                self._prefetch_queue.task_done()
+
+    async def close(self) -> None:
+        """取消未完成的预下载"""
+        workers, self._prefetch_workers = self._prefetch_workers, []
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        self._prefetch_queue = None
+        self._prefetch_pending.clear()
+
+    async def _download(self, url: str, file_md5: str) -> Path:
+        path = self.path(file_md5)
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        expected = _md5_hex(file_md5)
+        digest = hashlib.md5()
+        size = 0
+        request = Request("GET", url, timeout=self.timeout)
+        try:
+            await asyncio.to_thread(path.parent.mkdir, parents=True, exist_ok=True)
+            f = await asyncio.to_thread(open, tmp, "wb")
+            try:
+                async for status_code, content in self._stream(request):
+                    if status_code != 200:
+                        raise NetworkError(f"Download {url} failed: HTTP {status_code}")
+                    if content:
+                        digest.update(content)
+                        await asyncio.to_thread(f.write, content)
+                        size += len(content)
+            finally:
+                await asyncio.to_thread(f.close)
+            # 错误页面等内容不会被当作这个文件保存下来
+            if expected is not None and digest.hexdigest() != expected:
+                raise NetworkError(f"Download {url} failed: md5 mismatch, expected {expected}")
+            await asyncio.to_thread(tmp.replace, path)
+        except NetworkError:
+            await asyncio.to_thread(tmp.unlink, missing_ok=True)
+            raise
+        except Exception as e:
+            await asyncio.to_thread(tmp.unlink, missing_ok=True)
+            raise NetworkError(f"Download {url} failed: {e!r}") from e
+        await self._account(size)
+        return path
+
+    async def _stream(self, request: Request) -> AsyncIterator[Tuple[int, Optional[bytes]]]:
+        """
+        分块返回 (状态码, 数据)
+        旧版本的驱动器没有 stream_request 时退回到一次性读取整个响应
+        """
+        if hasattr(self.driver, "stream_request"):
+            async for chunk in self.driver.stream_request(request, chunk_size=64 * 1024):
+                content = chunk.content
+                yield chunk.status_code, content.encode() if isinstance(content, str) else content
+        else:
+            resp = await self.driver.request(request)
+            content = resp.content
+            yield resp.status_code, content.encode() if isinstance(content, str) else content
+
+    # 统计和淘汰选择都在事件循环中进行, 线程中只做文件的遍历和删除
+
+    def _list_files(self) -> List[Tuple[float, int, Path]]:
+        """列出已下载的文件 (修改时间, 大小, 路径)"""
+        files = []
+        for file in self.root.glob("*/*"):
+            if file.name.endswith(".tmp"):
+                continue
+            try:
+                stat = file.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, file))
+        return files
+
+    @staticmethod
+    def _remove_files(files: List[Path]) -> List[Path]:
+        """删除文件, 返回成功删除的文件"""
+        removed = []
+        for file in files:
+            try:
+                file.unlink()
+            except OSError:
+                continue
+            removed.append(file)
+        return removed
+
+    async def _account(self, size: int) -> None:
+        if self._used is None:
+            used = sum(file_size for _, file_size, _ in await asyncio.to_thread(self._list_files))
+            if self._used is None:  # 等待期间可能已经被别的下载统计过
+                self._used = used
+                size = 0  # 刚写入的文件已经统计在内
+        self._used += size
+        if self._used > self.quota:
+            await self._evict()
+
+    async def _evict(self) -> None:
+        """按最近使用时间删除文件, 直到占用降到上限的 90%"""
+        if self._evicting:
+            return
+        self._evicting = True
+        try:
+            sizes = {}
+            expected = self._used
+            for _, size, file in sorted(await asyncio.to_thread(self._list_files)):
+                if expected <= self.quota * 0.9:
+                    break
+                sizes[file] = size
+                expected -= size
+            for file in await asyncio.to_thread(self._remove_files, list(sizes)):
+                self._used -= sizes[file]
+        finally:
+            self._evicting = False
+
+    def stats(self) -> Dict[str, int]:
+        return {"used": self._used or 0, "prefetching": len(self._prefetch_pending)}
@@ -1,4 +1,4 @@
-from typing import Type, Union, Mapping, Iterable
+from typing import Type, Union, Mapping, Iterable, List, Dict
 
 from typing_extensions import override
 from pathlib import Path
@@ -6,6 +6,7 @@ from io import BytesIO
 
 from nonebot.adapters import Message as BaseMessage, MessageSegment as BaseMessageSegment
 from .models import MsgBody
+from .models.message import AtUinList
 
 
 class MessageSegment(BaseMessageSegment["Message"]):
@@ -62,6 +63,50 @@ class MessageSegment(BaseMessageSegment["Message"]):
         """
         return MessageSegment(type="atall", data={})
 
+    @staticmethod
+    def forward(messages: List[Union[str, "Message", "MessageSegment"]]) -> "MessageSegment":
+        """
+        创建一个嵌套的合并转发段, 只能用在合并转发消息中
+        :param messages: 需要组合的message
+        """
+        return MessageSegment(type="forward", data={"messages": messages})
+
+
+
+def _tokenize_at(text: str, ats: List[AtUinList]) -> List[MessageSegment]:
+    """
+    一次扫描把 Content 拆成 text 与 at 段
+    用 str.find 找到每个 @ 后, 按长度从长到短在昵称表中查找, 避免 @Tom 抢先匹配 @Tommy;
+    同一昵称出现多次时依次对应 AtUinLists 中的各个 uin, 用完后沿用最后一个
+    :param text: 消息文本
+    :param ats: AtUinLists
+    """
+    uins: Dict[str, List[int]] = {}
+    for at in ats:
+        if at.Nick:
+            uins.setdefault(at.Nick, []).append(at.Uin)
+    if not uins:
+        return [MessageSegment.text(text)]
+    lengths = sorted({len(nick) for nick in uins}, reverse=True)
+    segments = []
+    start = 0  # 还没有输出的文本的起点
+    pos = text.find("@")
+    while pos != -1:
+        for length in lengths:
+            nick = text[pos + 1:pos + 1 + length]
+            if (queue := uins.get(nick)) is not None:
+                break
+        else:
+            pos = text.find("@", pos + 1)
+            continue
+        if pos > start:
+            segments.append(MessageSegment(type="text", data={"text": text[start:pos]}))
+        segments.append(MessageSegment(type="at", data={"uin": queue.pop(0) if len(queue) > 1 else queue[0]}))
+        start = pos + 1 + len(nick)
+        pos = text.find("@", start)
+    if start < len(text):
+        segments.append(MessageSegment(type="text", data={"text": text[start:]}))
+    return segments
 
 
 class Message(BaseMessage[MessageSegment]):
@@ -81,24 +126,8 @@ class Message(BaseMessage[MessageSegment]):
     def build_message(msg_body: MsgBody) -> "Message":
         msg: list[MessageSegment] = []
 
-        text = msg_body.Content or ""
-        if ats := msg_body.AtUinLists:
-            # 按照 at 列表逐个替换文本中的 @昵称
-            for at in ats:
-                nick = at.Nick
-                uin = at.Uin
-                at_text = f"@{nick}"
-                if at_text in text:
-                    # 拆成前 + at段 + 后
-                    before, _, after = text.partition(at_text)
-                    if before:
-                        msg.append(MessageSegment.text(before))
-                    msg.append(MessageSegment(type="at", data={"uin": at}))
-                    text = after
-            if text:  # 剩余的普通文本
-                msg.append(MessageSegment.text(text))
-        elif text:
-            msg.append(MessageSegment.text(text))
+        if text := msg_body.Content:
+            msg.extend(_tokenize_at(text, msg_body.AtUinLists or []))
 
         if images := msg_body.Images:
             for image in images:
@@ -107,8 +136,13 @@ class Message(BaseMessage[MessageSegment]):
             msg.append(MessageSegment(type="file", data=file.model_dump()))
         elif voice := msg_body.Voice:
             msg.append(MessageSegment(type="voice", data=voice.model_dump()))
-
-        print("debug get msg list")
-        print(msg)
-        return Message(msg) if msg else Message("")
+        elif video := msg_body.Video:
+            msg.append(MessageSegment(type="video", data=video.model_dump()))
+
+        if not msg:
+            return Message("")
+        message = Message()
+        # 这些段都是上面构造的 MessageSegment, 跳过 Message.extend 逐段的类型检查
+        list.extend(message, msg)
+        return message
 
@@ -0,0 +1,284 @@
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+_T_Labels = Tuple[str, ...]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: Dict[str, object]) -> _T_Labels:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        """(名称后缀, 标签, 值)"""
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(f"{self.name}{suffix}{labels} {_format_value(value)}" for suffix, labels, value in self.samples())
+        return lines
+
+
+class CounterChild:
+    """绑定了一组标签的计数, 热点路径上保存下来直接 value += 1, 省去每次组装标签"""
+
+    __slots__ = ("value",)
+
+    def __init__(self) -> None:
+        self.value: float = 0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+
+class Counter(_Metric):
+    """只增不减的计数"""
+
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[_T_Labels, CounterChild] = {}
+
+    def labels(self, **labels: object) -> CounterChild:
+        key = self._key(labels)
+        if (child := self._values.get(key)) is None:
+            child = self._values[key] = CounterChild()
+        return child
+
+    def inc(self, amount: float = 1, **labels: object) -> None:
+        self.labels(**labels).value += amount
+
+    def get(self, **labels: object) -> float:
+        child = self._values.get(self._key(labels))
+        return child.value if child is not None else 0
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        for key, child in self._values.items():
+            yield "", _format_labels(self.labelnames, key), child.value
+
+
+class Gauge(_Metric):
+    """可增可减的当前值"""
+
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[_T_Labels, float] = {}
+
+    def set(self, value: float, **labels: object) -> None:
+        self._values[self._key(labels)] = value
+
+    def get(self, **labels: object) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def clear(self) -> None:
+        self._values.clear()
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        for key, value in self._values.items():
+            yield "", _format_labels(self.labelnames, key), value
+
+
+class Histogram(_Metric):
+    """按区间统计的分布, 用于耗时等"""
+
+    type = "histogram"
+
+    def __init__(
+            self,
+            name: str,
+            documentation: str,
+            labelnames: Sequence[str] = (),
+            buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # 标签 -> [各区间计数..., 总和, 总数]
+        self._values: Dict[_T_Labels, List[float]] = {}
+
+    def observe(self, value: float, **labels: object) -> None:
+        key = self._key(labels)
+        if (data := self._values.get(key)) is None:
+            data = self._values[key] = [0] * (len(self.buckets) + 2)
+        index = bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            data[index] += 1
+        data[-2] += value
+        data[-1] += 1
+
+    @contextmanager
+    def time(self, **labels: object) -> Iterator[None]:
+        """记录 with 块的耗时"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def get(self, **labels: object) -> Tuple[float, int]:
+        """(总和, 总数)"""
+        data = self._values.get(self._key(labels))
+        return (data[-2], int(data[-1])) if data else (0.0, 0)
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        for key, data in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, data):
+                cumulative += count
+                yield "_bucket", _format_labels(self.labelnames, key, f'le="{bound:g}"'), cumulative
+            yield "_bucket", _format_labels(self.labelnames, key, 'le="+Inf"'), data[-1]
+            yield "_sum", _format_labels(self.labelnames, key), data[-2]
+            yield "_count", _format_labels(self.labelnames, key), data[-1]
+
+
+class MetricsRegistry:
+    """
+    进程内的指标注册表
+    collector 在每次导出前调用, 用来更新队列长度等需要现取的 Gauge
+    """
+
+    def __init__(self) -> None:
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], None]] = []
+
+    def _register(self, metric: _Metric) -> _Metric:
+        if (existing := self._metrics.get(metric.name)) is not None:
+            if type(existing) is not type(metric):
+                raise ValueError(f"Metric {metric.name} already registered as {existing.type}")
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+            self,
+            name: str,
+            documentation: str,
+            labelnames: Sequence[str] = (),
+            buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
+
+    def add_collector(self, collector: Callable[[], None]) -> None:
+        self._collectors.append(collector)
+
+    def remove_collector(self, collector: Callable[[], None]) -> None:
+        if collector in self._collectors:
+            self._collectors.remove(collector)
+
+    def collect(self) -> None:
+        for collector in self._collectors:
+            collector()
+
+    def render(self) -> str:
+        """Prometheus 文本格式"""
+        self.collect()
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+events_received = REGISTRY.counter(
+    "opq_events_received_total", "收到的事件数", ["event_name"]
+)
+events_parsed = REGISTRY.counter(
+    "opq_events_parsed_total", "成功解析为 Event 的事件数", ["event_name"]
+)
+events_dropped = REGISTRY.counter(
+    "opq_events_dropped_total", "未能交给 Bot 处理的事件数", ["event_name", "reason"]
+)
+# 每个事件都要计时的开销与解析本身相比不可忽略, 只对其中一部分采样
+PARSE_SAMPLE_EVERY = 64
+event_parse_seconds = REGISTRY.histogram(
+    "opq_event_parse_seconds", f"事件解析耗时, 每 {PARSE_SAMPLE_EVERY} 个事件采样一次", ["event_name"],
+    buckets=(0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05),
+)
+api_request_seconds = REGISTRY.histogram(
+    "opq_api_request_seconds", "API 请求耗时", ["cmd"]
+)
+api_errors = REGISTRY.counter(
+    "opq_api_errors_total", "API 返回 Ret 不为 0 的次数", ["cmd", "ret"]
+)
+api_retries = REGISTRY.counter(
+    "opq_api_retries_total", "API 请求重试的次数", ["cmd"]
+)
+api_failures = REGISTRY.counter(
+    "opq_api_failures_total", "API 请求失败(网络错误、无法解析等)的次数", ["cmd"]
+)
+upload_bytes = REGISTRY.counter(
+    "opq_upload_bytes_total", "上传的字节数", ["kind"]
+)
+upload_seconds = REGISTRY.histogram(
+    "opq_upload_seconds", "上传耗时", ["kind"]
+)
+ws_reconnects = REGISTRY.counter(
+    "opq_ws_reconnects_total", "websocket 重连成功的次数", ["server"]
+)
+ws_connected = REGISTRY.gauge(
+    "opq_ws_connected", "websocket 是否已连接", ["server"]
+)
+dispatch_queue_depth = REGISTRY.gauge(
+    "opq_dispatch_queue_depth", "事件队列中等待处理的事件数", ["bot"]
+)
+dispatch_in_flight = REGISTRY.gauge(
+    "opq_dispatch_in_flight", "正在处理的事件数", ["bot"]
+)
+dispatch_dropped = REGISTRY.counter(
+    "opq_dispatch_dropped_total", "因事件队列满被丢弃的事件数", ["bot"]
+)
+send_pending = REGISTRY.gauge(
+    "opq_send_pending", "限速排队中的待发送消息数", ["bot"]
+)
+
+_event_counters: Dict[Optional[str], Tuple[CounterChild, CounterChild]] = {}
+
+
+def event_counters(event_name: Optional[str]) -> Tuple[CounterChild, CounterChild]:
+    """
+    这个事件在 events_received 与 events_parsed 中的计数
+    每个事件都要更新, 按事件名缓存, 之后只需要一次字典查找
+    """
+    if (counters := _event_counters.get(event_name)) is None:
+        counters = _event_counters[event_name] = (
+            events_received.labels(event_name=event_name),
+            events_parsed.labels(event_name=event_name),
+        )
+    return counters
@@ -5,6 +5,7 @@ from .response import (
     BaseResponse,
     SendMsgResponse,
     UploadForwardMsgResponse,
+    BroadcastResult,
     GetGroupListResponse,
     GetGroupMemberListResponse,
     GetFriendListResponse,
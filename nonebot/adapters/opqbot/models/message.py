@@ -26,6 +26,7 @@ class MsgHead(BaseModel):
     FromType: int  # "消息来源类型 3私聊 2群组 1好友")
     SenderUin: int  # "发送者QQ号")
     SenderNick: str
+    SenderUid: Optional[str] = None
     MsgType: int
     C2cCmd: int  # 0 收到群消息, 1 发出去消息的回应, 17 群消息被撤回, 349 上下线, 20 被拉群， 212 群解散， 8 上线， 11 好友私聊", )
     MsgSeq: int
@@ -39,6 +40,7 @@ class MsgHead(BaseModel):
 class AtUinList(BaseModel):
     Nick: str
     Uin: int
+    Uid: Optional[str] = None
 
 
 class Image(BaseModel):
@@ -19,8 +19,8 @@ class UploadImageVoiceResponse(BaseModel):
     FileSize: int
     FileId: Optional[int]
     FileToken: Optional[str] = None
-    Height: int = None
-    Width: int = None
+    Height: Optional[int] = None
+    Width: Optional[int] = None
 
 
 # class UploadGroupFileResponse(BaseModel):
@@ -37,6 +37,15 @@ class UploadForwardMsgResponse(BaseModel):
     ResId: str
 
 
+class BroadcastResult(BaseModel):
+    """broadcast 对单个目标的发送结果"""
+    target_type: str  # group / user
+    target_id: int
+    success: bool
+    response: Any = None
+    error: Optional[str] = None
+
+
 class GroupData(BaseModel):
     CreateTime: datetime
     GroupCnt: int
@@ -0,0 +1,215 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from enum import IntEnum
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Set, Tuple, TypeVar
+
+T = TypeVar("T")
+# ("group", 群号) 或 ("user", qq号)
+Target = Tuple[str, int]
+
+# 令牌桶数量超过这个值时清理已经回满的桶
+_MAX_IDLE_BUCKETS = 4096
+
+
+class Priority(IntEnum):
+    """发送优先级, 数值越小越先发送"""
+
+    HIGH = 0  # 回复消息
+    NORMAL = 1  # 普通发送
+    LOW = 2  # 广播等批量任务
+
+
+class TokenBucket:
+    """
+    令牌桶
+    :param rate: 每秒补充的令牌数
+    :param burst: 桶容量, 即允许的突发数量
+    :param now: 创建时的时间, 默认为 time.monotonic()
+    """
+
+    def __init__(self, rate: float, burst: int, now: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic() if now is None else now
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """距离有可用令牌还需要等待的秒数"""
+        self._refill(now)
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def consume(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+    def full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.burst
+
+    async def acquire(self) -> None:
+        """等待直到有可用令牌, 然后取走一个"""
+        while (wait := self.wait_time(time.monotonic())) > 0:
+            await asyncio.sleep(wait)
+        self.consume(time.monotonic())
+
+
+class _Job:
+    __slots__ = ("func", "future", "queued_at")
+
+    def __init__(self, func: Callable[[], Awaitable[Any]], future: asyncio.Future, queued_at: float):
+        self.func = func
+        self.future = future
+        self.queued_at = queued_at
+
+
+class OutboundScheduler:
+    """
+    出站消息调度器
+
+    每个 Bot 一个。发送需要同时拿到 Bot 的令牌和目标(群/用户)的令牌;
+    优先级高的先发, 同一优先级内各个目标轮流发送, 某个群刷屏不会饿死其它群。
+    :param clock: 取当前时间的函数, 默认为 time.monotonic, 测试时可以换成假时钟
+    """
+
+    def __init__(
+            self,
+            bot_rate: float,
+            bot_burst: int,
+            group_rate: float,
+            group_burst: int,
+            user_rate: float,
+            user_burst: int,
+            clock: Callable[[], float] = time.monotonic,
+    ):
+        self._clock = clock
+        self._bot_bucket = TokenBucket(bot_rate, bot_burst, clock())
+        self._limits = {"group": (group_rate, group_burst), "user": (user_rate, user_burst)}
+        self._buckets: Dict[Target, TokenBucket] = {}
+        # 优先级 -> 目标 -> 待发送任务, OrderedDict 的顺序即轮转顺序
+        self._queues: Dict[int, "OrderedDict[Target, Deque[_Job]]"] = {
+            priority: OrderedDict() for priority in Priority
+        }
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._running: Set[asyncio.Task] = set()
+        self.pending = 0  # 排队中的任务数
+        self.sent = 0  # 已发出的任务数
+        self.queued_time_total = 0.0  # 累计排队时间(秒)
+        self.queued_time_max = 0.0  # 最长排队时间(秒)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "pending": self.pending,
+            "sent": self.sent,
+            "queued_time_avg": self.queued_time_total / self.sent if self.sent else 0.0,
+            "queued_time_max": self.queued_time_max,
+        }
+
+    async def submit(
+            self,
+            target: Target,
+            func: Callable[[], Awaitable[T]],
+            priority: Priority = Priority.NORMAL,
+    ) -> T:
+        """
+        排队等待令牌后执行 func
+        :param target: 发送目标 ("group", 群号) 或 ("user", qq号)
+        :param func: 实际发送的函数
+        :param priority: 优先级
+        :return: func 的返回值
+        """
+        future = self._enqueue(target, func, priority)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        self._wakeup.set()
+        return await future
+
+    def _enqueue(self, target: Target, func: Callable[[], Awaitable[Any]], priority: Priority) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self._queues[priority].setdefault(target, deque()).append(_Job(func, future, self._clock()))
+        self.pending += 1
+        return future
+
+    async def stop(self) -> None:
+        """停止调度, 未发送的任务会被取消"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        for queue in self._queues.values():
+            for jobs in queue.values():
+                for job in jobs:
+                    job.future.cancel()
+            queue.clear()
+        self.pending = 0
+
+    def _bucket(self, target: Target) -> TokenBucket:
+        bucket = self._buckets.get(target)
+        if bucket is None:
+            if len(self._buckets) >= _MAX_IDLE_BUCKETS:
+                now = self._clock()
+                self._buckets = {k: v for k, v in self._buckets.items() if not v.full(now)}
+            bucket = self._buckets[target] = TokenBucket(*self._limits[target[0]], self._clock())
+        return bucket
+
+    def _next_job(self) -> Tuple[Optional[_Job], Optional[float]]:
+        """取出下一个可以发送的任务, 没有时返回需要等待的秒数"""
+        if not self.pending:
+            return None, None
+        now = self._clock()
+        if (wait := self._bot_bucket.wait_time(now)) > 0:
+            return None, wait
+        min_wait = None
+        for queue in self._queues.values():
+            for target, jobs in queue.items():
+                bucket = self._bucket(target)
+                wait = bucket.wait_time(now)
+                if wait > 0:
+                    min_wait = wait if min_wait is None else min(min_wait, wait)
+                    continue
+                job = jobs.popleft()
+                if jobs:
+                    queue.move_to_end(target)  # 轮到下一个目标
+                else:
+                    del queue[target]
+                bucket.consume(now)
+                self._bot_bucket.consume(now)
+                return job, None
+        return None, min_wait
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            job, wait = self._next_job()
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self.pending -= 1
+            if job.future.done():  # 调用方已经取消
+                continue
+            queued = self._clock() - job.queued_at
+            self.sent += 1
+            self.queued_time_total += queued
+            self.queued_time_max = max(self.queued_time_max, queued)
+            task = asyncio.create_task(self._execute(job))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    @staticmethod
+    async def _execute(job: _Job) -> None:
+        try:
+            result = await job.func()
+        except Exception as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            if not job.future.done():
+                job.future.set_result(result)
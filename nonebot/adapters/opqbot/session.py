@@ -0,0 +1,155 @@
+import asyncio
+import time
+from typing import Dict, Optional
+
+from nonebot.drivers import HTTPClientMixin, HTTPClientSession, Request, Response
+
+from .exception import CircuitOpen
+from .log import log
+
+
+class CircuitBreaker:
+    """
+    熔断器: 连续失败 failure_threshold 次后打开, 打开期间请求直接失败;
+    recovery_timeout 秒后放行一个试探请求, 成功则恢复, 失败则继续熔断
+    :param name: 日志中显示的名称
+    :param failure_threshold: 打开熔断的连续失败次数, 0 为不熔断
+    :param recovery_timeout: 熔断持续的秒数
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.recovery_timeout:
+            return "open"
+        return "half_open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._probing:
+            self._probing = True  # 只放行一个试探请求
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self._probing or (
+                self.opened_at is None and self.failure_threshold and self.failures >= self.failure_threshold
+        ):
+            self.opened_at = time.monotonic()
+            log("WARNING", f"Circuit for {self.name} opened after {self.failures} consecutive failures")
+        self._probing = False
+
+    def release(self) -> None:
+        """试探请求被取消, 允许下一个请求继续试探"""
+        self._probing = False
+
+
+class SessionPool:
+    """
+    按 OPQ 服务地址复用长连接的 HTTP 会话
+    :param driver: 支持 HTTP 客户端的驱动器
+    :param pool_size: 所有服务地址合计的最大并发连接数
+    :param max_connections_per_host: 单个服务地址的最大并发连接数
+    :param keepalive: 是否复用连接, 关闭时每个请求都新建连接
+    :param circuit_failures: 单个服务地址连续失败多少次后熔断, 0 为不熔断
+    :param circuit_reset: 熔断持续的秒数
+    """
+
+    def __init__(
+            self,
+            driver: HTTPClientMixin,
+            pool_size: int = 100,
+            max_connections_per_host: int = 20,
+            keepalive: bool = True,
+            circuit_failures: int = 5,
+            circuit_reset: float = 30.0,
+    ):
+        self.driver = driver
+        self.keepalive = keepalive
+        self.max_connections_per_host = max_connections_per_host
+        self.circuit_failures = circuit_failures
+        self.circuit_reset = circuit_reset
+        self.pool_size = pool_size
+        # 在事件循环中第一次使用时创建, Python 3.9 在这里创建会绑定到错误的事件循环
+        self._pool_limit: Optional[asyncio.Semaphore] = None
+        self._host_limits: Dict[str, asyncio.Semaphore] = {}
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self._sessions: Dict[str, HTTPClientSession] = {}
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def _get_session(self, base_url: str) -> Optional[HTTPClientSession]:
+        if not self.keepalive or not hasattr(self.driver, "get_session"):
+            return None  # 驱动器不支持会话时退回到逐个请求
+        if session := self._sessions.get(base_url):
+            return session
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if base_url not in self._sessions:
+                session = self.driver.get_session(headers={"Connection": "keep-alive"})
+                await session.setup()
+                self._sessions[base_url] = session
+                log("DEBUG", f"HTTP session for {base_url} created")
+        return self._sessions[base_url]
+
+    def breaker(self, base_url: str) -> CircuitBreaker:
+        if (breaker := self.breakers.get(base_url)) is None:
+            breaker = self.breakers[base_url] = CircuitBreaker(base_url, self.circuit_failures, self.circuit_reset)
+        return breaker
+
+    async def request(self, base_url: str, setup: Request) -> Response:
+        """
+        通过 base_url 对应的会话发送请求
+        请求出错或返回 5xx 计为失败, 该服务熔断期间直接抛出 CircuitOpen
+        """
+        breaker = self.breaker(base_url)
+        if not breaker.allow():
+            raise CircuitOpen(f"{base_url} is unavailable, retry after {breaker.recovery_timeout}s")
+        session = await self._get_session(base_url)
+        if self._pool_limit is None:
+            self._pool_limit = asyncio.Semaphore(self.pool_size)
+        if (host_limit := self._host_limits.get(base_url)) is None:
+            host_limit = self._host_limits[base_url] = asyncio.Semaphore(self.max_connections_per_host)
+        try:
+            async with self._pool_limit, host_limit:
+                if session is None:
+                    resp = await self.driver.request(setup)
+                else:
+                    resp = await session.request(setup)
+        except asyncio.CancelledError:
+            breaker.release()
+            raise
+        except Exception:
+            breaker.record_failure()
+            raise
+        if resp.status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        return resp
+
+    async def close(self) -> None:
+        """关闭所有会话"""
+        sessions, self._sessions = self._sessions, {}
+        for base_url, session in sessions.items():
+            try:
+                await session.close()
+            except Exception as e:
+                log("WARNING", f"Error while closing HTTP session for {base_url}", e)
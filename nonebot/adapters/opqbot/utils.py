@@ -1,6 +1,11 @@
 import asyncio
 import base64
+import binascii
+import json
+import os
+import random
 import re
+import struct
 from functools import partial
 from io import BytesIO
 from pathlib import Path
@@ -15,11 +20,29 @@ from typing import (
     Callable,
     Optional,
     Awaitable,
+    AsyncIterable,
+    AsyncIterator,
     overload,
 )
 from typing_extensions import ParamSpec, Concatenate
 from PIL import Image
 
+# 优先使用更快的 json 解析库
+try:
+    import orjson
+
+    json_loads: Callable[[Union[str, bytes]], Any] = orjson.loads
+    JSON_BACKEND = "orjson"
+except ImportError:  # pragma: no cover
+    try:
+        import msgspec
+
+        json_loads = msgspec.json.decode
+        JSON_BACKEND = "msgspec"
+    except ImportError:
+        json_loads = json.loads
+        JSON_BACKEND = "json"
+
 from enum import Enum
 
 if TYPE_CHECKING:
@@ -108,24 +131,258 @@ def _resolve_data_type(data: _T_Data) -> Tuple[FileType, _T_Data]:
     assert False, "正常情况下这里应该是执行不到的"
 
 
-def get_image_size(data: Union[bytes, BytesIO, str, Path]) -> Tuple[int, int]:
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# JPEG 中携带尺寸的 SOF 段, 排除 DHT(C4) JPG(C8) DAC(CC)
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+_JPEG_STANDALONE_MARKERS = {0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7, 0xD8}
+
+_Reader = Callable[[int, int], bytes]
+
+
+def _probe_image_size(read: _Reader) -> Optional[Tuple[int, int]]:
+    """
+    只读取文件头获取 PNG/JPEG/GIF/WebP 的尺寸
+    :param read: read(offset, size) 读取指定位置的字节
+    :return: (宽, 高), 无法识别时返回 None
+    """
+    head = read(0, 32)
+    if head[:8] == _PNG_SIGNATURE and head[12:16] == b"IHDR" and len(head) >= 24:
+        return struct.unpack(">II", head[16:24])
+    if head[:6] in (b"GIF87a", b"GIF89a") and len(head) >= 10:
+        return struct.unpack("<HH", head[6:10])
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP" and len(head) >= 30:
+        chunk = head[12:16]
+        if chunk == b"VP8 ":
+            width, height = struct.unpack("<HH", head[26:30])
+            return width & 0x3FFF, height & 0x3FFF
+        if chunk == b"VP8L" and head[20] == 0x2F:
+            bits = int.from_bytes(head[21:25], "little")
+            return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+        if chunk == b"VP8X":
+            return int.from_bytes(head[24:27], "little") + 1, int.from_bytes(head[27:30], "little") + 1
+        return None
+    if head[:2] == b"\xff\xd8":
+        # 逐段跳过, 只读取每段的段头
+        offset = 2
+        while True:
+            marker = read(offset, 4)
+            if len(marker) < 4 or marker[0] != 0xFF:
+                return None
+            code = marker[1]
+            if code == 0xFF:  # 填充字节
+                offset += 1
+                continue
+            if code in _JPEG_STANDALONE_MARKERS:
+                offset += 2
+                continue
+            if code in _JPEG_SOF_MARKERS:
+                sof = read(offset + 5, 4)
+                if len(sof) < 4:
+                    return None
+                height, width = struct.unpack(">HH", sof)
+                return width, height
+            if code in (0xD9, 0xDA):  # 到了图像数据还没找到 SOF
+                return None
+            offset += 2 + struct.unpack(">H", marker[2:4])[0]
+    return None
+
+
+def _buffer_reader(data: Union[bytes, bytearray, memoryview]) -> _Reader:
+    view = memoryview(data)
+    return lambda offset, size: bytes(view[offset:offset + size])
+
+
+def _base64_reader(data: str) -> _Reader:
+    """按需解码 base64 的对应片段, 不解码整张图片"""
+
+    def read(offset: int, size: int) -> bytes:
+        start = offset // 3 * 4
+        end = -(-(offset + size) // 3) * 4
+        return base64.b64decode(data[start:end])[offset % 3:offset % 3 + size]
+
+    return read
+
+
+def get_image_size(data: Union[bytes, bytearray, memoryview, BytesIO, str, Path]) -> Tuple[int, int]:
     """获取图像尺寸
-    :param data: 目标图像。接收图像路径或图像二进制数据
+    优先只解析文件头, 无法识别的格式才交给 PIL
+    :param data: 目标图像。接收图像路径, 图像二进制数据或 base64 文本
     :return: (长, 宽)
     """
-    d_type, data = _resolve_data_type(data)
-    if d_type == FileType.TYPE_URL:
-        raise "不能是url"
-    elif d_type == FileType.TYPE_BASE64:
-        image = Image.open(BytesIO(base64.b64decode(data)))
-    elif d_type == FileType.TYPE_PATH:
-        image = Image.open(data.absolute() if isinstance(data, Path) else data)
+    if isinstance(data, BytesIO):
+        data = data.getbuffer()
+    if isinstance(data, str):
+        if data.startswith("http://") or data.startswith("https://"):
+            raise TypeError("不能是url")
+        if data.startswith("base64://"):
+            data = data[9:]
+        elif len(data) < 1000 and Path(data).exists():
+            data = Path(data)
+
+    if isinstance(data, Path):
+        with open(data, "rb") as f:
+            def read(offset: int, size: int) -> bytes:
+                f.seek(offset)
+                return f.read(size)
+
+            size = _probe_image_size(read)
+        if size is None:
+            size = Image.open(data).size
+    elif isinstance(data, (bytes, bytearray, memoryview)):
+        size = _probe_image_size(_buffer_reader(data))
+        if size is None:
+            size = Image.open(BytesIO(data)).size
+    elif isinstance(data, str):
+        try:
+            size = _probe_image_size(_base64_reader(data))
+        except (binascii.Error, ValueError):
+            size = None
+        if size is None:
+            size = Image.open(BytesIO(base64.b64decode(data))).size
     else:
         raise TypeError("参数类型有误")
-    width, height = image.size
+    width, height = size
     return height, width
 
 
+_T_Stream = Union[str, Path, bytes, bytearray, memoryview, BytesIO, BinaryIO, AsyncIterable[bytes]]
+_T_Progress = Callable[[int, Optional[int]], Any]
+
+
+def _stream_size(source: _T_Stream) -> Optional[int]:
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return len(source)
+    if isinstance(source, (str, Path)):
+        return os.path.getsize(source)
+    if isinstance(source, BytesIO):
+        return source.getbuffer().nbytes - source.tell()
+    if hasattr(source, "fileno"):
+        try:
+            return os.fstat(source.fileno()).st_size - source.tell()
+        except (OSError, ValueError):
+            return None
+    return None
+
+
+async def _iter_source(source: _T_Stream, chunk_size: int) -> AsyncIterator[bytes]:
+    """按块读取数据源"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        view = memoryview(source)
+        for offset in range(0, len(view), chunk_size):
+            yield view[offset:offset + chunk_size]
+    elif isinstance(source, (str, Path)):
+        with open(source, "rb") as f:
+            while chunk := await asyncio.to_thread(f.read, chunk_size):
+                yield chunk
+    elif isinstance(source, BytesIO):
+        while chunk := source.read(chunk_size):
+            yield chunk
+    elif hasattr(source, "read"):
+        while chunk := await asyncio.to_thread(source.read, chunk_size):
+            yield chunk
+    else:
+        async for chunk in source:
+            yield chunk
+
+
+async def iter_base64(
+        source: _T_Stream,
+        chunk_size: int = 768 * 1024,
+        progress: Optional[_T_Progress] = None,
+) -> AsyncIterator[bytes]:
+    """
+    分块读取数据源并增量编码为 base64, 内存占用只与 chunk_size 有关
+    :param source: 文件路径, 文件对象, bytes 或异步迭代器
+    :param chunk_size: 每次读取的字节数
+    :param progress: 进度回调 progress(已读取字节数, 总字节数或 None)
+    """
+    total = _stream_size(source)
+    sent = 0
+    rest = b""  # 凑不满 3 字节的部分留到下一块, 保证中间不出现填充
+    async for chunk in _iter_source(source, chunk_size):
+        sent += len(chunk)
+        if rest:
+            chunk = rest + chunk
+        cut = len(chunk) - len(chunk) % 3
+        rest = bytes(chunk[cut:])
+        if cut:
+            yield base64.b64encode(chunk[:cut])
+        if progress is not None:
+            progress(sent, total)
+    if rest:
+        yield base64.b64encode(rest)
+
+
+async def iter_json_with_base64(
+        body: dict,
+        key: str,
+        source: _T_Stream,
+        chunk_size: int = 768 * 1024,
+        progress: Optional[_T_Progress] = None,
+) -> AsyncIterator[bytes]:
+    """
+    生成 JSON 请求体, 其中 body 里 key 字段的值为 source 的 base64, 以流的形式写入
+    :param body: 请求体, key 字段会被替换
+    :param key: 需要流式写入的字段名(如 Base64Buf)
+    """
+    placeholder = "__opq_stream_placeholder__"
+
+    def fill(obj: Any) -> Any:
+        if isinstance(obj, dict):
+            return {k: placeholder if k == key else fill(v) for k, v in obj.items()}
+        return obj
+
+    head, tail = json.dumps(fill(body), ensure_ascii=False).split(f'"{placeholder}"')
+    yield f'{head}"'.encode()
+    async for chunk in iter_base64(source, chunk_size, progress):
+        yield chunk
+    yield f'"{tail}'.encode()
+
+
+K = TypeVar("K")
+
+
+class Backoff:
+    """
+    带随机抖动的指数退避
+    :param initial: 第一次重连前的等待秒数
+    :param maximum: 最长等待秒数
+    :param factor: 每次失败后等待时间的倍数
+    """
+
+    def __init__(self, initial: float, maximum: float, factor: float = 2.0):
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.attempts = 0
+
+    def next_delay(self) -> float:
+        delay = min(self.maximum, self.initial * self.factor ** self.attempts)
+        self.attempts += 1
+        # 在 [delay/2, delay] 之间随机, 避免多个连接同时重连
+        return random.uniform(delay / 2, delay)
+
+    def reset(self) -> None:
+        self.attempts = 0
+
+
+class SingleFlight(Generic[K, R]):
+    """相同 key 的并发调用只执行一次, 其余调用方等待同一个结果"""
+
+    def __init__(self) -> None:
+        self._calls: Dict[K, "asyncio.Future[R]"] = {}
+
+    def __contains__(self, key: K) -> bool:
+        return key in self._calls
+
+    async def do(self, key: K, func: Callable[[], Awaitable[R]]) -> R:
+        if (task := self._calls.get(key)) is None:
+            task = self._calls[key] = asyncio.ensure_future(func())
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        # 某个调用方被取消时不影响其它调用方
+        return await asyncio.shield(task)
+
+
 class API(Generic[B, P, R]):
     def __init__(self, func: Callable[Concatenate[B, P], Awaitable[R]]) -> None:
         self.func = func
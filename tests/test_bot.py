@@ -0,0 +1,48 @@
+import asyncio
+from types import SimpleNamespace
+from typing import List
+
+from nonebot.adapters.opqbot.bot import Bot
+from nonebot.adapters.opqbot.directory import UidIndex
+
+
+class FakeBot:
+    """只带 resolve_uid 需要的属性, 直接调用 Bot 上的方法"""
+
+    def __init__(self):
+        self.adapter = SimpleNamespace(uid_index=UidIndex(maxsize=16))
+        self.adapter.uid_index.add(12345, "u_12345")
+        self.members = SimpleNamespace(get_member=self._get_member)
+        self.roster = SimpleNamespace(find_friend=self._find_friend)
+        self.requests: List[dict] = []
+
+    async def _get_member(self, group_id: int, uin: int):
+        return SimpleNamespace(Uid=f"m_{uin}") if uin == 23456 else None
+
+    async def _find_friend(self, uin: int):
+        return None
+
+    async def resolve_uid(self, user_id, group_id=None):
+        return await Bot.resolve_uid(self, user_id, group_id)
+
+    def build_request(self, payload: dict, cmd: str) -> dict:
+        return {"CgiCmd": cmd, "CgiRequest": payload}
+
+    async def post(self, request: dict):
+        self.requests.append(request)
+
+
+def test_resolve_uid_accepts_digit_strings():
+    bot = FakeBot()
+    assert asyncio.run(Bot.resolve_uid(bot, 12345)) == "u_12345"
+    assert asyncio.run(Bot.resolve_uid(bot, "12345")) == "u_12345"
+    assert asyncio.run(Bot.resolve_uid(bot, "23456", group_id=1)) == "m_23456"
+    assert asyncio.run(Bot.resolve_uid(bot, "u_abc")) == "u_abc"
+
+
+def test_set_group_ban_with_get_user_id():
+    bot = FakeBot()
+    asyncio.run(Bot.set_group_ban(bot, 1, "23456", 60))
+    asyncio.run(Bot.send_like(bot, "12345"))
+    assert bot.requests[0]["CgiRequest"]["Uid"] == "m_23456"
+    assert bot.requests[1]["CgiRequest"]["Uid"] == "u_12345"
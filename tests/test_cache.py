@@ -0,0 +1,108 @@
+import asyncio
+
+from nonebot.drivers import Response
+
+from nonebot.adapters.opqbot import MessageSegment
+from nonebot.adapters.opqbot.cache import (
+    DownloadCache, MemoryUploadCache, SqliteUploadCache, make_message_key, make_upload_key
+)
+from nonebot.adapters.opqbot.models import UploadImageVoiceResponse
+
+
+def voice_response() -> UploadImageVoiceResponse:
+    # 语音的上传结果没有宽高
+    return UploadImageVoiceResponse(FileMd5="md5", FileSize=1024, FileId=None, FileToken="token")
+
+
+def upload_key(command_id: int, file) -> str:
+    return asyncio.run(make_upload_key(command_id, file))
+
+
+def message_key(message) -> str:
+    return asyncio.run(make_message_key(message))
+
+
+def test_memory_cache_voice_round_trip():
+    cache = MemoryUploadCache(ttl=60, maxsize=8)
+    key = upload_key(29, b"voice")
+    asyncio.run(cache.set(key, voice_response()))
+    cached = asyncio.run(cache.get(key))
+    assert cached == voice_response()
+    assert cached.Height is None and cached.Width is None
+
+
+def test_sqlite_cache_voice_round_trip(tmp_path):
+    cache = SqliteUploadCache(tmp_path / "upload_cache.sqlite3", ttl=60, maxsize=8)
+    key = upload_key(29, b"voice")
+    asyncio.run(cache.set(key, voice_response()))
+    assert asyncio.run(cache.get(key)) == voice_response()
+    cache.close()
+
+
+def test_sqlite_cache_evicts_by_deferred_access_time(tmp_path):
+    async def main():
+        cache = SqliteUploadCache(tmp_path / "upload_cache.sqlite3", ttl=60, maxsize=2)
+        await cache.set("old", voice_response())
+        await cache.set("new", voice_response())
+        await cache.get("old")  # 只记在内存中, 下次写入前写回
+        await cache.set("third", voice_response())
+        result = [await cache.get(key) is not None for key in ("old", "new", "third")]
+        cache.close()
+        return result
+
+    assert asyncio.run(main()) == [True, False, True]
+
+
+def test_file_keys_match_content_keys(tmp_path):
+    path = tmp_path / "a.png"
+    path.write_bytes(b"png" * 1024 * 1024)
+    assert upload_key(2, path) == upload_key(2, str(path)) == upload_key(2, b"png" * 1024 * 1024)
+
+
+def test_url_is_not_an_upload_key():
+    # url 的内容可能变化, 必须下载后按内容计算 key
+    assert upload_key(2, "https://example.com/chart.png") is None
+    assert upload_key(2, b"png") == upload_key(2, b"png")
+    assert upload_key(2, b"png") != upload_key(2, b"png2")
+
+
+def test_download_cache_evicts_disk_on_the_loop(tmp_path):
+    async def fetch(url, headers):
+        return Response(200, content=url.encode() * 100, headers={})
+
+    async def main():
+        cache = DownloadCache(fetch, tmp_path, memory_size=0, disk_size=2000)
+        for i in range(10):
+            await cache.get(f"https://example.com/{i:02d}")
+        return cache
+
+    cache = asyncio.run(main())
+    on_disk = sum(f.stat().st_size for f in tmp_path.glob("*/*") if f.suffix not in (".json", ".tmp"))
+    assert cache.stats()["disk_used"] == on_disk <= 2000
+    assert len(cache._entries) == len([f for f in tmp_path.glob("*/*") if f.suffix == ".json"])
+
+
+def test_url_media_messages_are_not_cached():
+    assert message_key([MessageSegment.image("https://example.com/a.png")]) is None
+    assert message_key([MessageSegment.image(b"png")]) == message_key([MessageSegment.image(b"png")])
+
+
+def test_local_file_is_read_once_per_version(tmp_path, monkeypatch):
+    from nonebot.adapters.opqbot import cache
+
+    reads = []
+    hash_file = cache._hash_file
+    monkeypatch.setattr(cache, "_hash_file", lambda path: reads.append(path) or hash_file(path))
+    path = tmp_path / "b.png"
+    path.write_bytes(b"first")
+
+    async def main():
+        key = await make_message_key([MessageSegment.image(path)])
+        assert await make_upload_key(2, path) == await make_upload_key(2, str(path))
+        return key
+
+    first = asyncio.run(main())
+    assert len(reads) == 1
+    path.write_bytes(b"second version")
+    assert asyncio.run(main()) != first
+    assert len(reads) == 2
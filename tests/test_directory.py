@@ -0,0 +1,122 @@
+import asyncio
+import json
+from datetime import datetime
+from typing import Dict, List
+
+from nonebot.adapters.opqbot.directory import MemberDirectory, Roster, UidIndex
+from nonebot.adapters.opqbot.event import GroupMemberExitEvent
+from nonebot.adapters.opqbot.models import FriendInfo, MemberInfo
+from nonebot.adapters.opqbot.models.response import GroupData
+
+
+def member(uin: int) -> MemberInfo:
+    return MemberInfo(
+        CreditLevel=0, GroupCard=None, JoinTime=datetime.now(), LastSpeakTime=datetime.now(),
+        Level=1, MemberFlag=0, Nick=f"user{uin}", Uid=f"u_{uin}", Uin=uin,
+    )
+
+
+class FakeBot:
+    def __init__(self, groups: Dict[int, List[MemberInfo]]):
+        self.groups = groups
+
+    async def fetch_group_member_list(self, group_id: int) -> List[MemberInfo]:
+        return list(self.groups[group_id])
+
+
+def exit_event(group_id: int, uid: str) -> GroupMemberExitEvent:
+    return GroupMemberExitEvent.model_construct(group_id=group_id, user_uid=uid)
+
+
+def test_exit_removes_uid_entry():
+    directory = MemberDirectory(FakeBot({1: [member(10), member(11)]}), ttl=60)
+    asyncio.run(directory.get_members(1))
+    assert directory.get_by_uid("u_10").Uin == 10
+
+    directory.observe(exit_event(1, "u_10"))
+    assert directory.get_by_uid("u_10") is None
+    assert directory.get_by_uid("u_11").Uin == 11
+
+
+def test_exit_falls_back_to_other_group():
+    directory = MemberDirectory(FakeBot({1: [member(10)], 2: [member(10)]}), ttl=60)
+    asyncio.run(directory.get_members(1))
+    asyncio.run(directory.get_members(2))
+
+    directory.observe(exit_event(2, "u_10"))
+    assert directory.get_by_uid("u_10") is not None
+    directory.observe(exit_event(1, "u_10"))
+    assert directory.get_by_uid("u_10") is None
+
+
+def test_refresh_prunes_departed_members():
+    bot = FakeBot({1: [member(10), member(11)]})
+    directory = MemberDirectory(bot, ttl=60)
+    asyncio.run(directory.get_members(1))
+
+    bot.groups[1] = [member(11)]
+    asyncio.run(directory.get_members(1, refresh=True))
+    assert directory.get_by_uid("u_10") is None
+    assert directory.get_by_uid("u_11").Uin == 11
+    assert len(directory._by_uid) == 1
+
+
+def group(code: int) -> GroupData:
+    return GroupData(CreateTime=datetime.now(), GroupCnt=0, GroupCode=code, GroupName=f"group{code}", MemberCnt=1)
+
+
+def friend(uin: int) -> FriendInfo:
+    return FriendInfo(
+        Age=0, City="", Country="", Head="", Mark="", Nick=f"user{uin}", Province="", Sex=0, Signature="",
+        TagId=0, Uid=f"u_{uin}", Uin=uin,
+    )
+
+
+class FakeRosterBot:
+    def __init__(self):
+        self.fetches = 0
+
+    async def fetch_group_list(self) -> List[GroupData]:
+        self.fetches += 1
+        return [group(1), group(2)]
+
+    async def fetch_friend_list(self) -> List[FriendInfo]:
+        self.fetches += 1
+        return [friend(10)]
+
+
+def test_roster_returns_copies():
+    roster = Roster(FakeRosterBot(), ttl=60)
+    groups = asyncio.run(roster.get_groups())
+    groups.clear()
+    asyncio.run(roster.get_friends()).append(friend(11))
+    assert [g.GroupCode for g in asyncio.run(roster.get_groups())] == [1, 2]
+    assert asyncio.run(roster.find_friend(11)) is None
+
+
+def test_roster_persists_across_restarts(tmp_path):
+    path = tmp_path / "roster_10000.json"
+    bot = FakeRosterBot()
+
+    async def fetch_both(roster: Roster):
+        return await asyncio.gather(roster.get_groups(), roster.get_friends())
+
+    asyncio.run(fetch_both(Roster(bot, ttl=60, persist_path=path)))
+    assert bot.fetches == 2
+    # 同时刷新的两份列表都写入了文件
+    assert set(json.loads(path.read_text(encoding="utf-8"))) == {"groups", "friends"}
+
+    index = UidIndex(16)
+    restarted = Roster(bot, ttl=60, persist_path=path, uid_index=index)
+    groups, friends = asyncio.run(fetch_both(restarted))
+    assert bot.fetches == 2  # 有效期内直接使用文件中的列表
+    assert [g.GroupCode for g in groups] == [1, 2] and friends == [friend(10)]
+    assert index.get_uid(10) == "u_10"
+
+
+def test_roster_ignores_broken_cache_file(tmp_path):
+    path = tmp_path / "roster_10000.json"
+    path.write_text("{not json", encoding="utf-8")
+    bot = FakeRosterBot()
+    assert [g.GroupCode for g in asyncio.run(Roster(bot, ttl=60, persist_path=path).get_groups())] == [1, 2]
+    assert bot.fetches == 1
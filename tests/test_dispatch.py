@@ -0,0 +1,77 @@
+import asyncio
+
+from nonebot.adapters.opqbot import metrics
+from nonebot.adapters.opqbot.dispatch import EventDispatcher, OverflowPolicy
+from nonebot.adapters.opqbot.event import GroupMessageEvent
+
+
+async def _noop(event) -> None:
+    pass
+
+
+def test_dropped_events_are_counted():
+    async def main():
+        dropped = []
+        dispatcher = EventDispatcher(_noop, maxsize=2, policy=OverflowPolicy.DROP_OLDEST, on_drop=dropped.append)
+        for event in ("a", "b", "c", "d"):
+            await dispatcher.put(event)
+        return dispatcher, dropped
+
+    dispatcher, dropped = asyncio.run(main())
+    assert dropped == ["a", "b"]
+    assert dispatcher.dropped == 2
+
+
+def test_dispatch_dropped_is_a_counter():
+    assert isinstance(metrics.dispatch_dropped, metrics.Counter)
+    assert metrics.dispatch_dropped.name == "opq_dispatch_dropped_total"
+
+
+def message_event(group_id: int, user_id: int) -> GroupMessageEvent:
+    return GroupMessageEvent.model_construct(group_id=group_id, user_id=user_id)
+
+
+def test_same_session_is_handled_in_arrival_order():
+    finished = []
+    delays = {}
+
+    async def handler(event) -> None:
+        name, delay = delays[id(event)]
+        await asyncio.sleep(delay)
+        finished.append(name)
+
+    async def main():
+        dispatcher = EventDispatcher(handler, workers=4)
+        dispatcher.start()
+        for name, group_id, user_id, delay in [
+            ("a1", 1, 10, 0.05), ("a2", 1, 10, 0.02), ("b1", 1, 20, 0.0), ("a3", 1, 10, 0.0),
+        ]:
+            event = message_event(group_id, user_id)
+            delays[id(event)] = (name, delay)
+            await dispatcher.put(event)
+        await asyncio.wait_for(dispatcher.join(), 5)
+        await dispatcher.stop()
+
+    asyncio.run(main())
+    assert [name for name in finished if name.startswith("a")] == ["a1", "a2", "a3"]
+    assert finished.index("b1") < finished.index("a1")  # 其它会话不会被 a1 阻塞
+
+
+def test_stop_discards_queued_events():
+    handled = []
+
+    async def handler(event) -> None:
+        handled.append(event)
+
+    async def main():
+        dispatcher = EventDispatcher(handler, workers=1)
+        for i in range(3):
+            await dispatcher.put(message_event(1, i))
+        await dispatcher.stop()
+        dispatcher.start()
+        await asyncio.sleep(0.01)
+        await asyncio.wait_for(dispatcher.join(), 1)  # 丢弃的事件也已经 task_done
+        await dispatcher.stop()
+
+    asyncio.run(main())
+    assert handled == []
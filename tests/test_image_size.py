@@ -0,0 +1,70 @@
+import base64
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from nonebot.adapters.opqbot.utils import _base64_reader, _buffer_reader, _probe_image_size, get_image_size
+
+
+def encode(fmt: str, mode: str = "RGB", size=(123, 45), **params) -> bytes:
+    buffer = BytesIO()
+    Image.new(mode, size, (10, 20, 30, 40)[:len(mode)]).save(buffer, fmt, **params)
+    return buffer.getvalue()
+
+
+def exif() -> bytes:
+    data = Image.Exif()
+    data[0x010F] = "camera" * 200  # Make, 让 APP1 段足够长
+    return data.tobytes()
+
+
+IMAGES = {
+    "png": lambda: encode("PNG"),
+    "gif": lambda: encode("GIF"),
+    "jpeg": lambda: encode("JPEG"),
+    "jpeg progressive": lambda: encode("JPEG", progressive=True),
+    "jpeg exif": lambda: encode("JPEG", exif=exif()),
+    "webp lossy": lambda: encode("WEBP"),
+    "webp lossless": lambda: encode("WEBP", lossless=True),
+    "webp alpha": lambda: encode("WEBP", mode="RGBA"),
+}
+
+
+@pytest.mark.parametrize("name", IMAGES)
+def test_probe_matches_pil(name):
+    data = IMAGES[name]()
+    expected = Image.open(BytesIO(data)).size
+    assert _probe_image_size(_buffer_reader(data)) == expected
+    assert _probe_image_size(_base64_reader(base64.b64encode(data).decode())) == expected
+    assert get_image_size(data) == expected[::-1]  # get_image_size 返回 (高, 宽)
+
+
+def test_jpeg_exif_is_skipped_to_sof():
+    data = IMAGES["jpeg exif"]()
+    # APP1 在 SOF 之前, 并且比一次读取的文件头更长
+    assert 0 <= data.find(b"\xff\xe1") < 32 < len(exif()) < data.find(b"\xff\xc0")
+    assert _probe_image_size(_buffer_reader(data)) == (123, 45)
+
+
+@pytest.mark.parametrize("offset", range(7))
+@pytest.mark.parametrize("size", [1, 2, 4, 5, 32])
+def test_base64_reader_unaligned_offsets(offset, size):
+    data = bytes(range(40))
+    read = _base64_reader(base64.b64encode(data).decode())
+    assert read(offset, size) == data[offset:offset + size]
+
+
+@pytest.mark.parametrize("name", IMAGES)
+def test_truncated_input_returns_none(name):
+    data = IMAGES[name]()
+    expected = Image.open(BytesIO(data)).size
+    for length in range(len(data)):
+        # 截断在尺寸字段之前时无法识别, 之后则已经能读出正确的尺寸
+        assert _probe_image_size(_buffer_reader(data[:length])) in (None, expected)
+    assert _probe_image_size(_buffer_reader(data[:6])) is None
+
+
+@pytest.mark.parametrize("data", [b"", b"garbage" * 10, b"\xff\xd8" + b"\x00" * 40, b"RIFF\x00\x00\x00\x00WEBPXXXX" + b"\x00" * 20])
+def test_garbage_returns_none(data):
+    assert _probe_image_size(_buffer_reader(data)) is None
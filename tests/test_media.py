@@ -0,0 +1,77 @@
+import asyncio
+import hashlib
+from types import SimpleNamespace
+
+import pytest
+
+from nonebot.adapters.opqbot.exception import NetworkError
+from nonebot.adapters.opqbot.media import MediaStore
+
+CONTENT = b"image data" * 1000
+MD5 = hashlib.md5(CONTENT).hexdigest()
+
+
+class RequestOnlyDriver:
+    """没有 stream_request 的旧版本驱动器"""
+
+    def __init__(self, content: bytes = CONTENT, status_code: int = 200):
+        self.content = content
+        self.status_code = status_code
+        self.requests = 0
+
+    async def request(self, request):
+        self.requests += 1
+        await asyncio.sleep(0)
+        return SimpleNamespace(status_code=self.status_code, content=self.content)
+
+
+class StreamDriver(RequestOnlyDriver):
+    async def stream_request(self, request, chunk_size):
+        self.requests += 1
+        for i in range(0, len(self.content), chunk_size):
+            yield SimpleNamespace(status_code=self.status_code, content=self.content[i:i + chunk_size])
+
+
+@pytest.mark.parametrize("driver_class", [RequestOnlyDriver, StreamDriver])
+def test_fetch_stores_verified_content(tmp_path, driver_class):
+    store = MediaStore(driver_class(), tmp_path)
+    path = asyncio.run(store.fetch("https://example.com/a", MD5))
+    assert path.read_bytes() == CONTENT
+    assert store.stats()["used"] == len(CONTENT)
+
+
+def test_fetch_rejects_md5_mismatch(tmp_path):
+    store = MediaStore(RequestOnlyDriver(b"<html>error</html>"), tmp_path)
+    with pytest.raises(NetworkError):
+        asyncio.run(store.fetch("https://example.com/a", MD5))
+    assert store.get(MD5) is None
+    assert not list(tmp_path.glob("*/*"))
+
+
+def test_prefetch_is_bounded(tmp_path):
+    driver = RequestOnlyDriver()
+
+    async def main():
+        store = MediaStore(driver, tmp_path, prefetch_concurrency=2, prefetch_queue_size=3)
+        for i in range(10):
+            store.prefetch(f"https://example.com/{i}", hashlib.md5(str(i).encode()).hexdigest())
+        assert len(store._prefetch_workers) == 2
+        assert store.stats()["prefetching"] == 3
+        await store._prefetch_queue.join()
+        await store.close()
+
+    asyncio.run(main())
+    assert driver.requests == 3
+
+
+def test_quota_evicts_old_files(tmp_path):
+    async def main():
+        store = MediaStore(RequestOnlyDriver(), tmp_path, quota=len(CONTENT) * 2)
+        for i in range(4):
+            store.driver.content = CONTENT + bytes([i])
+            await store.fetch(f"https://example.com/{i}", hashlib.md5(store.driver.content).hexdigest())
+        return store
+
+    store = asyncio.run(main())
+    on_disk = sum(f.stat().st_size for f in tmp_path.glob("*/*"))
+    assert store.stats()["used"] == on_disk <= len(CONTENT) * 2
@@ -0,0 +1,36 @@
+from nonebot.adapters.opqbot import Message, MessageSegment
+from nonebot.adapters.opqbot.models import MsgBody
+
+
+def build(content: str, *ats) -> Message:
+    return Message.build_message(MsgBody(
+        SubMsgType=0, Content=content, AtUinLists=[{"Nick": nick, "Uin": uin, "Uid": f"u_{uin}"} for nick, uin in ats],
+        Images=None, Video=None, Voice=None, File=None, RedBag=None,
+    ))
+
+
+def test_out_of_order_mentions():
+    message = build("@Bob hi @Alice", ("Alice", 1), ("Bob", 2))
+    assert list(message) == [MessageSegment.at(2), MessageSegment.text(" hi "), MessageSegment.at(1)]
+
+
+def test_repeated_nick_uses_uins_in_order_then_reuses_last():
+    message = build("@Tom @Tom @Tom", ("Tom", 1), ("Tom", 2))
+    assert [segment.data["uin"] for segment in message if segment.type == "at"] == [1, 2, 2]
+
+
+def test_longer_nick_wins():
+    message = build("@Tommy and @Tom.", ("Tom", 1), ("Tommy", 2))
+    assert list(message) == [
+        MessageSegment.at(2), MessageSegment.text(" and "), MessageSegment.at(1), MessageSegment.text("."),
+    ]
+
+
+def test_regex_metacharacters_in_nick():
+    message = build("hi @a.*(b)[c]+ and @a", ("a.*(b)[c]+", 1))
+    assert list(message) == [MessageSegment.text("hi "), MessageSegment.at(1), MessageSegment.text(" and @a")]
+
+
+def test_unknown_mentions_stay_text():
+    assert list(build("mail me@example.com", ("Tom", 1))) == [MessageSegment.text("mail me@example.com")]
+    assert list(build("@Tom")) == [MessageSegment.text("@Tom")]
@@ -0,0 +1,19 @@
+from nonebot.adapters.opqbot import metrics
+
+
+def test_counter_child_shares_the_labelled_value():
+    counter = metrics.Counter("test_total", "test", ["event_name"])
+    child = counter.labels(event_name="a")
+    child.value += 1
+    counter.inc(2, event_name="a")
+    assert counter.get(event_name="a") == 3
+    assert counter.labels(event_name="a") is child
+    assert 'test_total{event_name="a"} 3' in counter.render()
+
+
+def test_event_counters_are_cached():
+    received, parsed = metrics.event_counters("ON_EVENT_TEST")
+    assert metrics.event_counters("ON_EVENT_TEST") == (received, parsed)
+    before = metrics.events_received.get(event_name="ON_EVENT_TEST")
+    received.value += 1
+    assert metrics.events_received.get(event_name="ON_EVENT_TEST") == before + 1
@@ -0,0 +1,146 @@
+import asyncio
+from typing import List, Optional
+
+from nonebot.adapters.opqbot.ratelimit import OutboundScheduler, Priority, TokenBucket
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+
+def make_scheduler(clock: FakeClock, **limits) -> OutboundScheduler:
+    options = dict(bot_rate=100, bot_burst=100, group_rate=100, group_burst=100, user_rate=100, user_burst=100)
+    options.update(limits)
+    return OutboundScheduler(**options, clock=clock)
+
+
+def push(scheduler: OutboundScheduler, target, name: str, priority: Priority = Priority.NORMAL) -> None:
+    async def send() -> str:
+        return name
+
+    send.name = name
+    scheduler._enqueue(target, send, priority)
+
+
+def pull(scheduler: OutboundScheduler) -> Optional[str]:
+    """按调度顺序取出一个任务, 没有可发送的任务时返回 None"""
+    job, _ = scheduler._next_job()
+    if job is None:
+        return None
+    scheduler.pending -= 1
+    return job.func.name
+
+
+def pull_all(scheduler: OutboundScheduler) -> List[str]:
+    names = []
+    while (name := pull(scheduler)) is not None:
+        names.append(name)
+    return names
+
+
+def test_token_bucket_refills_with_the_clock():
+    bucket = TokenBucket(rate=2, burst=2, now=0)
+    bucket.consume(0)
+    bucket.consume(0)
+    assert bucket.wait_time(0) == 0.5
+    assert bucket.wait_time(0.25) == 0.25
+    assert bucket.wait_time(0.5) == 0
+    assert not bucket.full(0.5)
+    assert bucket.full(10)
+    assert bucket.tokens == 2  # 不会超过桶容量
+
+
+def test_higher_priority_is_sent_first():
+    async def main():
+        clock = FakeClock()
+        scheduler = make_scheduler(clock)
+        push(scheduler, ("group", 1), "low", Priority.LOW)
+        push(scheduler, ("group", 2), "normal", Priority.NORMAL)
+        push(scheduler, ("group", 3), "high", Priority.HIGH)
+        push(scheduler, ("group", 1), "reply", Priority.HIGH)
+        return pull_all(scheduler)
+
+    assert asyncio.run(main()) == ["high", "reply", "normal", "low"]
+
+
+def test_targets_take_turns_within_a_priority():
+    async def main():
+        clock = FakeClock()
+        scheduler = make_scheduler(clock)
+        for i in range(3):
+            push(scheduler, ("group", 1), f"a{i}")
+        push(scheduler, ("group", 2), "b0")
+        push(scheduler, ("user", 3), "c0")
+        return pull_all(scheduler)
+
+    # 群 1 先排了三条, 其它目标不需要等它发完
+    assert asyncio.run(main()) == ["a0", "b0", "c0", "a1", "a2"]
+
+
+def test_group_bucket_only_holds_back_that_group():
+    async def main():
+        clock = FakeClock()
+        scheduler = make_scheduler(clock, group_rate=1, group_burst=1)
+        push(scheduler, ("group", 1), "a0")
+        push(scheduler, ("group", 1), "a1")
+        push(scheduler, ("group", 2), "b0")
+        push(scheduler, ("group", 2), "b1")
+        first = pull_all(scheduler)
+        job, wait = scheduler._next_job()
+        clock.advance(0.5)
+        _, wait_later = scheduler._next_job()
+        clock.advance(0.5)
+        return first, job, wait, wait_later, pull_all(scheduler)
+
+    first, job, wait, wait_later, second = asyncio.run(main())
+    assert first == ["a0", "b0"]
+    assert job is None and wait == 1.0 and wait_later == 0.5
+    assert second == ["a1", "b1"]
+
+
+def test_bot_bucket_limits_all_targets():
+    async def main():
+        clock = FakeClock()
+        scheduler = make_scheduler(clock, bot_rate=2, bot_burst=2)
+        for i in range(3):
+            push(scheduler, ("group", i), f"g{i}")
+        first = pull_all(scheduler)
+        _, wait = scheduler._next_job()
+        clock.advance(wait)
+        return first, wait, pull_all(scheduler)
+
+    assert asyncio.run(main()) == (["g0", "g1"], 0.5, ["g2"])
+
+
+def test_submit_runs_jobs_in_schedule_order():
+    sent = []
+
+    async def send(name: str) -> str:
+        sent.append(name)
+        return name
+
+    async def main():
+        clock = FakeClock()
+        scheduler = make_scheduler(clock)
+        # 三个 submit 都在调度任务开始前入队
+        results = await asyncio.gather(
+            scheduler.submit(("group", 1), lambda: send("low"), Priority.LOW),
+            scheduler.submit(("group", 1), lambda: send("normal")),
+            scheduler.submit(("group", 2), lambda: send("high"), Priority.HIGH),
+        )
+        stats = scheduler.stats()
+        await scheduler.stop()
+        return results, stats
+
+    results, stats = asyncio.run(main())
+    assert results == ["low", "normal", "high"]
+    assert sent == ["high", "normal", "low"]
+    assert stats["sent"] == 3 and stats["pending"] == 0
+    assert stats["queued_time_max"] == 0  # 假时钟在发送前没有前进
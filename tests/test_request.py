@@ -0,0 +1,195 @@
+import asyncio
+import json
+from types import SimpleNamespace
+from typing import Dict, List, Union
+
+import pytest
+from nonebot.drivers import Request, Response
+
+from nonebot.adapters.opqbot import bot as bot_module, ratelimit
+from nonebot.adapters.opqbot.bot import Bot
+from nonebot.adapters.opqbot.cache import TTLCache
+from nonebot.adapters.opqbot.config import Config
+from nonebot.adapters.opqbot.directory import UidIndex
+from nonebot.adapters.opqbot.exception import ActionFailed, CircuitOpen, NetworkError, RateLimited
+from nonebot.adapters.opqbot.session import SessionPool
+
+URL = "http://127.0.0.1:8086"
+
+
+def ok(data=None) -> Response:
+    return reply(0, None, data)
+
+
+def reply(ret: int, errmsg, data=None) -> Response:
+    body = {"CgiBaseResponse": {"Ret": ret, "ErrMsg": errmsg}, "ResponseData": data}
+    return Response(200, content=json.dumps(body))
+
+
+class FakeDriver:
+    """按顺序返回预设的响应, 异常则直接抛出"""
+
+    def __init__(self, *results: Union[Response, Exception]):
+        self.results = list(results)
+        self.requests: List[Request] = []
+
+    async def request(self, setup: Request) -> Response:
+        self.requests.append(setup)
+        result = self.results.pop(0) if len(self.results) > 1 else self.results[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+def make_bot(driver: FakeDriver, **config) -> Bot:
+    adapter_config = Config(**{"url": "127.0.0.1:8086", "opq_api_retries": 2, "opq_circuit_failures": 3, **config})
+    adapter = SimpleNamespace(
+        adapter_config=adapter_config,
+        http_url=URL,
+        uid_index=UidIndex(16),
+        payload_cache=None,
+        forward_cache=None,
+        http_sessions=SessionPool(
+            driver, circuit_failures=adapter_config.opq_circuit_failures, circuit_reset=30
+        ),
+    )
+    return Bot(adapter, "10000")
+
+
+@pytest.fixture
+def sleeps(monkeypatch) -> List[float]:
+    """记录重试前的等待时间, 不真正等待"""
+    delays = []
+
+    async def fake_sleep(delay: float) -> None:
+        delays.append(delay)
+
+    monkeypatch.setattr(bot_module.asyncio, "sleep", fake_sleep)
+    return delays
+
+
+def test_read_command_is_retried_with_backoff(sleeps):
+    driver = FakeDriver(ConnectionError("reset"), ConnectionError("reset"), ok({"GroupLists": []}))
+    bot = make_bot(driver, opq_api_retry_backoff=0.2)
+    result = asyncio.run(bot.post(bot.build_request({}, cmd="GetGroupLists")))
+    assert result == {"GroupLists": []}
+    assert len(driver.requests) == 3
+    assert len(sleeps) == 2
+    assert 0.1 <= sleeps[0] <= 0.2 and 0.2 <= sleeps[1] <= 0.4
+
+
+def test_send_is_attempted_once(sleeps):
+    driver = FakeDriver(ConnectionError("reset"), ok())
+    bot = make_bot(driver)
+    with pytest.raises(NetworkError):
+        asyncio.run(bot.post(bot.build_request({"ToUin": 1, "ToType": 2}, cmd="MessageSvc.PbSendMsg")))
+    assert len(driver.requests) == 1
+    assert sleeps == []
+
+
+def test_nonzero_ret_raises_action_failed(sleeps):
+    driver = FakeDriver(reply(-1, "no permission"))
+    bot = make_bot(driver)
+    with pytest.raises(ActionFailed) as exc_info:
+        asyncio.run(bot.post(bot.build_request({}, cmd="GetGroupLists")))
+    assert not isinstance(exc_info.value, RateLimited)
+    assert len(driver.requests) == 1  # 业务错误不重试
+
+
+def test_rate_limit_response_raises_rate_limited(sleeps):
+    driver = FakeDriver(reply(-1, "发送频繁, 请稍后再试"))
+    bot = make_bot(driver)
+    with pytest.raises(RateLimited):
+        asyncio.run(bot.post(bot.build_request({"ToUin": 1, "ToType": 2}, cmd="MessageSvc.PbSendMsg")))
+    driver = FakeDriver(Response(429, content=""))
+    bot = make_bot(driver)
+    with pytest.raises(RateLimited):
+        asyncio.run(bot.post(bot.build_request({"ToUin": 1, "ToType": 2}, cmd="MessageSvc.PbSendMsg")))
+
+
+def test_breaker_opens_after_configured_failures(sleeps):
+    driver = FakeDriver(ConnectionError("down"))
+    bot = make_bot(driver, opq_circuit_failures=3)
+    request = bot.build_request({"ToUin": 1, "ToType": 2}, cmd="MessageSvc.PbSendMsg")
+    for _ in range(3):
+        with pytest.raises(NetworkError) as exc_info:
+            asyncio.run(bot.post(request))
+        assert not isinstance(exc_info.value, CircuitOpen)
+    with pytest.raises(CircuitOpen):
+        asyncio.run(bot.post(request))
+    assert len(driver.requests) == 3  # 熔断后不再发出请求
+
+
+def test_broadcast_is_paced_without_rate_limit(monkeypatch):
+    clock = SimpleNamespace(now=1000.0)
+    sent_at = []
+
+    async def fake_sleep(delay: float) -> None:
+        clock.now += delay
+
+    class TimedDriver(FakeDriver):
+        async def request(self, setup: Request) -> Response:
+            sent_at.append(clock.now - 1000.0)
+            return await super().request(setup)
+
+    monkeypatch.setattr(ratelimit, "time", SimpleNamespace(monotonic=lambda: clock.now))
+    monkeypatch.setattr(bot_module.asyncio, "sleep", fake_sleep)
+    bot = make_bot(TimedDriver(ok()), opq_rate_limit=False, opq_rate_bot=2, opq_rate_bot_burst=2)
+    results = asyncio.run(bot.broadcast("hello", group_ids=range(1, 6)))
+    assert all(result.success for result in results)
+    # 先发出突发的 2 条, 之后每 0.5 秒一条
+    assert sorted(sent_at) == [0, 0, 0.5, 1.0, 1.5]
+
+
+class ForwardDriver(FakeDriver):
+    """SsoUploadMultiMsg 依次返回 res0, res1 ..., 并记下每个 ResId 对应的 MsgBodys"""
+
+    def __init__(self):
+        super().__init__(ok())
+        self.uploads: Dict[str, List[dict]] = {}
+
+    async def request(self, setup: Request) -> Response:
+        self.requests.append(setup)
+        res_id = f"res{len(self.uploads)}"
+        self.uploads[res_id] = setup.json["CgiRequest"]["MsgBodys"]
+        return ok({"ResId": res_id})
+
+
+def unfold(driver: ForwardDriver, res_id: str) -> List[str]:
+    """把(可能多层嵌套的)聊天记录展开成原始消息文本"""
+    texts = []
+    for body in driver.uploads[res_id]:
+        if body.get("SubMsgType") == 51:
+            texts.extend(unfold(driver, json.loads(body["Content"])["meta"]["detail"]["resid"]))
+        else:
+            texts.append(body["Content"])
+    return texts
+
+
+def test_forward_over_chunk_size_is_nested_in_order():
+    driver = ForwardDriver()
+    bot = make_bot(driver, opq_forward_chunk_size=3)
+    messages = [f"m{i}" for i in range(10)]
+    card = json.loads(asyncio.run(bot.build_forward_msg(messages)))
+    # 10 条拆成 4 块, 4 张卡片再拆成 2 块, 最后合成 1 条
+    assert len(driver.uploads) == 4 + 2 + 1
+    assert all(len(bodys) <= 3 for bodys in driver.uploads.values())
+    detail = card["meta"]["detail"]
+    assert detail["summary"] == "查看10条转发消息"
+    assert unfold(driver, detail["resid"]) == messages
+
+
+def test_identical_forward_reuses_cached_res_id():
+    driver = ForwardDriver()
+    bot = make_bot(driver, opq_forward_chunk_size=3)
+    bot.adapter.forward_cache = cache = TTLCache(60, 16)
+    messages = [f"m{i}" for i in range(7)]
+    first = asyncio.run(bot.build_forward_msg(messages))
+    uploads = len(driver.uploads)
+    assert uploads == 3 + 1
+    second = asyncio.run(bot.build_forward_msg(messages))
+    assert second == first
+    assert len(driver.uploads) == uploads  # 每一块都命中缓存, 没有再次上传
+    assert cache.hits == uploads
+    asyncio.run(bot.build_forward_msg(messages[:-1] + ["changed"]))
+    assert len(driver.uploads) == uploads + 2  # 只有最后一块与外层需要重新上传